@@ -5,20 +5,29 @@ import gpmf.parse as gpmf_parse
 from gpmf.extract import get_gpmf_payloads_from_file
 import sys
 import numpy as np
-from matplotlib import pyplot as plt
 import cv2
+from video_info import probe_video
 
 class Extractor:
-    def __init__(self, videopath = "hero5.mp4"):
+    def __init__(self, videopath = "hero5.mp4", use_stream_timestamps = True):
+        """
+        Args:
+            videopath (string, optional): Path to the GoPro video. Defaults to "hero5.mp4".
+            use_stream_timestamps (bool, optional): Time samples with the STMP/TSMP stream
+                timestamps when every payload has them, instead of the payload time ranges. Defaults to True.
+        """
         self.videopath = videopath
+        self.use_stream_timestamps = use_stream_timestamps
 
-        payloads, parser = get_gpmf_payloads_from_file(videopath)
+        payloads, track = get_gpmf_payloads_from_file(videopath)
 
         self.parsed = []
-        print(payloads)
+        # Start and end of each payload in seconds
+        self.payload_times = []
 
         for gpmf_data, timestamps in payloads:
-            self.parsed.append(gpmf_parse.parse_dict(gpmf_data))
+            self.parsed.append(gpmf_parse.parse_dict_fast(gpmf_data))
+            self.payload_times.append((timestamps[0] / track.timescale, timestamps[1] / track.timescale))
 
 
         self.video_length = 0 # video length in seconds
@@ -35,40 +44,83 @@ class Extractor:
 
     def find_video_length(self):
         
-        #find video length using openCV
-        video = cv2.VideoCapture(self.videopath)
-        num_frames = video.get(cv2.CAP_PROP_FRAME_COUNT)
-        self.fps = video.get(cv2.CAP_PROP_FPS)
-        self.video_length =  num_frames / self.fps
+        # find video length from the shared probe, which is cached per file
+        info = probe_video(self.videopath)
+        self.fps = info.fps
+        self.video_length = info.duration
         print("Video length: {} s, framerate: {} FPS".format(self.video_length,self.fps))
 
-        self.size = int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.size = info.width, info.height
 
-        video.release()
+    def get_stream_samples(self, key):
+        """Collect the samples of a sensor stream with a timestamp for every sample
 
-    def parse_gyro(self):
-        for frame in self.parsed:
+        Samples are spread evenly over their payload time range. With stream timestamps,
+        each payload starts at its STMP and the sample period comes from the STMP
+        difference to the next payload, divided by the TSMP sample count when present,
+        so dropped payloads and rate changes don't accumulate as clock drift.
+
+        Args:
+            key (string): Stream key, e.g. "GYRO"
+
+        Returns:
+            (np.ndarray, np.ndarray, float): Sample times in seconds, raw samples and the stream scale
+        """
+        blocks = []
+        scal = 0
+        for frame, (start, end) in zip(self.parsed, self.payload_times):
             for stream in frame["DEVC"]["STRM"]:
-                if "GYRO" in stream:
-                    #print(stream["STNM"]) # print stream name
-                    self.gyro += stream["GYRO"]
-                    
+                if key in stream:
+                    blocks.append((start, end, np.atleast_2d(stream[key]), stream.get("STMP"), stream.get("TSMP")))
+
                     # Calibration scale shouldn't change
-                    self.gyro_scal = stream["SCAL"]
-                    #print(self.gyro_scal)
-        
-        
+                    scal = stream["SCAL"]
+
+        if not blocks:
+            return np.zeros(0), np.zeros((0, 3)), 1
+
+        counts = np.array([len(block[2]) for block in blocks])
+        starts = np.array([block[0] for block in blocks])
+        periods = np.array([(block[1] - block[0]) for block in blocks]) / counts
+
+        stmp = [block[3] for block in blocks]
+        tsmp = [block[4] for block in blocks]
+        if self.use_stream_timestamps and len(blocks) > 1 and all(isinstance(t, int) for t in stmp):
+            stmp = np.array(stmp, dtype=np.float64) / 1000000
+            # Samples from the first sample of each payload to the first one of the next
+            generated = counts[:-1]
+            if all(isinstance(t, int) for t in tsmp):
+                # Total sample counter, includes samples that were never delivered
+                generated = np.diff(np.array(tsmp) - counts)
+
+            if np.all(np.diff(stmp) > 0) and np.all(generated > 0):
+                stream_periods = np.diff(stmp) / generated
+                periods = np.append(stream_periods, stream_periods[-1])
+                # Keep the first payload on the video clock
+                starts = starts[0] + stmp - stmp[0]
+            else:
+                print("{} stream timestamps are not increasing, using payload times".format(key))
+
+        first_samples = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sample_index = np.arange(counts.sum()) - np.repeat(first_samples, counts)
+        times = np.repeat(starts, counts) + sample_index * np.repeat(periods, counts)
+
+        return times, np.concatenate([block[2] for block in blocks]), scal
+
+    def parse_gyro(self):
+        times, self.gyro, self.gyro_scal = self.get_stream_samples("GYRO")
+
         # Convert to angular vel. vector in rad/s
-        omega = np.array(self.gyro) / self.gyro_scal
+        omega = self.gyro / self.gyro_scal
         self.num_gyro_samples = omega.shape[0]
 
 
-        self.gyro_rate = self.num_gyro_samples / self.video_length 
+        self.gyro_rate = (self.num_gyro_samples - 1) / (times[-1] - times[0])
         print("Gyro rate: {} Hz, should be close to 200 or 400 Hz".format(self.gyro_rate))
 
 
         self.parsed_gyro = np.zeros((self.num_gyro_samples, 4))
-        self.parsed_gyro[:,0] = np.arange(self.num_gyro_samples) * 1/self.gyro_rate
+        self.parsed_gyro[:,0] = times
 
         # Data order for gopro gyro is (z,x,y)
         self.parsed_gyro[:,3] = omega[:,0] # z
@@ -76,27 +128,18 @@ class Extractor:
         self.parsed_gyro[:,2] = omega[:,2] # y
         
     def parse_accl(self):
-        for frame in self.parsed:
-            for stream in frame["DEVC"]["STRM"]:
-                if "ACCL" in stream:
-                    #print(stream["STNM"]) # print stream name
-                    self.accl += stream["ACCL"]
-                    
-                    # Calibration scale shouldn't change
-                    self.accl_scal = stream["SCAL"]
-                    #print(self.accl_scal)
-        
+        times, self.accl, self.accl_scal = self.get_stream_samples("ACCL")
         
         # Convert to angular vel. vector in rad/s ??
-        omega = np.array(self.accl) / self.accl_scal
+        omega = self.accl / self.accl_scal
         self.num_accl_samples = omega.shape[0]
 
-        self.accl_rate = self.num_accl_samples / self.video_length 
+        self.accl_rate = (self.num_accl_samples - 1) / (times[-1] - times[0])
         print("Accl rate: {} Hz, should be close to 200 or 400 Hz".format(self.accl_rate))
 
 
         self.parsed_accl = np.zeros((self.num_accl_samples, 4))
-        self.parsed_accl[:,0] = np.arange(self.num_accl_samples) * 1/self.accl_rate
+        self.parsed_accl[:,0] = times
 
         # Data order for gopro gyro is (z,x,y)
         self.parsed_accl[:,3] = omega[:,0] # z
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import platform
+import tempfile
+import zipfile
+
+import numpy as np
+
+
+def get_cache_dir():
+    """Get the per-user cache directory for gyroflow
+
+    Returns:
+        string: Path of the cache directory, not necessarily existing yet
+    """
+    system = platform.system()
+    if system == "Windows":
+        base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), "AppData", "Local")
+    elif system == "Darwin":
+        base = os.path.join(os.path.expanduser("~"), "Library", "Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(base, "gyroflow")
+
+
+def video_fingerprint(videopath, chunk_size = 1 << 20):
+    """Fast content hash of a video file
+
+    Only the file size and three chunks at the start, middle and end are hashed,
+    which is enough to tell recordings apart without reading gigabytes of video.
+
+    Args:
+        videopath (string): Path to the video file
+        chunk_size (int, optional): Bytes hashed at each position. Defaults to 1 MiB.
+
+    Returns:
+        string: Hex digest
+    """
+    size = os.path.getsize(videopath)
+    digest = hashlib.sha1(str(size).encode())
+
+    with open(videopath, "rb") as f:
+        for position in sorted({0, max(0, size // 2 - chunk_size // 2), max(0, size - chunk_size)}):
+            f.seek(position)
+            digest.update(f.read(chunk_size))
+
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """Content addressed on-disk cache of arrays with a size bound
+
+    Entries are stored as .npz files named by the hash of their key. Reading an
+    entry refreshes its modification time, and the least recently used entries
+    are removed once the cache grows beyond max_size.
+    """
+    def __init__(self, cache_dir = None, max_size = 512 * 1024 * 1024):
+        """
+        Args:
+            cache_dir (string, optional): Directory for the entries. Defaults to optical_flow in the user cache dir.
+            max_size (int, optional): Size bound in bytes. Defaults to 512 MiB.
+        """
+        self.cache_dir = cache_dir or os.path.join(get_cache_dir(), "optical_flow")
+        self.max_size = max_size
+
+    def make_key(self, **parts):
+        """Hash the parts describing an entry
+
+        Args:
+            **parts: JSON serializable values
+
+        Returns:
+            string: Hex digest used as file name
+        """
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def load(self, key):
+        """Load an entry
+
+        Args:
+            key (string): Entry key from make_key
+
+        Returns:
+            dict: Arrays of the entry, or None if it is not cached
+        """
+        path = self.get_path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile) as e:
+            if os.path.exists(path):
+                print("Removing unreadable cache entry {}: {}".format(path, e))
+                os.remove(path)
+            return None
+
+        return arrays
+
+    def save(self, key, **arrays):
+        """Store an entry and evict old entries if needed
+
+        Args:
+            key (string): Entry key from make_key
+            **arrays: Arrays of the entry
+        """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first so concurrent readers never see partial entries
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self.get_path(key))
+        except OSError as e:
+            print("Could not write analysis cache: {}".format(e))
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_size
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,408 @@
+"""Headless batch stabilization
+
+Runs sync and render for a list of jobs on a process pool without importing Qt
+or matplotlib. Usage:
+
+    python -m gyroflow batch jobs.json [--workers N] [--restart]
+
+The jobs file is either a list of jobs or an object with "jobs", "defaults"
+and "workers". Each job has a "video", a calibration "preset", an optional gyro
+"log" with "log_type", an "output" path and "settings" overriding the defaults.
+Relative paths are resolved against the directory of the jobs file.
+
+Progress is written to stdout as one JSON object per line. Finished jobs are
+recorded in a state file next to the jobs file, so an interrupted batch picks
+up where it stopped when run again.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+DEFAULT_SETTINGS = {
+    "hero": 8,
+    "fov": 1.5,
+    # Smoothness time constant in seconds
+    "smoothness": 0.24,
+    "gyro_lpf": -1,
+    "uptilt": 0,
+    "initial_offset": 0,
+    "sync_search_size": 10,
+    # Sync points in seconds. sync2 defaults to 5 seconds before the end
+    "sync1": 5,
+    "sync2": None,
+    "slice_length": 60,
+    "sync_slices": 2,
+    "piecewise_drift": False,
+    # Export range in seconds, stop defaults to the end of the video
+    "start": 0,
+    "stop": None,
+    # Output crop, defaults to the video size
+    "out_size": None,
+    "scale": 1,
+    "split_screen": False,
+    "bitrate": 20,
+    "vcodec": "libx264",
+    "vprofile": "high",
+    "pix_fmt": "",
+    "debug_text": False,
+    "custom_ffmpeg": "",
+    "mesh_grid": None,
+    "render_workers": 1,
+}
+
+LOG_TYPES = ["gpmf", "insta", "rawblackbox", "csvblackbox", "csvgyroflow"]
+
+
+def emit(event, **fields):
+    """Write a progress event as a JSON line to stdout
+
+    Args:
+        event (string): Event name
+        **fields: Event data
+    """
+    record = {"event": event, "time": round(time.time(), 3)}
+    record.update(fields)
+    sys.stdout.write(json.dumps(record) + "\n")
+    sys.stdout.flush()
+
+
+def load_jobs(jobspath):
+    """Read and validate a jobs file
+
+    Args:
+        jobspath (string): Path to the JSON jobs file
+
+    Returns:
+        (list, int): Jobs with absolute paths and merged settings, and the number of
+            workers given in the file or None
+    """
+    with open(jobspath) as f:
+        spec = json.load(f)
+
+    if isinstance(spec, list):
+        spec = {"jobs": spec}
+
+    base_dir = os.path.dirname(os.path.abspath(jobspath))
+    def resolve(path):
+        return path if not path else os.path.normpath(os.path.join(base_dir, os.path.expanduser(path)))
+
+    defaults = dict(DEFAULT_SETTINGS, **spec.get("defaults", {}))
+
+    jobs = []
+    seen_ids = set()
+    for i, entry in enumerate(spec.get("jobs", [])):
+        if "video" not in entry or "preset" not in entry:
+            raise ValueError("Job {} needs a video and a preset".format(i))
+
+        video = resolve(entry["video"])
+        log = resolve(entry.get("log", ""))
+        log_type = entry.get("log_type") or guess_log_type(log)
+        if log_type not in LOG_TYPES:
+            raise ValueError("Job {}: unknown log type {}, use one of {}".format(i, log_type, ", ".join(LOG_TYPES)))
+        if log_type != "gpmf" and not log:
+            raise ValueError("Job {}: log type {} needs a log".format(i, log_type))
+
+        unknown = set(entry.get("settings", {})) - set(DEFAULT_SETTINGS)
+        if unknown:
+            raise ValueError("Job {}: unknown settings {}".format(i, ", ".join(sorted(unknown))))
+
+        job_id = str(entry.get("id") or os.path.splitext(os.path.basename(video))[0])
+        if job_id in seen_ids:
+            raise ValueError("Duplicate job id {}, set an explicit id".format(job_id))
+        seen_ids.add(job_id)
+
+        jobs.append({
+            "id": job_id,
+            "video": video,
+            "preset": resolve(entry["preset"]),
+            "log": log,
+            "log_type": log_type,
+            "output": resolve(entry.get("output") or os.path.splitext(video)[0] + "_stabilized.mp4"),
+            "settings": dict(defaults, **entry.get("settings", {})),
+        })
+
+    return jobs, spec.get("workers")
+
+
+def guess_log_type(logpath):
+    """Guess the log type from the file name like the GUI does
+
+    Args:
+        logpath (string): Gyro log path, empty for GoPro metadata
+
+    Returns:
+        string: Log type
+    """
+    if not logpath:
+        return "gpmf"
+    if logpath.lower().endswith(".csv"):
+        return "csvblackbox"
+    return "rawblackbox"
+
+
+def get_partial_path(outpath):
+    """Path the output is rendered to before it is complete, keeping the container extension"""
+    root, extension = os.path.splitext(outpath)
+    return root + ".partial" + (extension or ".mp4")
+
+
+def read_state(statepath):
+    """Read the finished jobs from the state file
+
+    Args:
+        statepath (string): JSON lines state file
+
+    Returns:
+        dict: Last record of each finished job by id
+    """
+    finished = {}
+    if not os.path.isfile(statepath):
+        return finished
+
+    with open(statepath) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Truncated by an interruption
+                continue
+            if record.get("status") == "done":
+                finished[record["job"]] = record
+    return finished
+
+
+def append_state(statepath, record):
+    with open(statepath, "a") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def create_stabilizer(job):
+    """Construct the stabilizer for a job, mirroring the GUI
+
+    Args:
+        job (dict): Job from load_jobs
+
+    Returns:
+        Stabilizer: Stabilizer with gyro data loaded
+    """
+    # Imported here so the parent process never loads the processing stack
+    import stabilizer
+
+    settings = job["settings"]
+    log_type = job["log_type"]
+
+    if log_type == "gpmf":
+        stab = stabilizer.GPMFStabilizer(job["video"], job["preset"], hero=settings["hero"], fov_scale=settings["fov"],
+                                         gyro_lpf_cutoff=settings["gyro_lpf"])
+    elif log_type == "insta":
+        stab = stabilizer.InstaStabilizer(job["video"], job["preset"], job["log"], fov_scale=settings["fov"],
+                                          gyro_lpf_cutoff=settings["gyro_lpf"])
+    else:
+        stab = stabilizer.BBLStabilizer(job["video"], job["preset"], job["log"], fov_scale=settings["fov"],
+                                        cam_angle_degrees=settings["uptilt"], use_csv=log_type == "csvblackbox",
+                                        gyro_lpf_cutoff=settings["gyro_lpf"],
+                                        logtype="gyroflow" if log_type == "csvgyroflow" else "")
+
+    stab.set_initial_offset(settings["initial_offset"])
+    stab.set_rough_search(settings["sync_search_size"])
+    return stab
+
+
+def run_job(job, events, log_dir, threads = None):
+    """Sync and render one job in a worker process
+
+    Everything the processing stack and ffmpeg print goes to the job log, so only
+    the parent writes to stdout.
+
+    Args:
+        job (dict): Job from load_jobs
+        events (queue.Queue): Manager queue receiving (event, fields) progress tuples
+        log_dir (string): Directory for the job logs
+        threads (int, optional): Optical flow threads of this job. None uses the CPU count.
+
+    Returns:
+        dict: Sync result of the job
+    """
+    logpath = os.path.join(log_dir, job["id"] + ".log")
+    # Line buffered, so prints and ffmpeg output stay in order
+    with open(logpath, "w", buffering=1) as log, redirect_output(log):
+        def stage(name, **fields):
+            print("=== {} ===".format(name))
+            events.put(("stage", dict(job=job["id"], stage=name, **fields)))
+
+        settings = job["settings"]
+
+        stage("load")
+        stab = create_stabilizer(job)
+        # The jobs running in parallel share the CPUs
+        stab.set_analysis_workers(threads)
+        try:
+            duration = stab.num_frames / stab.fps
+            slice_length = settings["slice_length"]
+
+            stage("sync")
+            if settings["sync_slices"] > 2:
+                stab.multi_sync_stab(settings["smoothness"], settings["sync_slices"], slice_length,
+                                     piecewise=settings["piecewise_drift"], debug_plots=False)
+            else:
+                sync2 = settings["sync2"] if settings["sync2"] is not None else int(duration - 5)
+                stab.auto_sync_stab(settings["smoothness"], int(settings["sync1"] * stab.fps), int(sync2 * stab.fps),
+                                    slice_length, debug_plots=False)
+            stage("synced", d1=float(stab.d1), d2=float(stab.d2))
+
+            stop = settings["stop"] if settings["stop"] is not None else duration
+            out_size = tuple(settings["out_size"] or (stab.width, stab.height))
+            mesh_grid = tuple(settings["mesh_grid"]) if settings["mesh_grid"] else None
+
+            stage("render", start=settings["start"], stop=stop)
+            partial_path = get_partial_path(job["output"])
+            stab.renderfile(settings["start"], stop, partial_path, out_size=out_size,
+                            split_screen=settings["split_screen"], bitrate_mbits=settings["bitrate"],
+                            display_preview=False, scale=settings["scale"], vcodec=settings["vcodec"],
+                            vprofile=settings["vprofile"], pix_fmt=settings["pix_fmt"],
+                            debug_text=settings["debug_text"], custom_ffmpeg=settings["custom_ffmpeg"],
+                            mesh_grid=mesh_grid, workers=settings["render_workers"],
+                            # Pool workers are daemonic on Python 3.7 and 3.8 and can't start a segment pool
+                            segments=1)
+            os.replace(partial_path, job["output"])
+        finally:
+            stab.release()
+
+    return {"d1": float(stab.d1), "d2": float(stab.d2)}
+
+
+@contextlib.contextmanager
+def redirect_output(f):
+    """Point stdout and stderr of this process, including child processes, at a file"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    os.dup2(f.fileno(), 1)
+    os.dup2(f.fileno(), 2)
+    try:
+        with contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+            yield
+    finally:
+        f.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        os.close(saved[0])
+        os.close(saved[1])
+
+
+def run_batch(jobs, statepath, log_dir, workers = None, restart = False, retries = 0):
+    """Run jobs on a process pool, skipping the ones finished in an earlier run
+
+    Args:
+        jobs (list): Jobs from load_jobs
+        statepath (string): JSON lines file recording finished jobs
+        log_dir (string): Directory for the job logs
+        workers (int, optional): Size of the process pool. None uses the CPU count.
+        restart (bool, optional): Ignore the state file and run all jobs. Defaults to False.
+        retries (int, optional): Number of times a failed job is run again. Defaults to 0.
+
+    Returns:
+        int: Number of failed jobs
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    if restart and os.path.exists(statepath):
+        os.remove(statepath)
+    finished = read_state(statepath)
+
+    pending = []
+    for job in jobs:
+        record = finished.get(job["id"])
+        if record and record.get("output") == job["output"] and os.path.isfile(job["output"]):
+            emit("skipped", job=job["id"], output=job["output"])
+        else:
+            pending.append(job)
+
+    workers = workers or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // max(1, min(workers, len(pending))))
+    emit("batch_start", jobs=len(jobs), pending=len(pending), workers=workers)
+    failed = 0
+
+    with multiprocessing.Manager() as manager:
+        events = manager.Queue()
+
+        def drain_events():
+            while not events.empty():
+                event, fields = events.get()
+                emit(event, **fields)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            def submit(job):
+                emit("queued", job=job["id"], video=job["video"])
+                return pool.submit(run_job, job, events, log_dir, threads)
+
+            attempts = {job["id"]: 0 for job in pending}
+            running = {submit(job): job for job in pending}
+            while running:
+                done, _ = concurrent.futures.wait(running, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+                drain_events()
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if attempts[job["id"]] < retries:
+                            attempts[job["id"]] += 1
+                            emit("retry", job=job["id"], error=str(e), attempt=attempts[job["id"]])
+                            running[submit(job)] = job
+                            continue
+                        failed += 1
+                        emit("failed", job=job["id"], error=str(e),
+                             traceback="".join(traceback.format_exception(type(e), e, e.__traceback__)),
+                             log=os.path.join(log_dir, job["id"] + ".log"))
+                        continue
+
+                    append_state(statepath, dict(job=job["id"], status="done", output=job["output"], **result))
+                    emit("done", job=job["id"], output=job["output"], **result)
+
+        drain_events()
+
+    emit("batch_done", jobs=len(jobs), failed=failed)
+    return failed
+
+
+def main(argv = None):
+    """Command line entry point of the batch mode
+
+    Args:
+        argv (list, optional): Arguments after "batch". Defaults to sys.argv[1:].
+
+    Returns:
+        int: Exit code, 1 if any job failed
+    """
+    parser = argparse.ArgumentParser(prog="gyroflow batch", description="Headless batch stabilization")
+    parser.add_argument("jobs", help="JSON jobs file")
+    parser.add_argument("--workers", type=int, default=None, help="Jobs processed in parallel, defaults to the CPU count")
+    parser.add_argument("--state", default=None, help="State file for resuming, defaults to <jobs>.state.jsonl")
+    parser.add_argument("--logs", default=None, help="Directory for job logs, defaults to <jobs>.logs")
+    parser.add_argument("--restart", action="store_true", help="Run all jobs again instead of resuming")
+    parser.add_argument("--retries", type=int, default=0, help="Times a failed job is run again")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs, file_workers = load_jobs(args.jobs)
+    except (OSError, ValueError) as e:
+        emit("error", error=str(e))
+        return 2
+
+    root = os.path.splitext(os.path.abspath(args.jobs))[0]
+    failed = run_batch(jobs, args.state or root + ".state.jsonl", args.logs or root + ".logs",
+                       workers=args.workers or file_workers, restart=args.restart, retries=args.retries)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,6 @@
 from orangebox import Parser
 from scipy.spatial.transform import Rotation
-import math
+import operator
 import numpy as np
 
 class BlackboxExtractor:
@@ -22,46 +22,72 @@ class BlackboxExtractor:
             return np.array(self.final_gyro_data)
         
         self.camera_angle = cam_angle_degrees
-        r  = Rotation.from_euler('x', self.camera_angle, degrees=True)
-        
+
+        chunks = [chunk for _, chunk in self.iter_gyro_chunks(cam_angle_degrees)]
+        self.final_gyro_data = np.concatenate(chunks) if chunks else np.zeros((0, 4))
+
+
+        # rough gyro rate assumed to be constant
+        self.gyro_rate = self.final_gyro_data.shape[0]/(self.final_gyro_data[-1,0] - self.final_gyro_data[0,0])
+
+
+        self.extracted = True
+
+        return self.final_gyro_data
+
+    def iter_gyro_chunks(self, cam_angle_degrees=0, chunk_size=65536):
+        """Stream the gyro data of all logs in the file
+
+        Frame fields are gathered into a preallocated array, and unit conversion
+        and camera rotation are applied to a whole chunk at once. Peak memory is
+        set by chunk_size, not by the flight length.
+
+        Args:
+            cam_angle_degrees (float, optional): Camera uptilt rotation around x. Defaults to 0.
+            chunk_size (int, optional): Frames per chunk. Defaults to 65536.
+
+        Yields:
+            (int, np.ndarray): Log index and Nx4 array of [time, gyroX, gyroY, gyroZ] in seconds and rad/s
+        """
+        rotation = Rotation.from_euler('x', cam_angle_degrees, degrees=True).as_matrix()
+
         for lg in range(1,self.n_of_logs+1):
             self.parser.set_log_index(lg)
             t  = self.parser.field_names.index('time')
             gx = self.parser.field_names.index('gyroADC[1]')
             gy = self.parser.field_names.index('gyroADC[2]')
             gz = self.parser.field_names.index('gyroADC[0]')
-            data_frames = []
-            
+            get_fields = operator.itemgetter(t, gx, gy, gz)
+
+            raw = np.empty((chunk_size, 4))
+            n = 0
             for frame in self.parser.frames():
-                to_rotate = [-math.radians(frame.data[gx]),
-                             math.radians(frame.data[gy]),
-                             -math.radians(frame.data[gz])]
-                
-                rotated = r.apply(to_rotate)
-                
-                f = [frame.data[t]/1000000,
-                     rotated[0],
-                     rotated[1],
-                     rotated[2]]
-                #f = [frame.data[t]/1000000,
-                #     math.radians(frame.data[gx]),
-                #     math.radians(frame.data[gz]),
-                #     -math.radians(frame.data[gy])]
-                data_frames.append(f)
-                
-            self.final_gyro_data.extend(data_frames)
-
-
-        self.final_gyro_data = np.array(self.final_gyro_data)
+                raw[n] = get_fields(frame.data)
+                n += 1
+                if n == chunk_size:
+                    yield lg, self.convert_gyro_chunk(raw, rotation)
+                    n = 0
 
+            if n > 0:
+                yield lg, self.convert_gyro_chunk(raw[:n], rotation)
 
-        # rough gyro rate assumed to be constant
-        self.gyro_rate = self.final_gyro_data.shape[0]/(self.final_gyro_data[-1,0] - self.final_gyro_data[0,0])
+    def convert_gyro_chunk(self, raw, rotation):
+        """Convert raw [time, gx, gy, gz] frame fields to seconds and rotated rad/s
 
+        Args:
+            raw (np.ndarray): Nx4 raw fields, time in microseconds and rates in degrees/s
+            rotation (np.ndarray): 3x3 camera angle rotation matrix
 
-        self.extracted = True
+        Returns:
+            np.ndarray: Nx4 array of [time, gyroX, gyroY, gyroZ]
+        """
+        to_rotate = np.radians(np.column_stack((-raw[:,1], raw[:,2], -raw[:,3])))
 
-        return self.final_gyro_data
+        gyro_data = np.empty(raw.shape)
+        gyro_data[:,0] = raw[:,0]/1000000
+        gyro_data[:,1:] = to_rotate @ rotation.T
+
+        return gyro_data
 
 
 
@@ -3,12 +3,11 @@ from datetime import date
 import numpy as np
 import cv2
 from _version import __version__
-from tkinter import Tk
-from tkinter.filedialog import askopenfilename
 
 from scipy.spatial.transform import Rotation
 
 import sys
+import threading
 
 # https://www.imatest.com/support/docs/pre-5-2/geometric-calibration/projective-camera
 def inverse_cam_mtx(K):
@@ -75,6 +74,9 @@ class FisheyeCalibrator:
 
         self.data_from_preset_file = False
 
+        # Precomputed ray grid and buffers for get_rotation_maps
+        self.rotation_map_cache = None
+
 
 
     def add_calib_image(self, img):
@@ -284,6 +286,209 @@ class FisheyeCalibrator:
 
         return map1, map2
 
+    def prepare_rotation_maps(self, fov_scale = 1.0, new_img_dim = None, lut_size = 16385):
+        """Precompute the undistorted ray grid used by get_rotation_maps.
+
+        Every output pixel is turned into a unit ray through the virtual camera once.
+        The fisheye projection only depends on the angle to the optical axis, so it is
+        stored as a 1D lookup table over cos(theta).
+
+        Args:
+            fov_scale (float, optional): Virtual camera focal length divider. Defaults to 1.
+            new_img_dim (tuple, optional): Dimension of new image
+            lut_size (int, optional): Number of entries in the projection lookup table. Defaults to 16385.
+        """
+
+        img_dim = tuple(int(d) for d in (new_img_dim if new_img_dim else self.calib_dimension))
+
+        scaled_K = self.K * img_dim[0] / self.calib_dimension[0]
+        scaled_K[2][2] = 1.0
+
+        new_K = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(scaled_K, self.D,
+                img_dim, np.eye(3), fov_scale=fov_scale)
+
+        width, height = img_dim
+        inv_new_K = np.linalg.inv(new_K)
+
+        rays = np.empty((height, width, 3), dtype=np.float32)
+        rays[:,:,0] = (inv_new_K[0,0] * np.arange(width) + inv_new_K[0,2])[np.newaxis,:] + (inv_new_K[0,1] * np.arange(height))[:,np.newaxis]
+        rays[:,:,1] = (inv_new_K[1,1] * np.arange(height) + inv_new_K[1,2])[:,np.newaxis]
+        rays[:,:,2] = 1
+        rays /= np.sqrt(np.sum(np.square(rays), axis=2, keepdims=True))
+
+        # theta_d/sin(theta) as a function of cos(theta). The odd table size puts a node exactly at
+        # cos(theta) = 0 so rays behind the camera can map far outside the image without bleeding forward
+        D = self.D.flatten()
+        cos_theta = np.linspace(-1, 1, lut_size)
+        theta = np.arccos(cos_theta)
+        theta2 = theta * theta
+        theta_d = theta * (1 + theta2 * (D[0] + theta2 * (D[1] + theta2 * (D[2] + theta2 * D[3]))))
+        sin_theta = np.sin(theta)
+        lut = np.ones(lut_size)
+        np.divide(theta_d, sin_theta, out=lut, where=sin_theta > 1e-12)
+        lut[cos_theta < 0] = 1e6
+
+        self.rotation_map_cache = {
+            "key": (img_dim, fov_scale),
+            "scaled_K": scaled_K,
+            "new_K": new_K,
+            "rays": rays,
+            "lut": lut.astype(np.float32).reshape(1, -1),
+            "lut_scale": (lut_size - 1) / 2,
+            "lut_row": np.zeros((height, width), dtype=np.float32),
+            # Freed with the thread, so the warp threads of each render don't accumulate buffers
+            "buffers": threading.local(),
+        }
+
+    def get_rotation_maps(self, fov_scale = 1.0, new_img_dim = None, quat = None):
+        """Get undistortion maps for a rotated virtual camera.
+
+        Same result as get_maps, but reuses the ray grid from prepare_rotation_maps so
+        only a rotation and the distortion lookup run per call. The returned float32
+        maps are reused buffers which are overwritten by the next call from the same
+        thread, so concurrent renders need one thread per frame in flight.
+
+        Args:
+            fov_scale (float, optional): Virtual camera focal length divider. Defaults to 1.
+            new_img_dim (tuple, optional): Dimension of new image
+            quat (np.ndarray, optional): Orientation of the virtual camera
+
+        Returns:
+            (np.ndarray,np.ndarray): Undistortion maps
+        """
+
+        img_dim = tuple(int(d) for d in (new_img_dim if new_img_dim else self.calib_dimension))
+
+        cache = self.rotation_map_cache
+        if cache is None or cache["key"] != (img_dim, fov_scale):
+            self.prepare_rotation_maps(fov_scale, img_dim)
+            cache = self.rotation_map_cache
+
+        R = np.eye(3)
+
+        if type(quat) != type(None):
+            quat = quat.flatten()
+            R = Rotation([-quat[1],-quat[2],quat[3],-quat[0]]).as_matrix()
+
+        # Rays in the original camera frame are R^T * ray
+        Rt = R.T
+        K = cache["scaled_K"]
+        a = cache["lut_scale"]
+
+        # Scratch and output buffers are kept per thread
+        buffers = getattr(cache["buffers"], "maps", None)
+        if buffers is None:
+            buffers = [np.empty(cache["lut_row"].shape, dtype=np.float32) for _ in range(4)]
+            cache["buffers"].maps = buffers
+        lut_coord, projection, map1, map2 = buffers
+
+        cv2.transform(cache["rays"], np.append(Rt[2] * a, a).reshape(1, 4), dst=lut_coord)
+        cv2.remap(cache["lut"], lut_coord, cache["lut_row"], cv2.INTER_LINEAR,
+                  dst=projection, borderMode=cv2.BORDER_REPLICATE)
+
+        cv2.transform(cache["rays"], np.append(K[0,0] * Rt[0] + K[0,1] * Rt[1], 0).reshape(1, 4), dst=map1)
+        cv2.transform(cache["rays"], np.append(K[1,1] * Rt[1], 0).reshape(1, 4), dst=map2)
+        cv2.multiply(map1, projection, dst=map1)
+        cv2.add(map1, float(K[0,2]), dst=map1)
+        cv2.multiply(map2, projection, dst=map2)
+        cv2.add(map2, float(K[1,2]), dst=map2)
+
+        return map1, map2
+
+    def get_mesh_maps(self, fov_scale = 1.0, new_img_dim = None, quat = None, grid_size = (64, 36)):
+        """Get undistortion maps for a rotated virtual camera from a sparse mesh.
+
+        The exact mapping is only evaluated on a coarse grid of vertices, which is
+        upsampled to full resolution with bilinear cv2.resize. The grid extends one
+        cell past the image borders so edge pixels are interpolated as well.
+
+        Args:
+            fov_scale (float, optional): Virtual camera focal length divider. Defaults to 1.
+            new_img_dim (tuple, optional): Dimension of new image
+            quat (np.ndarray, optional): Orientation of the virtual camera
+            grid_size (tuple, optional): Approximate number of mesh vertices (x, y). Defaults to (64, 36).
+
+        Returns:
+            (np.ndarray,np.ndarray): Undistortion maps
+        """
+
+        img_dim = tuple(int(d) for d in (new_img_dim if new_img_dim else self.calib_dimension))
+        width, height = img_dim
+
+        scaled_K = self.K * img_dim[0] / self.calib_dimension[0]
+        scaled_K[2][2] = 1.0
+
+        new_K = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(scaled_K, self.D,
+                img_dim, np.eye(3), fov_scale=fov_scale)
+
+        R = np.eye(3)
+
+        if type(quat) != type(None):
+            quat = quat.flatten()
+            R = Rotation([-quat[1],-quat[2],quat[3],-quat[0]]).as_matrix()
+
+        # Integer cell size in pixels so cv2.resize hits the vertices exactly.
+        # Vertex k sits at pixel (k - 0.5) * step - 0.5 of the output image
+        step_x = max(1, int(np.ceil(width / max(1, grid_size[0] - 1))))
+        step_y = max(1, int(np.ceil(height / max(1, grid_size[1] - 1))))
+        num_x = int(np.ceil((width - 0.5) / step_x + 1.5))
+        num_y = int(np.ceil((height - 0.5) / step_y + 1.5))
+
+        xs = (np.arange(num_x) - 0.5) * step_x - 0.5
+        ys = (np.arange(num_y) - 0.5) * step_y - 0.5
+        grid_x, grid_y = np.meshgrid(xs, ys)
+        points = np.stack((grid_x, grid_y, np.ones_like(grid_x)), axis=-1)
+
+        # Rays in the original camera frame are R^T * inv(new_K) * p
+        rays = points @ (R.T @ np.linalg.inv(new_K)).T
+
+        r = np.hypot(rays[:,:,0], rays[:,:,1])
+        theta = np.arctan2(r, rays[:,:,2])
+        theta2 = theta * theta
+        D = self.D.flatten()
+        theta_d = theta * (1 + theta2 * (D[0] + theta2 * (D[1] + theta2 * (D[2] + theta2 * D[3]))))
+        scale = np.zeros_like(r)
+        np.divide(theta_d, r, out=scale, where=r > 1e-12)
+
+        mesh_x = scaled_K[0,0] * rays[:,:,0] * scale + scaled_K[0,1] * rays[:,:,1] * scale + scaled_K[0,2]
+        mesh_y = scaled_K[1,1] * rays[:,:,1] * scale + scaled_K[1,2]
+
+        full_dim = (num_x * step_x, num_y * step_y)
+        map1 = cv2.resize(mesh_x.astype(np.float32), full_dim, interpolation=cv2.INTER_LINEAR)
+        map2 = cv2.resize(mesh_y.astype(np.float32), full_dim, interpolation=cv2.INTER_LINEAR)
+
+        map1 = map1[step_y:step_y + height, step_x:step_x + width]
+        map2 = map2[step_y:step_y + height, step_x:step_x + width]
+
+        return map1, map2
+
+    def get_mesh_error(self, fov_scale = 1.0, new_img_dim = None, quat = None, grid_size = (64, 36)):
+        """Get the maximum pixel error of get_mesh_maps compared to the dense maps.
+
+        Only output pixels which sample from inside the source image are counted.
+
+        Args:
+            fov_scale (float, optional): Virtual camera focal length divider. Defaults to 1.
+            new_img_dim (tuple, optional): Dimension of new image
+            quat (np.ndarray, optional): Orientation of the virtual camera
+            grid_size (tuple, optional): Approximate number of mesh vertices (x, y). Defaults to (64, 36).
+
+        Returns:
+            float: Maximum distance in pixels between the sample positions
+        """
+
+        img_dim = tuple(int(d) for d in (new_img_dim if new_img_dim else self.calib_dimension))
+
+        dense1, dense2 = self.get_rotation_maps(fov_scale, img_dim, quat)
+        mesh1, mesh2 = self.get_mesh_maps(fov_scale, img_dim, quat, grid_size)
+
+        inside = (dense1 >= 0) & (dense1 <= img_dim[0] - 1) & (dense2 >= 0) & (dense2 <= img_dim[1] - 1)
+        if not np.any(inside):
+            return 0.0
+
+        error = np.hypot(mesh1 - dense1, mesh2 - dense2)
+        return float(np.max(error[inside]))
+
 
     def undistort_points(self, distorted_points,new_img_dim = None):
         img_dim = new_img_dim if new_img_dim else self.calib_dimension
@@ -527,6 +732,8 @@ class FisheyeCalibrator:
             printinfo (bool, optional): Print extra info from preset file. Defaults to False.
         """
 
+        from tkinter import Tk
+        from tkinter.filedialog import askopenfilename
         Tk().withdraw() # hide root window
         # file browser prompt
         filename = askopenfilename(title = "Select calibration preset file",
@@ -542,6 +749,8 @@ class FisheyeCalibrator:
         """
         self.compute_calibration()
 
+        from tkinter import Tk
+        from tkinter.filedialog import askopenfilename
         Tk().withdraw()
 
         filename = askopenfilename(title = "Select image to undistort",
@@ -1061,6 +1270,8 @@ class StandardCalibrator:
             printinfo (bool, optional): Print extra info from preset file. Defaults to False.
         """
 
+        from tkinter import Tk
+        from tkinter.filedialog import askopenfilename
         Tk().withdraw() # hide root window
         # file browser prompt
         filename = askopenfilename(title = "Select calibration preset file",
@@ -1076,6 +1287,8 @@ class StandardCalibrator:
         """
         self.compute_calibration()
 
+        from tkinter import Tk
+        from tkinter.filedialog import askopenfilename
         Tk().withdraw()
 
         filename = askopenfilename(title = "Select image to undistort",
@@ -0,0 +1,168 @@
+import bisect
+import subprocess
+
+import cv2
+import numpy as np
+
+from video_info import get_ffprobe_path, probe_video
+
+
+def probe_keyframe_times(videopath):
+    """Get the timestamps of the keyframes in the first video stream using ffprobe
+
+    Only the packet index is read, no frames are decoded.
+
+    Args:
+        videopath (string): Path to the video file
+
+    Returns:
+        list: Sorted keyframe times in seconds. Empty if ffprobe is not available.
+    """
+    try:
+        result = subprocess.run([get_ffprobe_path(), "-v", "error", "-select_streams", "v:0",
+                                 "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", videopath],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print("Could not read keyframes: {}".format(e))
+        return []
+
+    times = []
+    for line in result.stdout.splitlines():
+        fields = line.strip().split(",")
+        if len(fields) < 2 or "K" not in fields[1]:
+            continue
+        try:
+            times.append(float(fields[0]))
+        except ValueError:
+            # N/A for packets without timestamp
+            pass
+
+    # Packets are listed in decode order
+    return sorted(times)
+
+
+class FrameSource:
+    """Frame accurate video reader shared by sync analysis and rendering
+
+    Seeks always land on a keyframe and decode forward to the requested frame,
+    which avoids the slow and occasionally inaccurate frame seeks of long GOP
+    files. The read position is tracked, so reading on from the current frame
+    never seeks.
+
+    For analysis the frames can be delivered as downscaled grayscale images.
+    """
+    def __init__(self, videopath, gray = False, scale = 1):
+        """
+        Args:
+            videopath (string): Path to the video file
+            gray (bool, optional): Convert frames to grayscale. Defaults to False.
+            scale (float, optional): Resize factor applied to decoded frames. Defaults to 1.
+        """
+        self.videopath = videopath
+        self.info = probe_video(videopath)
+        self.cap = cv2.VideoCapture(videopath)
+        self.width = self.info.width
+        self.height = self.info.height
+        self.fps = self.info.fps
+        self.num_frames = self.info.num_frames
+
+        self.gray = gray
+        self.scale = scale
+        self.output_size = (max(1, int(round(self.width * scale))), max(1, int(round(self.height * scale))))
+
+        # Index of the frame returned by the next read
+        self.position = 0
+        # Presentation time in seconds of the last read frame
+        self.frame_time = 0
+
+        self.keyframes = None
+
+    def get_keyframes(self):
+        """Get the frame indices of the keyframes, probing the file on first use
+
+        Without ffprobe the video is split into one second blocks, which are then
+        reached with the seek of the OpenCV backend.
+
+        Returns:
+            list: Sorted keyframe indices starting with 0
+        """
+        if self.keyframes is None:
+            times = probe_keyframe_times(self.videopath)
+            if times:
+                # Relative to the first frame, which is always a keyframe
+                indices = np.round((np.array(times) - times[0]) * self.fps).astype(int)
+                self.keyframes = sorted(set(indices.tolist()) | {0})
+            else:
+                block = max(1, int(round(self.fps)))
+                self.keyframes = list(range(0, max(self.num_frames, 1), block))
+
+        return self.keyframes
+
+    def get_gop(self, frame_num):
+        """Get the range of the GOP containing a frame
+
+        Args:
+            frame_num (int): Frame index
+
+        Returns:
+            (int, int): First frame of the GOP and first frame of the next one
+        """
+        keyframes = self.get_keyframes()
+        i = max(bisect.bisect_right(keyframes, frame_num) - 1, 0)
+        end = keyframes[i + 1] if i + 1 < len(keyframes) else max(self.num_frames, frame_num + 1)
+        return keyframes[i], end
+
+    def seek(self, frame_num):
+        """Position the reader so the next read returns the given frame
+
+        Args:
+            frame_num (int): Frame index
+        """
+        frame_num = int(frame_num)
+        if frame_num == self.position:
+            return
+
+        gop_start, _ = self.get_gop(frame_num)
+        if not (gop_start <= self.position < frame_num):
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, gop_start)
+            self.position = gop_start
+
+        while self.position < frame_num:
+            if not self.cap.grab():
+                break
+            self.position += 1
+
+    def read(self):
+        """Read the next frame
+
+        Returns:
+            (bool, np.ndarray): Success and decoded frame, like cv2.VideoCapture.read
+        """
+        success, frame = self.cap.read()
+        if success:
+            self.frame_time = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            self.position += 1
+
+            if self.gray:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if self.scale != 1:
+                frame = cv2.resize(frame, self.output_size, interpolation=cv2.INTER_AREA)
+
+        return success, frame
+
+    def to_full_resolution(self, points):
+        """Map pixel coordinates in scaled frames back to the original resolution
+
+        Args:
+            points (np.ndarray): Points with x, y in the last axis
+
+        Returns:
+            np.ndarray: Points in original frame coordinates
+        """
+        if self.scale == 1:
+            return points
+        factor = np.array([self.width / self.output_size[0], self.height / self.output_size[1]], dtype=points.dtype)
+        return (points + 0.5) * factor - 0.5
+
+    def release(self):
+        self.cap.release()
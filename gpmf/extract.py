@@ -3,141 +3,236 @@
 # https://github.com/rambo/python-gpmf
 
 #!/usr/bin/env python3
-import hachoir.parser
-from hachoir.field import MissingField
-from hachoir.field.string_field import String
+"""Finds the GPMF track of an MP4 file and reads its payloads"""
+import os
+import struct
+
+import numpy as np
+
+# Largest single read when streaming adjacent payloads
+MAX_READ_SIZE = 8 * 1024 * 1024
+
+
+def iter_boxes(f, start, end):
+    """Walk the boxes in a byte range of an MP4 file
+
+    Args:
+        f (file): MP4 file opened in binary mode
+        start (int): Offset of the first box
+        end (int): End of the range
+
+    Yields:
+        (bytes, int, int): Box type, offset of the box payload and end of the box
+    """
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+        if size == 1:
+            # 64 bit size follows the type
+            size, = struct.unpack(">Q", f.read(8))
+            header_size = 16
+        elif size == 0:
+            # Box extends to the end of the enclosing range
+            size = end - offset
+
+        if size < header_size:
+            return
+
+        yield box_type, offset + header_size, min(offset + size, end)
+        offset += size
+
+
+def get_child_boxes(f, start, end):
+    """Get the payload ranges of the child boxes by type, first occurrence only"""
+    children = {}
+    for box_type, payload_start, box_end in iter_boxes(f, start, end):
+        children.setdefault(box_type, (payload_start, box_end))
+    return children
+
+
+def read_box(f, box_range):
+    f.seek(box_range[0])
+    return f.read(box_range[1] - box_range[0])
+
+
+class GPMFTrack:
+    """Sample table of the GPMF (gpmd) track of an MP4 file
+
+    Only the moov box and the tables of the gpmd track are read. The sample tables
+    are decoded with np.frombuffer, which keeps opening large files fast.
+
+    Attributes:
+        filepath (string): Path to the MP4 file
+        timescale (int): Media time units per second
+        offsets (np.ndarray): File offset of each payload
+        sizes (np.ndarray): Size of each payload in bytes
+        start_times (np.ndarray): Start of each payload in media time units
+        durations (np.ndarray): Duration of each payload in media time units
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.timescale = 1
+
+        with open(filepath, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            stbl = self.find_gpmd_stbl(f, file_size)
+            if stbl is None:
+                raise Exception("No GPMF track found in {}".format(filepath))
+
+            tables = {box_type: read_box(f, box_range) for box_type, box_range in stbl.items()}
+
+        self.sizes = self.parse_stsz(tables[b'stsz'])
+        if b'co64' in tables:
+            chunk_offsets = np.frombuffer(tables[b'co64'], dtype='>u8', offset=8).astype(np.int64)
+        else:
+            chunk_offsets = np.frombuffer(tables[b'stco'], dtype='>u4', offset=8).astype(np.int64)
+        self.offsets = self.get_sample_offsets(chunk_offsets, tables.get(b'stsc'), self.sizes)
+
+        stts = np.frombuffer(tables[b'stts'], dtype='>u4', offset=8).reshape(-1, 2).astype(np.int64)
+        self.durations = np.repeat(stts[:,1], stts[:,0])[:len(self.sizes)]
+        self.start_times = np.concatenate(([0], np.cumsum(self.durations)[:-1]))
+
+    def find_gpmd_stbl(self, f, file_size):
+        """Find the sample table boxes of the gpmd track
+
+        Args:
+            f (file): MP4 file
+            file_size (int): Size of the file
+
+        Returns:
+            dict: Payload ranges of the stbl child boxes, or None without a gpmd track
+        """
+        moov = get_child_boxes(f, 0, file_size).get(b'moov')
+        if moov is None:
+            return None
+
+        for box_type, trak_start, trak_end in iter_boxes(f, *moov):
+            if box_type != b'trak':
+                continue
 
+            mdia = get_child_boxes(f, trak_start, trak_end).get(b'mdia')
+            if mdia is None:
+                continue
+            mdia_children = get_child_boxes(f, *mdia)
 
-def get_raw_content(met):
-    """Reads the raw bytes from the stream for this atom/field"""
-    if hasattr(met, 'stream'):
-        stream = met.stream
-    else:
-        stream = met.parent.stream
-    return stream.read(met.absolute_address, met.size)
+            # Handler type follows version, flags and pre_defined
+            hdlr = mdia_children.get(b'hdlr')
+            if hdlr is None or read_box(f, hdlr)[8:12] != b'meta' or b'minf' not in mdia_children:
+                continue
 
+            stbl = get_child_boxes(f, *mdia_children[b'minf']).get(b'stbl')
+            if stbl is None:
+                continue
+            stbl_children = get_child_boxes(f, *stbl)
 
-def get_gpmf_payloads_from_file(filepath):
-    """Get payloads from file, returns a tuple with the payloads iterator and the parser instance"""
-    parser = hachoir.parser.createParser(filepath)
-    return (get_payloads(find_gpmd_stbl_atom(parser)), parser)
-
-
-def get_gpmf_payloads(parser):
-    """Shorthand for finding the GPMF atom to be passed to get_payloads"""
-    return get_payloads(find_gpmd_stbl_atom(parser))
-
-
-def get_payloads(stbl):
-    """Get payloads by chunk from stbl, with timing info"""
-    # Locate needed subatoms
-    try:
-        for subatom in stbl:
-            tag = subatom['tag']
-            if tag.value == 'stsz':
-                stsz = subatom['stsz']
-            if tag.value == 'stco':
-                stco = subatom['stco']
-            if tag.value == 'stts':
-                stts = subatom['stts']
-    except TypeError:
-        raise Exception("Problem parsing metadata")
-
-    # Generate start and end timestamps for all chunks
-    timestamps = []
-    for idx in range(stts['count'].value):
-        sample_delta = stts["sample_delta[{}]".format(idx)].value
-        for idx2 in range(stts["sample_count[{}]".format(idx)].value):
-            if idx == 0 and idx2 == 0:
-                sampletimes = (0, sample_delta)
-            else:
-                sampletimes = (timestamps[-1][1], timestamps[-1][1] + sample_delta)
-            timestamps.append(sampletimes)
-
-    # Read chunks, yield with timing data
-    num_samples = stsz['count'].value
-    for idx in range(num_samples):
-        offset = stco["chunk_offset[{}]".format(idx)].value
-        size = stsz["sample_size[{}]".format(idx)].value
-        data = stbl.stream.read(offset * 8, size * 8)[1]
-        yield (data, timestamps[idx])
-
-
-def get_stream_data(stbl):
-    """Get raw payload bytes from stbl atom offsets"""
-    ret_bytes = b''
-    for payload in get_payloads(stbl):
-        ret_bytes += payload[0]
-    return ret_bytes
-
-
-def find_gpmd_stbl_atom(parser):
-    """Find the stbl atom"""
-    minf_atom = find_gpmd_minf_atom(parser)
-    if not minf_atom:
-        return None
-    try:
-        for minf_field in minf_atom:
-            tag = minf_field['tag']
-            if tag.value != 'stbl':
+            # First sample description entry: size and data format after version, flags and entry count
+            stsd = stbl_children.get(b'stsd')
+            if stsd is None or read_box(f, stsd)[12:16] != b'gpmd':
                 continue
-            return minf_field['stbl']
-    except MissingField:
-        pass
-
-
-def find_gpmd_minf_atom(parser):
-    """Find minf atom for GPMF media"""
-    def recursive_search(atom):
-        try:
-            subtype = atom['hdlr/subtype']
-            if subtype.value == 'meta':
-                meta_atom = atom.parent
-                # print(meta_atom)
-                for subatom in meta_atom:
-                    tag = subatom['tag']
-                    if tag.value != 'minf':
-                        continue
-                    minf_atom = subatom['minf']
-                    #print("  {}".format(minf_atom))
-                    for minf_field in minf_atom:
-                        tag = minf_field['tag']
-                        #print("    {}".format(tag))
-                        if tag.value != 'gmhd':
-                            continue
-                        if b'gpmd' in minf_field['data'].value:
-                            return minf_atom
-        except MissingField:
-            pass
-        try:
-            for x in atom:
-                ret = recursive_search(x)
-                if ret:
-                    return ret
-        except KeyError as e:
-            pass
+
+            mdhd = mdia_children.get(b'mdhd')
+            if mdhd is not None:
+                self.timescale = self.parse_timescale(read_box(f, mdhd))
+
+            return stbl_children
+
         return None
-    return recursive_search(parser)
+
+    def parse_timescale(self, mdhd):
+        version = mdhd[0]
+        # Creation and modification times are 64 bit in version 1
+        offset = 20 if version == 1 else 12
+        timescale, = struct.unpack_from(">I", mdhd, offset)
+        return timescale
+
+    def parse_stsz(self, stsz):
+        sample_size, sample_count = struct.unpack_from(">II", stsz, 4)
+        if sample_size:
+            return np.full(sample_count, sample_size, dtype=np.int64)
+        return np.frombuffer(stsz, dtype='>u4', count=sample_count, offset=12).astype(np.int64)
+
+    def get_sample_offsets(self, chunk_offsets, stsc, sizes):
+        """Expand chunk offsets to sample offsets using the sample-to-chunk table
+
+        Args:
+            chunk_offsets (np.ndarray): File offset of each chunk
+            stsc (bytes): stsc box payload, None for one sample per chunk
+            sizes (np.ndarray): Sample sizes
+
+        Returns:
+            np.ndarray: File offset of each sample
+        """
+        num_chunks = len(chunk_offsets)
+        if stsc is None:
+            samples_per_chunk = np.ones(num_chunks, dtype=np.int64)
+        else:
+            # Rows of (first chunk, samples per chunk, description index), chunks counted from 1
+            entries = np.frombuffer(stsc, dtype='>u4', offset=8).reshape(-1, 3).astype(np.int64)
+            run_lengths = np.diff(np.concatenate((entries[:,0], [num_chunks + 1])))
+            samples_per_chunk = np.repeat(entries[:,1], run_lengths)
+
+        sample_chunks = np.repeat(np.arange(num_chunks), samples_per_chunk)[:len(sizes)]
+        chunk_first_samples = np.concatenate(([0], np.cumsum(samples_per_chunk)[:-1]))
+
+        size_cumsum = np.concatenate(([0], np.cumsum(sizes)))
+        within_chunk = size_cumsum[:len(sizes)] - size_cumsum[chunk_first_samples[sample_chunks]]
+
+        return chunk_offsets[sample_chunks] + within_chunk
+
+    def payloads(self):
+        """Stream the payloads in sample order
+
+        Payloads stored back to back are fetched with a single read.
+
+        Yields:
+            (bytes, (int, int)): Payload data and its start and end time in media time units
+        """
+        num_samples = len(self.sizes)
+        if num_samples == 0:
+            return
+
+        # Runs of adjacent payloads, split so no read exceeds MAX_READ_SIZE
+        breaks = np.flatnonzero(self.offsets[1:] != self.offsets[:-1] + self.sizes[:-1]) + 1
+        run_bounds = np.concatenate(([0], breaks, [num_samples]))
+
+        with open(self.filepath, "rb") as f:
+            for run_start, run_end in zip(run_bounds[:-1], run_bounds[1:]):
+                idx = run_start
+                while idx < run_end:
+                    # At least one payload per read
+                    base = self.offsets[idx]
+                    last = idx + max(1, np.searchsorted(self.offsets[idx:run_end] + self.sizes[idx:run_end] - base,
+                                                        MAX_READ_SIZE, side="right"))
+                    last = min(last, run_end)
+
+                    f.seek(base)
+                    data = f.read(int(self.offsets[last - 1] + self.sizes[last - 1] - base))
+
+                    for i in range(idx, last):
+                        start = int(self.offsets[i] - base)
+                        yield (data[start:start + int(self.sizes[i])],
+                               (int(self.start_times[i]), int(self.start_times[i] + self.durations[i])))
+                    idx = last
+
+
+def get_gpmf_payloads_from_file(filepath):
+    """Get payloads from file, returns a tuple with the payloads iterator and the GPMFTrack instance"""
+    track = GPMFTrack(filepath)
+    return (track.payloads(), track)
 
 
-def recursive_print(input):
-    """Recursively print hachoir parsed state"""
-    print(repr(input))
-    if isinstance(input, String):
-        print("  {}".format(input.display))
-    try:
-        for x in input:
-            recursive_print(x)
-    except KeyError as e:
-        pass
+def get_stream_data(track):
+    """Get raw payload bytes of a GPMFTrack"""
+    return b''.join(payload[0] for payload in track.payloads())
 
 
 if __name__ == '__main__':
     import sys
-    parser = hachoir.parser.createParser(sys.argv[1])
     with open(sys.argv[2], 'wb') as fp:
         fp.write(
             get_stream_data(
-                find_gpmd_stbl_atom(parser)
+                GPMFTrack(sys.argv[1])
             )
         )
@@ -5,10 +5,12 @@
 
 #!/usr/bin/env python3
 """Parses the FOURCC data in GPMF stream into fields"""
+import collections
 import struct
 
 import construct
 import dateutil.parser
+import numpy as np
 
 TYPES = construct.Enum(
     construct.Byte,
@@ -171,6 +173,100 @@ def parse_dict(data):
 
     return new_dict
 
+
+# Big-endian NumPy dtypes of the GPMF number types decoded by the fast path
+NUMPY_TYPES = {
+    ord(b'b'): np.dtype('>i1'),
+    ord(b'B'): np.dtype('>u1'),
+    ord(b's'): np.dtype('>i2'),
+    ord(b'S'): np.dtype('>u2'),
+    ord(b'l'): np.dtype('>i4'),
+    ord(b'L'): np.dtype('>u4'),
+    ord(b'f'): np.dtype('>f4'),
+    ord(b'd'): np.dtype('>f8'),
+    ord(b'j'): np.dtype('>i8'),
+    ord(b'J'): np.dtype('>u8'),
+}
+
+KLV_HEADER = struct.Struct(">4sBBH")
+
+# Same fields as a parsed FOURCC, for handing elements to parse_value
+Element = collections.namedtuple("Element", ["key", "type", "size", "repeat", "data"])
+
+
+def iter_klv(data):
+    """Walk the KLV elements of a GPMF buffer without copying
+
+    Args:
+        data (bytes|memoryview): GPMF data
+
+    Yields:
+        (bytes, int, int, int, memoryview): key, type, size, repeat and unpadded data of each element
+    """
+    view = memoryview(data)
+    offset = 0
+    end = len(view)
+    while offset + KLV_HEADER.size <= end:
+        key, type_id, size, repeat = KLV_HEADER.unpack_from(view, offset)
+        offset += KLV_HEADER.size
+        length = size * repeat
+        yield key, type_id, size, repeat, view[offset:offset + length]
+        # Data is padded to 32 bits
+        offset += (length + 3) & ~3
+
+
+def decode_numeric(type_id, size, repeat, data):
+    """Decode a number element directly into a NumPy array
+
+    Args:
+        type_id (int): GPMF type character
+        size (int): Bytes per sample
+        repeat (int): Number of samples
+        data (memoryview): Element data
+
+    Returns:
+        Single value as a Python number, otherwise an array with one row per sample
+    """
+    dtype = NUMPY_TYPES[type_id]
+    per_sample = size // dtype.itemsize
+    values = np.frombuffer(data, dtype=dtype, count=per_sample * repeat)
+
+    if values.shape[0] == 1:
+        return values[0].item()
+    if per_sample > 1:
+        return values.reshape(repeat, per_sample)
+    return values
+
+
+def parse_dict_fast(data):
+    """Parse data into a dict recursively like parse_dict, decoding number
+    elements straight into NumPy arrays. Other types go through parse_value.
+    """
+
+    new_dict = dict()
+
+    for key, type_id, size, repeat, element_data in iter_klv(data):
+        key = key.decode('ascii')
+        if type_id == 0:
+            if key == "STRM":
+                new_dict.setdefault("STRM", []).append(parse_dict_fast(element_data))
+            else:
+                new_dict[key] = parse_dict_fast(element_data)
+
+        elif type_id in NUMPY_TYPES and size % NUMPY_TYPES[type_id].itemsize == 0:
+            new_dict[key] = decode_numeric(type_id, size, repeat, element_data)
+
+        else:
+            element = Element(key.encode('ascii'), type_id, size, repeat, element_data.tobytes())
+            try:
+                value = parse_value(element)
+            except ValueError:
+                value = element.data
+            new_dict[key] = value
+
+    return new_dict
+
+
 if __name__ == '__main__':
     import sys
     from extract import get_gpmf_payloads_from_file
@@ -5,9 +5,237 @@ This module uses gyroscope data to compute quaternion orientations over time
 """
 
 
+import math
 import numpy as np
 import quaternion as quat
 
+
+def slerp_smooth_pass(orientations, alpha):
+    """Exact sequential exponential smoothing, value = slerp(value, orientations[i], alpha)
+    for each sample. Same arithmetic as quat.slerp on plain floats, which avoids the NumPy
+    call overhead per sample.
+
+    Args:
+        orientations (numpy.ndarray): Nx4 array of unit quaternions
+        alpha (float): Smoothing factor per sample, as used by slerp
+
+    Returns:
+        numpy.ndarray: Nx4 array of smoothed quaternions
+    """
+
+    smoothed = np.empty(orientations.shape)
+    w, x, y, z = (float(c) for c in orientations[0])
+
+    for i, (qw, qx, qy, qz) in enumerate(np.asarray(orientations, dtype=np.float64).tolist()):
+        dot = w * qw + x * qx + y * qy + z * qz
+
+        # shortest path
+        if dot < 0.0:
+            qw, qx, qy, qz = -qw, -qx, -qy, -qz
+            dot = -dot
+
+        if dot > 0.9995:
+            # linear interpolation for nearby quaternions, like quat.slerp
+            w, x, y, z = w + alpha * (qw - w), x + alpha * (qx - x), y + alpha * (qy - y), z + alpha * (qz - z)
+            norm = math.sqrt(w * w + x * x + y * y + z * z)
+            w, x, y, z = w / norm, x / norm, y / norm, z / norm
+        else:
+            theta_0 = math.acos(min(dot, 1.0))
+            theta = theta_0 * alpha
+            s1 = math.sin(theta) / math.sin(theta_0)
+            s0 = math.cos(theta) - dot * s1
+            w, x, y, z = s0 * w + s1 * qw, s0 * x + s1 * qx, s0 * y + s1 * qy, s0 * z + s1 * qz
+
+        smoothed[i] = (w, x, y, z)
+
+    return smoothed
+
+
+def exponential_smooth_quaternions(orientations, alpha, block_size=128, max_corrections=8, tolerance=1.0e-5):
+    """One pass of exponential smoothing on the quaternion manifold. Equivalent to
+    value = slerp(value, orientations[i], alpha) for each sample.
+
+    The orientations are split in blocks. Each block is expressed as rotation vectors relative to
+    an anchor, the smoothed value at the start of the block, where the recurrence is a linear
+    first order filter running in scipy. Vectorized defect correction passes then remove the
+    linearization error. The tangent space approximation breaks down when the smoothed value
+    lags far behind the orientations, e.g. fast rotation with long time constants. If the
+    corrections don't converge, the exact sequential pass is used instead.
+
+    Args:
+        orientations (numpy.ndarray): Nx4 array of unit quaternions
+        alpha (float): Smoothing factor per sample, as used by slerp
+        block_size (int, optional): Samples per anchor block. Defaults to 128.
+        max_corrections (int, optional): Maximum number of defect correction passes. Defaults to 8.
+        tolerance (float, optional): Bound on the deviation from the sequential result in rad. Defaults to 1e-5.
+
+    Returns:
+        numpy.ndarray: Nx4 array of smoothed quaternions
+    """
+
+    from scipy import signal
+
+    num_samples = orientations.shape[0]
+    num_blocks = -(-num_samples // block_size)
+    decay = 1 - alpha
+
+    # Anchor for each block. Only the end of each block is needed to get the next anchor
+    end_weights = alpha * decay ** np.arange(block_size - 1, -1, -1)
+    anchors = np.empty((num_blocks, 4))
+    anchor = np.array(orientations[0], dtype=np.float64)
+
+    for k in range(num_blocks):
+        anchors[k] = anchor
+        block = orientations[k * block_size:(k + 1) * block_size]
+
+        # log map inlined, this loop runs once per block
+        relative = block @ quat.left_matrix(quat.conjugate_array(anchor)).T
+        vec_norm = np.sqrt(np.einsum("ij,ij->i", relative[:,1:], relative[:,1:]))
+        half_angle = np.arctan2(vec_norm, np.abs(relative[:,0]))
+        weights = end_weights[block_size - block.shape[0]:] * np.sign(relative[:,0] + 0.5 * (relative[:,0] == 0)) * half_angle / np.maximum(vec_norm, 1.0e-300)
+        block_end = weights @ relative[:,1:]
+
+        block_end_angle = math.sqrt(block_end.dot(block_end))
+        if block_end_angle > 1.0e-12:
+            delta_q = np.concatenate(([math.cos(block_end_angle)], block_end * (math.sin(block_end_angle) / block_end_angle)))
+            anchor = quat.left_matrix(anchor) @ delta_q
+            anchor /= math.sqrt(anchor.dot(anchor))
+
+    # Linear filter in the tangent space of each anchor. Subtracting the decayed filter state
+    # at each block start is the same as restarting the filter from zero within each block
+    block_idx = np.arange(num_samples) // block_size
+    block_pos = np.arange(num_samples) % block_size
+    sample_anchors = anchors[block_idx]
+
+    rotvecs = quat.log_array(quat.quaternion_multiply_array(quat.conjugate_array(sample_anchors), orientations))
+    filtered = signal.lfilter([alpha], [1, -decay], rotvecs, axis=0)
+
+    block_start_state = np.zeros((num_blocks, 3))
+    block_start_state[1:] = filtered[np.arange(1, num_blocks) * block_size - 1]
+    filtered -= (decay ** (block_pos + 1))[:,np.newaxis] * block_start_state[block_idx]
+
+    smoothed = quat.quaternion_multiply_array(sample_anchors, quat.exp_array(filtered))
+
+    for i in range(max_corrections):
+        # Take one exact slerp step from each approximate value and propagate the defect
+        previous = np.vstack((orientations[:1], smoothed[:-1]))
+        step = quat.log_array(quat.quaternion_multiply_array(quat.conjugate_array(previous), orientations))
+        stepped = quat.quaternion_multiply_array(previous, quat.exp_array(alpha * step))
+        defect = quat.log_array(quat.quaternion_multiply_array(quat.conjugate_array(smoothed), stepped))
+
+        # The smoothing contracts per sample defects by decay, so the deviation from the
+        # sequential result is bounded by the largest defect / alpha (defects are half angles)
+        max_defect = np.max(np.linalg.norm(defect, axis=1)) if num_samples else 0
+        if 2 * max_defect <= tolerance * alpha:
+            return smoothed
+
+        smoothed = quat.quaternion_multiply_array(smoothed, quat.exp_array(signal.lfilter([1], [1, -decay], defect, axis=0)))
+
+    return slerp_smooth_pass(orientations, alpha)
+
+
+def interpolate_orientations(time_list, orientations, out_times):
+    """Slerp between the two orientations bracketing each output time.
+    Times outside the data range hold the first/last orientation.
+
+    Args:
+        time_list (numpy.ndarray): Sorted sample times
+        orientations (numpy.ndarray): Nx4 array of quaternions at the sample times
+        out_times (numpy.ndarray): Times to resample at, in any order
+
+    Returns:
+        numpy.ndarray: Contiguous Mx4 array of interpolated quaternions
+    """
+
+    out_times = np.asarray(out_times, dtype=np.float64)
+
+    if len(time_list) < 2:
+        return np.tile(orientations[0], (out_times.shape[0], 1))
+
+    # index of the sample at or before each output time
+    idx = np.clip(np.searchsorted(time_list, out_times, side="right") - 1, 0, len(time_list) - 2)
+
+    sample_spacing = time_list[idx + 1] - time_list[idx]
+    weights = np.zeros(out_times.shape)
+    spaced = sample_spacing > 0
+    weights[spaced] = (out_times[spaced] - time_list[idx][spaced]) / sample_spacing[spaced]
+    weights = np.clip(weights, 0, 1)
+
+    return np.ascontiguousarray(quat.slerp_array(orientations[idx], orientations[idx + 1], weights))
+
+
+class GyroRateIndex:
+    """Prefix integral of gyro rates for fast window averages.
+
+    The cumulative trapezoidal integral is built once. The mean rate over any
+    number of time windows then takes one searchsorted and a quadratic
+    interpolation per window edge, which is exact for linearly interpolated rates.
+    """
+    def __init__(self, times, rates):
+        """
+        Args:
+            times (numpy.ndarray): Sorted sample times
+            rates (numpy.ndarray): Nx3 angular rates at the sample times
+        """
+
+        self.times = np.asarray(times, dtype=np.float64)
+        self.rates = np.asarray(rates, dtype=np.float64)
+
+        dt = np.diff(self.times)
+        self.cumulative = np.zeros(self.rates.shape)
+        self.cumulative[1:] = np.cumsum((self.rates[1:] + self.rates[:-1]) / 2 * dt[:,np.newaxis], axis=0)
+
+        # rate change per second within each sample interval
+        self.slopes = np.zeros(self.rates.shape)
+        spaced = dt > 0
+        self.slopes[:-1][spaced] = np.diff(self.rates, axis=0)[spaced] / dt[spaced,np.newaxis]
+
+    def integral(self, t):
+        """Integral of the rates from the first sample up to the given times.
+        Times are clamped to the data range.
+
+        Args:
+            t (numpy.ndarray): Times of any shape
+
+        Returns:
+            numpy.ndarray: Integrated rates with shape t.shape + (3,)
+        """
+
+        t = np.clip(np.asarray(t, dtype=np.float64), self.times[0], self.times[-1])
+        idx = np.clip(np.searchsorted(self.times, t, side="right") - 1, 0, len(self.times) - 1)
+        s = (t - self.times[idx])[...,np.newaxis]
+
+        return self.cumulative[idx] + self.rates[idx] * s + 0.5 * self.slopes[idx] * s * s
+
+    def mean_rate(self, t0, t1):
+        """Mean angular rate over the windows [t0, t1]
+
+        Args:
+            t0 (numpy.ndarray): Window start times
+            t1 (numpy.ndarray): Window end times, same shape as t0
+
+        Returns:
+            numpy.ndarray: Mean rates with shape t0.shape + (3,)
+        """
+
+        t0 = np.asarray(t0, dtype=np.float64)
+        t1 = np.asarray(t1, dtype=np.float64)
+        return (self.integral(t1) - self.integral(t0)) / (t1 - t0)[...,np.newaxis]
+
+    def covers(self, t0, t1):
+        """Check which windows lie inside the data range
+
+        Args:
+            t0 (numpy.ndarray): Window start times
+            t1 (numpy.ndarray): Window end times
+
+        Returns:
+            numpy.ndarray: Boolean array, True where the window is covered by samples
+        """
+
+        return (np.asarray(t0) >= self.times[0]) & (np.asarray(t1) <= self.times[-1])
+
+
 class GyroIntegrator:
     def __init__(self, input_data, time_scaling=1, gyro_scaling=1, zero_out_time=True, initial_orientation=None, acc_data=None):
         """Initialize instance of gyroIntegrator for getting orientation from gyro data
@@ -58,9 +286,12 @@ class GyroIntegrator:
         self.already_integrated = False
 
 
-    def integrate_all(self):
+    def integrate_all(self, vectorized=True):
         """go through each gyro sample and integrate to find orientation
 
+        Args:
+            vectorized (bool, optional): Use the batched NumPy engine instead of the per-sample reference loop. Defaults to True.
+
         Returns:
             (np.ndarray, np.ndarray): tuple (time_list, quaternion orientation array)
         """
@@ -68,6 +299,44 @@ class GyroIntegrator:
         if self.already_integrated:
             return (self.time_list, self.orientation_list)
 
+        if vectorized:
+            return self.integrate_vectorized()
+
+        return self.integrate_loop()
+
+
+    def integrate_vectorized(self):
+        """Batched version of integrate_all. Computes all delta quaternions in one pass
+        and composes them with a chunked prefix product.
+
+        Returns:
+            (np.ndarray, np.ndarray): tuple (time_list, quaternion orientation array)
+        """
+
+        times = self.data[:,0]
+        omegas = self.data[:,1:]
+
+        # symmetrical dt calculation, same as the loop. Edges use the single neighbour
+        padded_times = np.concatenate((times[:1], times, times[-1:]))
+        delta_times = (padded_times[2:] - padded_times[:-2])/2
+
+        delta_qs = self.rates_to_quats(omegas, delta_times)
+
+        self.orientation_list = quat.quaternion_cumprod(delta_qs, self.orientation)
+        self.orientation = np.copy(self.orientation_list[-1])
+        self.time_list = np.copy(times)
+
+        self.already_integrated = True
+
+        return (self.time_list, self.orientation_list)
+
+
+    def integrate_loop(self):
+        """Reference implementation of integrate_all stepping through each sample in Python
+
+        Returns:
+            (np.ndarray, np.ndarray): tuple (time_list, quaternion orientation array)
+        """
 
         # temp lists to save data
         temp_orientation_list = []
@@ -120,10 +389,30 @@ class GyroIntegrator:
         return None
 
 
-    def get_smoothed_orientation(self, smooth = 0.94):
+    def get_smoothed_orientation(self, smooth = 0.94, vectorized=True):
         # https://en.wikipedia.org/wiki/Exponential_smoothing
         # the smooth value corresponds to the time constant
 
+        if not vectorized:
+            return self.get_smoothed_orientation_loop(smooth)
+
+        alpha = 1
+        if smooth > 0:
+            alpha = 1 - np.exp(-(1 / self.gyro_sample_rate) /smooth)
+
+        if alpha >= 1:
+            return (self.time_list, np.copy(self.orientation_list))
+
+        # forward pass, then reverse pass over the result
+        smoothed_orientation = exponential_smooth_quaternions(self.orientation_list, alpha)
+        smoothed_orientation2 = exponential_smooth_quaternions(smoothed_orientation[::-1], alpha)[::-1]
+
+        return (self.time_list, np.ascontiguousarray(smoothed_orientation2))
+
+
+    def get_smoothed_orientation_loop(self, smooth = 0.94):
+        """Reference implementation of get_smoothed_orientation using per-sample slerp"""
+
         alpha = 1
         if smooth > 0:
             alpha = 1 - np.exp(-(1 / self.gyro_sample_rate) /smooth)
@@ -163,50 +452,34 @@ class GyroIntegrator:
 
 
         # rotations that'll stabilize the camera
-        stab_rotations = np.zeros(self.orientation_list.shape)
-
-        for i in range(self.num_data_points):
-            # rotation quaternion from smooth motion -> raw motion to counteract it
-            stab_rotations[i,:] = quat.rot_between(smoothed_orientation[i],self.orientation_list[i])
+        # rotation quaternion from smooth motion -> raw motion to counteract it
+        stab_rotations = quat.rot_between_array(smoothed_orientation, self.orientation_list)
 
         return (self.time_list, stab_rotations) 
 
         
-    def get_interpolated_stab_transform(self,smooth, start=0, interval=1/29.97):
-        time_list, smoothed_orientation = self.get_stabilize_transform(smooth)
-
-        time = start
+    def get_interpolated_stab_transform(self,smooth, start=0, interval=1/29.97, frame_times=None):
+        """Stabilization rotations resampled at the video frame times
 
-        out_times = []
-        slerped_rotations = []
-
-        while time < 0:
-            slerped_rotations.append(smoothed_orientation[0])
-            out_times.append(time)
-            time += interval
-
-        while time_list[0] >= time:
-            slerped_rotations.append(smoothed_orientation[0])
-            out_times.append(time)
-            time += interval
-
-
-        for i in range(len(time_list)-1):
-            if time_list[i] <= time < time_list[i+1]:
+        Args:
+            smooth (float): Smoothing time constant
+            start (float, optional): Time of the first frame. Defaults to 0.
+            interval (float, optional): Time between frames. Defaults to 1/29.97.
+            frame_times (numpy.ndarray, optional): Per-frame timestamps, e.g. for VFR video. Overrides start and interval.
 
-                # interpolate between two quaternions
-                weight = (time - time_list[i])/(time_list[i+1]-time_list[i])
-                slerped_rotations.append(quat.slerp(smoothed_orientation[i],smoothed_orientation[i+1],[weight]))
-                out_times.append(time)
+        Returns:
+            (np.ndarray, np.ndarray): tuple (frame times, Nx4 quaternion array)
+        """
+        time_list, smoothed_orientation = self.get_stabilize_transform(smooth)
 
-                time += interval
+        if frame_times is None:
+            # fixed frame rate until the end of the gyro data
+            num_frames = max(0, int(np.ceil((time_list[-1] - start) / interval)))
+            frame_times = start + np.arange(num_frames) * interval
 
-            elif time < time_list[i]:
-                # continue even if missing gyro data
-                slerped_rotations.append(smoothed_orientation[i])
-                time += interval
+        out_times = np.asarray(frame_times, dtype=np.float64)
 
-        return (out_times, slerped_rotations)
+        return (out_times, interpolate_orientations(time_list, smoothed_orientation, out_times))
 
     def get_raw_data(self, axis):
         """get a column of the raw data. Either time or gyro.
@@ -263,6 +536,109 @@ class GyroIntegrator:
             return quat.quaternion(1,0,0,0)
 
 
+    def rates_to_quats(self, omegas, dts):
+        """Rotation quaternions from an array of gyroscope samples. Batched version of rate_to_quat
+
+        Args:
+            omegas (numpy.ndarray): Nx3 array of angular velocity vectors in rad/s.
+            dts (numpy.ndarray|float): Time delta for each sample.
+
+        Returns:
+            numpy.ndarray: Nx4 array of rotation quaternions
+        """
+
+        ha = omegas * np.reshape(dts, (-1, 1)) * 0.5
+        l = np.linalg.norm(ha, axis=1)
+
+        rotating = l > 1.0e-12
+        delta_qs = np.zeros((omegas.shape[0], 4))
+        delta_qs[:,0] = 1
+
+        l_rot = l[rotating]
+        delta_qs[rotating,0] = np.cos(l_rot)
+        delta_qs[rotating,1:] = ha[rotating] * (np.sin(l_rot) / l_rot)[:,np.newaxis]
+        delta_qs[rotating] = quat.normalize_array(delta_qs[rotating])
+
+        return delta_qs
+
+
+class StabilizationSession:
+    """Integrated orientations kept across sync corrections and smoothness changes.
+
+    The gyro data is integrated once on its own clock. A sync correction only remaps
+    the timestamps, and smoothed stabilization rotations are cached per effective time
+    constant, so a new smoothness value only reruns smoothing and resampling. The
+    orientation increments keep their original clock, which differs from integrating
+    on the corrected clock by the relative clock drift (typically well below 0.1%).
+    """
+    def __init__(self, integrator):
+        """
+        Args:
+            integrator (GyroIntegrator): Integrator holding the gyro data on its raw clock
+        """
+
+        self.integrator = integrator
+        self.integrator.integrate_all()
+
+        self.raw_times = np.copy(self.integrator.time_list)
+        self.times = self.raw_times
+
+        self.cached_smooth = None
+        self.cached_stab_rotations = None
+
+    def set_time_correction(self, slope=1, offset=0):
+        """Map the raw gyro clock to video time with corrected = slope * raw + offset
+
+        Args:
+            slope (float, optional): Clock rate correction. Defaults to 1.
+            offset (float, optional): Time offset in seconds. Defaults to 0.
+        """
+        self.set_corrected_times(slope * self.raw_times + offset)
+
+    def set_corrected_times(self, corrected_times):
+        """Use arbitrary increasing video times for the gyro samples, e.g. piecewise drift corrections
+
+        Args:
+            corrected_times (numpy.ndarray): Video time of each gyro sample
+        """
+        self.times = np.asarray(corrected_times, dtype=np.float64)
+
+    def get_stabilize_transform(self, smooth):
+        """Stabilization rotations on the corrected clock
+
+        Args:
+            smooth (float): Smoothing time constant in corrected seconds
+
+        Returns:
+            (np.ndarray, np.ndarray): tuple (corrected times, Nx4 quaternion array)
+        """
+
+        # The smoothing works in raw samples, so convert the time constant to the raw clock
+        clock_rate = (self.raw_times[-1] - self.raw_times[0]) / (self.times[-1] - self.times[0])
+        raw_smooth = smooth * clock_rate
+
+        if raw_smooth != self.cached_smooth:
+            _, self.cached_stab_rotations = self.integrator.get_stabilize_transform(raw_smooth)
+            self.cached_smooth = raw_smooth
+
+        return (self.times, self.cached_stab_rotations)
+
+    def get_interpolated_stab_transform(self, smooth, start=0, interval=1/29.97, frame_times=None):
+        """Stabilization rotations resampled at the video frame times.
+        Same arguments and output as GyroIntegrator.get_interpolated_stab_transform.
+        """
+        time_list, stab_rotations = self.get_stabilize_transform(smooth)
+
+        if frame_times is None:
+            # fixed frame rate until the end of the gyro data
+            num_frames = max(0, int(np.ceil((time_list[-1] - start) / interval)))
+            frame_times = start + np.arange(num_frames) * interval
+
+        out_times = np.asarray(frame_times, dtype=np.float64)
+
+        return (out_times, interpolate_orientations(time_list, stab_rotations, out_times))
+
+
 class FrameRotationIntegrator(GyroIntegrator):
     def __init__(self, input_data, initial_orientation=None):
         """Initialize instance of FrameRotationIntegrator for getting orientation from frame change data
@@ -295,16 +671,30 @@ class FrameRotationIntegrator(GyroIntegrator):
         self.already_integrated = False
 
 
-    def integrate_all(self):
-        """go through each sample and integrate to find orientation. Assumes sample N contains change between N and N-1
+    def integrate_vectorized(self):
+        """Batched version of integrate_all. Assumes sample N contains change between N and N-1
 
         Returns:
             (np.ndarray, np.ndarray): tuple (time_list, quaternion orientation array)
         """
 
-        if self.already_integrated:
-            return (self.time_list, self.orientation_list)
+        delta_qs = self.rates_to_quats(self.data[:,1:], 1) # one frame per sample
 
+        self.orientation_list = np.vstack((np.copy(self.orientation), quat.quaternion_cumprod(delta_qs, self.orientation)))
+        self.orientation = np.copy(self.orientation_list[-1])
+        self.time_list = np.concatenate(([self.data[0][0] - 1], self.data[:,0]))
+
+        self.already_integrated = True
+
+        return (self.time_list, self.orientation_list)
+
+
+    def integrate_loop(self):
+        """go through each sample and integrate to find orientation. Assumes sample N contains change between N and N-1
+
+        Returns:
+            (np.ndarray, np.ndarray): tuple (time_list, quaternion orientation array)
+        """
 
         # temp lists to save data
         temp_orientation_list = []
@@ -379,14 +769,18 @@ class EulerIntegrator:
 
         # Variables to save integration data
         self.euler_orientation_list = None
+        self.orientation_list = None
         self.time_list = None
 
         self.already_integrated = False
 
 
-    def integrate_all(self):
+    def integrate_all(self, vectorized=True):
         """go through each gyro sample and integrate to find orientation
 
+        Args:
+            vectorized (bool, optional): Use the batched NumPy engine instead of the per-sample reference loop. Defaults to True.
+
         Returns:
             (np.ndarray, np.ndarray): tuple (time_list, quaternion orientation array)
         """
@@ -394,11 +788,46 @@ class EulerIntegrator:
         if self.already_integrated:
             return (self.time_list, self.orientation_list)
 
+        if vectorized:
+            return self.integrate_vectorized()
+
+        return self.integrate_loop()
+
+
+    def integrate_vectorized(self):
+        """Batched version of integrate_all using a cumulative sum of the angle increments
+
+        Returns:
+            (np.ndarray, np.ndarray): tuple (time_list, quaternion orientation array)
+        """
+
+        times = self.data[:,0]
+
+        # symmetrical dt calculation, same as the loop
+        padded_times = np.concatenate((times[:1], times, times[-1:]))
+        delta_times = (padded_times[2:] - padded_times[:-2])/2
+
+        self.euler_orientation_list = np.cumsum(self.data[:,1:] * delta_times[:,np.newaxis], axis=0)
+        self.orientation_list = self.euler_to_quat_array(self.euler_orientation_list)
+        self.time_list = np.copy(times)
+
+        self.already_integrated = True
+
+        return (self.time_list, self.orientation_list)
+
+
+    def integrate_loop(self):
+        """Reference implementation of integrate_all stepping through each sample in Python
+
+        Returns:
+            (np.ndarray, np.ndarray): tuple (time_list, quaternion orientation array)
+        """
+
         # temp lists to save data
         temp_orientation_list = []
         temp_time_list = []
 
-        euler_orientation = np.array([0, 0, 0])
+        euler_orientation = np.array([0, 0, 0], dtype=np.float64)
 
         for i in range(self.num_data_points):
 
@@ -423,6 +852,7 @@ class EulerIntegrator:
 
 
         self.euler_orientation_list = np.array(temp_orientation_list)
+        self.orientation_list = self.euler_to_quat_array(self.euler_orientation_list)
         self.time_list = np.array(temp_time_list)
 
         self.already_integrated = True
@@ -430,6 +860,20 @@ class EulerIntegrator:
         return (self.time_list, self.orientation_list)
 
 
+    def euler_to_quat_array(self, euler_angles):
+        """Faux orientation quaternions from integrated xyz angles
+
+        Args:
+            euler_angles (numpy.ndarray): Nx3 array of accumulated angles in rad
+
+        Returns:
+            numpy.ndarray: Nx4 quaternion array [w, x, y, z]
+        """
+        from scipy.spatial.transform import Rotation
+        xyzw = Rotation.from_euler("xyz", euler_angles).as_quat()
+        return np.column_stack((xyzw[:,3], xyzw[:,:3]))
+
+
     def get_orientations(self):
         """Get the processed quaternion orientations
 
@@ -483,45 +927,34 @@ class EulerIntegrator:
 
 
         # rotations that'll stabilize the camera
-        stab_rotations = np.zeros(self.orientation_list.shape)
-
-        for i in range(self.num_data_points):
-            # rotation quaternion from smooth motion -> raw motion to counteract it
-            stab_rotations[i,:] = quat.rot_between(smoothed_orientation[i],self.orientation_list[i])
+        # rotation quaternion from smooth motion -> raw motion to counteract it
+        stab_rotations = quat.rot_between_array(smoothed_orientation, self.orientation_list)
 
         return (self.time_list, stab_rotations) 
 
         
-    def get_interpolated_stab_transform(self,smooth, start=0, interval=1/29.97):
-        time_list, smoothed_orientation = self.get_stabilize_transform(smooth)
-
-        time = start
-
-        out_times = []
-        slerped_rotations = []
-
-        while time < 0:
-            slerped_rotations.append(smoothed_orientation[0])
-            out_times.append(time)
-            time += interval
-
-        while time_list[0] >= time:
-            slerped_rotations.append(smoothed_orientation[0])
-            out_times.append(time)
-            time += interval
+    def get_interpolated_stab_transform(self,smooth, start=0, interval=1/29.97, frame_times=None):
+        """Stabilization rotations resampled at the video frame times
 
+        Args:
+            smooth (float): Smoothing time constant
+            start (float, optional): Time of the first frame. Defaults to 0.
+            interval (float, optional): Time between frames. Defaults to 1/29.97.
+            frame_times (numpy.ndarray, optional): Per-frame timestamps, e.g. for VFR video. Overrides start and interval.
 
-        for i in range(len(time_list)-1):
-            if time_list[i] <= time < time_list[i+1]:
+        Returns:
+            (np.ndarray, np.ndarray): tuple (frame times, Nx4 quaternion array)
+        """
+        time_list, smoothed_orientation = self.get_stabilize_transform(smooth)
 
-                # interpolate between two quaternions
-                weight = (time - time_list[i])/(time_list[i+1]-time_list[i])
-                slerped_rotations.append(quat.slerp(smoothed_orientation[i],smoothed_orientation[i+1],[weight]))
-                out_times.append(time)
+        if frame_times is None:
+            # fixed frame rate until the end of the gyro data
+            num_frames = max(0, int(np.ceil((time_list[-1] - start) / interval)))
+            frame_times = start + np.arange(num_frames) * interval
 
-                time += interval
+        out_times = np.asarray(frame_times, dtype=np.float64)
 
-        return (out_times, slerped_rotations)
+        return (out_times, interpolate_orientations(time_list, smoothed_orientation, out_times))
 
     def get_raw_data(self, axis):
         """get a column of the raw data. Either time or gyro.
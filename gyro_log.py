@@ -0,0 +1,184 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+import struct
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+# File layout: magic, header length (uint32 little endian), JSON header padded
+# to DATA_ALIGNMENT, then one contiguous float64 array per field
+CACHE_MAGIC = b"GFGYRO01"
+CACHE_SUFFIX = ".gyrocache"
+DATA_ALIGNMENT = 64
+
+
+def get_cache_path(logpath, params):
+    """Get the path of the binary cache for a log and a set of loader parameters
+
+    Args:
+        logpath (string): Path to the gyro log or video with embedded gyro data
+        params (dict): Loader parameters that change the decoded data
+
+    Returns:
+        string: Cache file path next to the log
+    """
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:8]
+    return "{}.{}{}".format(logpath, digest, CACHE_SUFFIX)
+
+
+def write_gyro_cache(cachepath, data, fields, source_stat, params):
+    """Write gyro data to the binary cache format
+
+    Args:
+        cachepath (string): Output path
+        data (np.ndarray): NxM samples, one column per field
+        fields (list): Field names of the columns
+        source_stat (os.stat_result): Stat of the log when it was parsed
+        params (dict): Loader parameters stored for validation
+    """
+    data = np.asarray(data, dtype="<f8")
+    header = {
+        "fields": list(fields),
+        "rows": int(data.shape[0]),
+        "dtype": "<f8",
+        "source_size": source_stat.st_size,
+        "source_mtime_ns": source_stat.st_mtime_ns,
+        "params": params,
+    }
+    header_bytes = json.dumps(header, sort_keys=True).encode()
+    data_offset = -(-(len(CACHE_MAGIC) + 4 + len(header_bytes)) // DATA_ALIGNMENT) * DATA_ALIGNMENT
+    header_bytes = header_bytes.ljust(data_offset - len(CACHE_MAGIC) - 4)
+
+    tmp_path = cachepath + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(CACHE_MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        # Column major, so each field is contiguous on disk
+        f.write(np.ascontiguousarray(data.T).tobytes())
+    os.replace(tmp_path, cachepath)
+
+
+def read_gyro_cache(cachepath, source_stat = None, params = None):
+    """Memory map a binary gyro cache
+
+    Args:
+        cachepath (string): Cache file path
+        source_stat (os.stat_result, optional): Current stat of the log. The cache is
+            rejected if the size or modification time changed.
+        params (dict, optional): Loader parameters the cache has to match
+
+    Returns:
+        (np.ndarray, list): NxM copy-on-write view of the samples and the field names,
+            or (None, None) if the cache is missing or stale
+    """
+    try:
+        with open(cachepath, "rb") as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None, None
+            header_length, = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_length))
+    except (OSError, ValueError, struct.error):
+        return None, None
+
+    if source_stat is not None and (header["source_size"] != source_stat.st_size or
+                                    header["source_mtime_ns"] != source_stat.st_mtime_ns):
+        return None, None
+    if params is not None and header["params"] != json.loads(json.dumps(params)):
+        return None, None
+
+    shape = (len(header["fields"]), header["rows"])
+    if header["rows"] == 0:
+        return np.zeros(shape[::-1]), header["fields"]
+
+    # Copy on write: callers may adjust axes in place without touching the file
+    columns = np.memmap(cachepath, dtype=header["dtype"], mode="c", offset=len(CACHE_MAGIC) + 4 + header_length, shape=shape)
+    return np.asarray(columns).T, header["fields"]
+
+
+def load_gyro_log(logpath, parse, fields = ("t", "x", "y", "z"), use_cache = True, **params):
+    """Load gyro data through the binary cache next to the log
+
+    The first load parses the log and writes the cache. Later loads memory map it
+    as long as the log has the same size and modification time.
+
+    Args:
+        logpath (string): Path to the gyro log or video with embedded gyro data
+        parse (callable): Parses the log, returns NxM samples in the order of fields
+        fields (tuple, optional): Field names. Defaults to ("t", "x", "y", "z").
+        use_cache (bool, optional): Read and write the cache. Defaults to True.
+        **params: Loader parameters that change the decoded data, part of the cache identity
+
+    Returns:
+        np.ndarray: NxM samples
+    """
+    if not use_cache:
+        return np.asarray(parse())
+
+    params = dict(params, fields=list(fields))
+    source_stat = os.stat(logpath)
+    cachepath = get_cache_path(logpath, params)
+
+    data, _ = read_gyro_cache(cachepath, source_stat, params)
+    if data is not None:
+        print("Using gyro cache {}".format(cachepath))
+        return data
+
+    data = np.asarray(parse(), dtype=np.float64)
+
+    try:
+        write_gyro_cache(cachepath, data, fields, source_stat, params)
+    except OSError as e:
+        print("Could not write gyro cache: {}".format(e))
+
+    return data
+
+
+def read_blackbox_csv(csvpath, cam_angle_degrees = 0, chunk_rows = 100000):
+    """Read the gyro columns of a Betaflight Blackbox CSV export
+
+    Only the time and gyroADC columns are parsed, in chunks of rows, so memory
+    use is bounded by the Nx4 result and one chunk of text.
+
+    Args:
+        csvpath (string): Path to the CSV export
+        cam_angle_degrees (float, optional): Camera uptilt rotation around x. Defaults to 0.
+        chunk_rows (int, optional): Rows parsed at a time. Defaults to 100000.
+
+    Returns:
+        np.ndarray: Nx4 array of [time, gyroX, gyroY, gyroZ] in seconds and rad/s
+    """
+    chunks = []
+    with open(csvpath) as f:
+        # Skip the key/value preamble up to the column header
+        gyro_index = None
+        for row in csv.reader(f):
+            if row and row[0] == "loopIteration":
+                gyro_index = row.index("gyroADC[0]")
+                break
+
+        if gyro_index is None:
+            raise ValueError("No loopIteration header found in {}".format(csvpath))
+
+        # time, gyroADC[0], gyroADC[1], gyroADC[2]
+        usecols = (1, gyro_index, gyro_index + 1, gyro_index + 2)
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                break
+            chunks.append(np.loadtxt(lines, delimiter=",", usecols=usecols, ndmin=2))
+
+    raw = np.concatenate(chunks) if chunks else np.zeros((0, 4))
+
+    gyroscale = np.pi/180
+    to_rotate = np.column_stack((-raw[:,2], raw[:,3], -raw[:,1])) * gyroscale
+    rotation = Rotation.from_euler('x', cam_angle_degrees, degrees=True).as_matrix()
+
+    gyro_data = np.empty(raw.shape)
+    gyro_data[:,0] = raw[:,0] / 1000000
+    gyro_data[:,1:] = to_rotate @ rotation.T
+
+    return gyro_data
@@ -1,25 +1,32 @@
 """Main file containing UI code"""
 
 import sys
+
+if __name__ == "__main__" and sys.argv[1:2] == ["batch"]:
+    # Headless mode: python -m gyroflow batch jobs.json. Runs before the Qt import,
+    # and worker processes that re-import the main module get the batch module
+    import batch
+    sys.modules["__main__"] = batch
+    sys.exit(batch.main(sys.argv[2:]))
+
 import random
 import cv2
 import os
 import numpy as np
 from PySide2 import QtCore, QtWidgets, QtGui
 from _version import __version__
-from vidgear.gears.helper import get_valid_ffmpeg_path
-import calibrate_video
 import time
 import nonlinear_stretch
 import urllib.request
 import json
 import re
-import calibrate_video
 import subprocess
 import bundled_images
+from video_info import probe_video
 
 
-import stabilizer
+# calibrate_video, stabilizer and vidgear pull in scipy, tkinter and ffmpeg helpers,
+# they are imported when a utility needs them so the launcher opens quickly
 
 # https://en.wikipedia.org/wiki/List_of_digital_camera_brands
 cam_company_list = ["GoPro", "Runcam", "Insta360", "Caddx", "Foxeer", "DJI", "RED", "Canon", "Arri",
@@ -664,6 +671,7 @@ class CalibratorUtility(QtWidgets.QMainWindow):
         self.main_widget.show()
 
         # initialize instance of calibrator class
+        import calibrate_video
         self.calibrator = calibrate_video.FisheyeCalibrator(chessboard_size=self.chessboard_size)
 
 
@@ -677,6 +685,7 @@ class CalibratorUtility(QtWidgets.QMainWindow):
         self.video_viewer.next_frame()
 
         # reset calibrator and info
+        import calibrate_video
         self.calibrator = calibrate_video.FisheyeCalibrator(chessboard_size=self.chessboard_size)
         self.update_calib_info()
 
@@ -1546,6 +1555,18 @@ class StabUtilityBarebone(QtWidgets.QMainWindow):
         self.sync_search_size.setValue(10)
         self.sync_controls_layout.addWidget(self.sync_search_size)
 
+        # More than two slices are spread over the whole clip and fitted robustly, ignoring the sync timestamps
+        self.sync_controls_layout.addWidget(QtWidgets.QLabel("Number of sync slices (more than 2 spreads them over the clip)"))
+        self.sync_slices_control = QtWidgets.QSpinBox(self)
+        self.sync_slices_control.setMinimum(2)
+        self.sync_slices_control.setMaximum(30)
+        self.sync_slices_control.setValue(2)
+        self.sync_controls_layout.addWidget(self.sync_slices_control)
+
+        self.piecewise_drift_select = QtWidgets.QCheckBox("Piecewise clock drift (multi slice sync)")
+        self.piecewise_drift_select.setChecked(False)
+        self.sync_controls_layout.addWidget(self.piecewise_drift_select)
+
         # Select method for doing low-pass filtering
         self.sync_controls_layout.addWidget(QtWidgets.QLabel("Smoothing method"))
         self.stabilization_algo_select = QtWidgets.QComboBox()
@@ -1566,6 +1587,13 @@ class StabUtilityBarebone(QtWidgets.QMainWindow):
         self.smooth_slider.setTickInterval(1)
         self.smooth_slider.valueChanged.connect(self.smooth_changed)
 
+        # Restabilize once the value stops changing, for dragging as well as keys and mouse wheel
+        self.smooth_update_timer = QtCore.QTimer(self)
+        self.smooth_update_timer.setSingleShot(True)
+        self.smooth_update_timer.setInterval(150)
+        self.smooth_update_timer.timeout.connect(self.smooth_settled)
+        self.smooth_slider.valueChanged.connect(lambda: self.smooth_update_timer.start())
+
         self.sync_controls_layout.addWidget(self.smooth_text)
         self.sync_controls_layout.addWidget(self.smooth_slider)
 
@@ -1828,16 +1856,14 @@ class StabUtilityBarebone(QtWidgets.QMainWindow):
 
         # Extract information about the clip
 
-        cap = cv2.VideoCapture(self.infile_path)
-        self.video_info_dict["width"] = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.video_info_dict["height"] = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        self.video_info_dict["fps"] = cap.get(cv2.CAP_PROP_FPS)
-        self.video_info_dict["time"] = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) / self.video_info_dict["fps"]) 
+        info = probe_video(self.infile_path)
+        self.video_info_dict["width"] = info.width
+        self.video_info_dict["height"] = info.height
+        self.video_info_dict["fps"] = info.fps
+        self.video_info_dict["time"] = int(info.duration)
 
         self.video_info_dict["aspect"] = 0 if self.video_info_dict["height"] == 0 else self.video_info_dict["width"]/self.video_info_dict["height"]
 
-        cap.release()
-
         self.display_video_info()
 
         no_suffix = os.path.splitext(self.infile_path)[0]
@@ -1884,6 +1910,7 @@ class StabUtilityBarebone(QtWidgets.QMainWindow):
         self.open_preset_button.setText("Preset file: {}".format(self.preset_path.split("/")[-1]))
         self.open_preset_button.setStyleSheet("font-weight:bold;")
 
+        import calibrate_video
         self.preset_info_dict = calibrate_video.FisheyeCalibrator().load_calibration_json(self.preset_path)
         #print(self.preset_info_dict)
         self.display_preset_info()
@@ -1983,6 +2010,12 @@ class StabUtilityBarebone(QtWidgets.QMainWindow):
         smooth_val = (raw_val/100)**3 * self.smooth_max_period
         self.smooth_text.setText(self.smooth_text_template.format(smooth_val, raw_val))
 
+    def smooth_settled(self):
+        """Restabilize with the new smoothness, reusing the integrated gyro data of the last sync
+        """
+        if self.analyzed:
+            self.stab.update_smoothness(self.get_smoothness_timeconstant())
+
     def get_smoothness_timeconstant(self):
         """ Nonlinear smoothness slider
         """
@@ -2004,6 +2037,7 @@ class StabUtilityBarebone(QtWidgets.QMainWindow):
     def recompute_stab(self):
         """Update sync and stabilization
         """
+        import stabilizer
 
 
         if self.infile_path == "" or self.preset_path == "":
@@ -2016,13 +2050,11 @@ class StabUtilityBarebone(QtWidgets.QMainWindow):
         OF_slice_length = self.OF_frames_control.value()
 
 
-        cap = cv2.VideoCapture(self.infile_path)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
-        cap.release()
+        info = probe_video(self.infile_path)
+        width = info.width
+        height = info.height
+        fps = info.fps
+        num_frames = info.num_frames
 
         sync1_frame = int(self.sync1_control.value() * fps)
         sync2_frame = int(self.sync2_control.value() * fps)
@@ -2087,8 +2119,14 @@ class StabUtilityBarebone(QtWidgets.QMainWindow):
         
         
 
-        self.stab.auto_sync_stab(smoothness_time_constant, sync1_frame, sync2_frame,
-                                 OF_slice_length, debug_plots=self.sync_debug_select.isChecked())
+        num_slices = self.sync_slices_control.value()
+        if num_slices > 2:
+            self.stab.multi_sync_stab(smoothness_time_constant, num_slices, OF_slice_length,
+                                      piecewise=self.piecewise_drift_select.isChecked(),
+                                      debug_plots=self.sync_debug_select.isChecked())
+        else:
+            self.stab.auto_sync_stab(smoothness_time_constant, sync1_frame, sync2_frame,
+                                     OF_slice_length, debug_plots=self.sync_debug_select.isChecked())
 
         self.recompute_stab_button.setText("Recompute sync")
         self.export_button.setEnabled(True)
@@ -2192,6 +2230,7 @@ class StabUtilityBarebone(QtWidgets.QMainWindow):
         QtWidgets.QMessageBox.critical(self, "Something's gone awry", msg)
 
     def get_available_encoders(self):
+        from vidgear.gears.helper import get_valid_ffmpeg_path
         if(get_valid_ffmpeg_path()):  # Helper function from VidGear
             ffmpeg_encoders_sp = subprocess.run([get_valid_ffmpeg_path(),'-encoders'], check=True, stdout=subprocess.PIPE, universal_newlines=True)
             return ffmpeg_encoders_sp.stdout
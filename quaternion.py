@@ -1,60 +1,165 @@
 import numpy as np
 from scipy.spatial.transform import Rotation
 
+# Quaternions are stored as [w, x, y, z]. The *_array functions work on Nx4 arrays
+# (or anything with the quaternion along the last axis) and the single quaternion
+# functions below are thin wrappers around them.
+
 def quaternion(w,x,y,z):
     return np.array([w,x,y,z])
 
 def vector(x,y,z):
     return np.array([x,y,z])
 
+def normalize_array(Q):
+    """Normalize each quaternion (last axis) to unit length"""
+    Q = np.asarray(Q, dtype=np.float64)
+    return Q / np.linalg.norm(Q, axis=-1, keepdims=True)
+
 def normalize(q):
-    return q/np.sqrt(q.dot(q)) # q/|q|
+    return normalize_array(q) # q/|q|
 
 # https://stackoverflow.com/questions/39000758/how-to-multiply-two-quaternions-by-python-or-numpy
-def quaternion_multiply(Q1, Q2):
-    w0, x0, y0, z0 = Q2
-    w1, x1, y1, z1 = Q1
-    return np.array([-x1 * x0 - y1 * y0 - z1 * z0 + w1 * w0,
+def quaternion_multiply_array(Q1, Q2):
+    """Row-wise quaternion product Q1 * Q2. A single quaternion is broadcast against an Nx4 array"""
+    w0, x0, y0, z0 = np.moveaxis(np.asarray(Q2, dtype=np.float64), -1, 0)
+    w1, x1, y1, z1 = np.moveaxis(np.asarray(Q1, dtype=np.float64), -1, 0)
+    return np.stack([-x1 * x0 - y1 * y0 - z1 * z0 + w1 * w0,
                      x1 * w0 + y1 * z0 - z1 * y0 + w1 * x0,
                      -x1 * z0 + y1 * w0 + z1 * x0 + w1 * y0,
-                     x1 * y0 - y1 * x0 + z1 * w0 + w1 * z0])
+                     x1 * y0 - y1 * x0 + z1 * w0 + w1 * z0], axis=-1)
+
+def quaternion_multiply(Q1, Q2):
+    return quaternion_multiply_array(Q1, Q2)
 
+def left_matrix(q):
+    """4x4 matrix L such that L @ p equals quaternion_multiply(q, p)"""
+    w, x, y, z = q
+    return np.array([[w, -x, -y, -z],
+                     [x,  w, -z,  y],
+                     [y,  z,  w, -x],
+                     [z, -y,  x,  w]])
 
 # https://www.mathworks.com/help/aeroblks/quaternioninverse.html
+def conjugate_array(Q):
+    """Negate imaginary components. Same as the inverse for unit quaternions"""
+    return np.asarray(Q, dtype=np.float64) * np.array([1, -1, -1, -1])
+
 def inverse(q):
     # negate imaginary components to get inverse of unit quat
-    return quaternion(q[0],-q[1],-q[2],-q[3])
+    return conjugate_array(q)
+
+def rot_between_array(Q1, Q2):
+    """Row-wise rotation quaternions from Q1 to Q2"""
+    return quaternion_multiply_array(conjugate_array(Q1), Q2)
 
 def rot_between(q1, q2):
     """Compute rotation quaternion from q1 to q2"""
 
     # https://www.gamedev.net/forums/topic/423462-rotation-difference-between-two-quaternions/
-    return quaternion_multiply(inverse(q1), q2)
+    return rot_between_array(q1, q2)
+
+def log_array(Q):
+    """Logarithm map of unit quaternions along the shortest path. Returns Nx3 half-angle rotation vectors"""
+    Q = np.asarray(Q, dtype=np.float64)
+    Q = np.where(Q[...,:1] < 0, -Q, Q)
+    vec_norm = np.linalg.norm(Q[...,1:], axis=-1)
+    half_angle = np.arctan2(vec_norm, Q[...,0])
+    scale = np.ones(vec_norm.shape)
+    nonzero = vec_norm > 1.0e-12
+    scale[nonzero] = half_angle[nonzero] / vec_norm[nonzero]
+    return Q[...,1:] * scale[...,np.newaxis]
+
+def exp_array(V):
+    """Exponential map from Nx3 half-angle rotation vectors to Nx4 unit quaternions"""
+    V = np.asarray(V, dtype=np.float64)
+    half_angle = np.linalg.norm(V, axis=-1)
+    scale = np.ones(half_angle.shape)
+    nonzero = half_angle > 1.0e-12
+    scale[nonzero] = np.sin(half_angle[nonzero]) / half_angle[nonzero]
+    return np.concatenate((np.cos(half_angle)[...,np.newaxis], V * scale[...,np.newaxis]), axis=-1)
 
 # https://en.wikipedia.org/wiki/Slerp
-def slerp(v0, v1, t_array):
-    """Spherical linear interpolation."""
-    # >>> slerp([1,0,0,0], [0,0,0,1], np.arange(0, 1, 0.001))
-    t_array = np.array(t_array)
-    v0 = np.array(v0)
-    v1 = np.array(v1)
-    dot = np.sum(v0 * v1)
-
-    if dot < 0.0:
-        v1 = -v1
-        dot = -dot
-    
+def slerp_array(Q0, Q1, t_array):
+    """Row-wise spherical linear interpolation from Q0 to Q1 with one weight per row"""
+    t_array = np.asarray(t_array, dtype=np.float64).reshape(-1)
+    Q0 = np.atleast_2d(np.asarray(Q0, dtype=np.float64))
+    Q1 = np.atleast_2d(np.asarray(Q1, dtype=np.float64))
+
+    num_rows = max(Q0.shape[0], Q1.shape[0], t_array.shape[0])
+    Q0 = np.broadcast_to(Q0, (num_rows, 4))
+    Q1 = np.broadcast_to(Q1, (num_rows, 4))
+    t_array = np.broadcast_to(t_array, (num_rows,))
+
+    dot = np.sum(Q0 * Q1, axis=1)
+
+    # shortest path
+    Q1 = np.where(dot[:,np.newaxis] < 0.0, -Q1, Q1)
+    dot = np.abs(dot)
+
+    result = np.empty((num_rows, 4))
+
+    # linear interpolation for nearby quaternions
     DOT_THRESHOLD = 0.9995
-    if dot > DOT_THRESHOLD:
-        result = v0[np.newaxis,:] + t_array[:,np.newaxis] * (v1 - v0)[np.newaxis,:]
-        return (result.T / np.linalg.norm(result, axis=1)).T
-    
-    theta_0 = np.arccos(dot)
+    close = dot > DOT_THRESHOLD
+    far = ~close
+
+    lerped = Q0[close] + t_array[close,np.newaxis] * (Q1[close] - Q0[close])
+    result[close] = lerped / np.linalg.norm(lerped, axis=1)[:,np.newaxis]
+
+    theta_0 = np.arccos(dot[far])
     sin_theta_0 = np.sin(theta_0)
 
-    theta = theta_0 * t_array
+    theta = theta_0 * t_array[far]
     sin_theta = np.sin(theta)
-    
-    s0 = np.cos(theta) - dot * sin_theta / sin_theta_0
+
+    s0 = np.cos(theta) - dot[far] * sin_theta / sin_theta_0
     s1 = sin_theta / sin_theta_0
-    return (s0[:,np.newaxis] * v0[np.newaxis,:]) + (s1[:,np.newaxis] * v1[np.newaxis,:])
\ No newline at end of file
+    result[far] = (s0[:,np.newaxis] * Q0[far]) + (s1[:,np.newaxis] * Q1[far])
+
+    return result
+
+def slerp(v0, v1, t_array):
+    """Spherical linear interpolation."""
+    # >>> slerp([1,0,0,0], [0,0,0,1], np.arange(0, 1, 0.001))
+    return slerp_array(v0, v1, t_array)
+
+def rotation_matrix_array(Q):
+    """Nx3x3 rotation matrices from Nx4 unit quaternions"""
+    w, x, y, z = np.moveaxis(normalize_array(Q), -1, 0)
+    return np.stack([np.stack([1 - 2*(y*y + z*z), 2*(x*y - z*w),     2*(x*z + y*w)], axis=-1),
+                     np.stack([2*(x*y + z*w),     1 - 2*(x*x + z*z), 2*(y*z - x*w)], axis=-1),
+                     np.stack([2*(x*z - y*w),     2*(y*z + x*w),     1 - 2*(x*x + y*y)], axis=-1)], axis=-2)
+
+def quaternion_cumprod(delta_qs, initial_orientation, chunk_size=4096):
+    """Compose a sequence of rotation quaternions, equivalent to repeatedly doing
+    orientation = normalize(orientation * delta_q).
+
+    Within each chunk a log-step (Hillis-Steele) scan is used, the chunks are then
+    chained together through the last orientation of the previous chunk.
+
+    Args:
+        delta_qs (numpy.ndarray): Nx4 array of rotation quaternions
+        initial_orientation (numpy.ndarray): Quaternion to start from
+        chunk_size (int, optional): Samples per scan block. Defaults to 4096.
+
+    Returns:
+        numpy.ndarray: Nx4 array of orientations after each delta
+    """
+    orientations = np.empty((delta_qs.shape[0], 4))
+    carry = np.array(initial_orientation, dtype=np.float64)
+
+    for start in range(0, delta_qs.shape[0], chunk_size):
+        block = np.array(delta_qs[start:start + chunk_size], dtype=np.float64)
+
+        step = 1
+        while step < block.shape[0]:
+            block[step:] = normalize_array(quaternion_multiply_array(block[:-step], block[step:]))
+            step *= 2
+
+        block = normalize_array(quaternion_multiply_array(carry, block))
+
+        orientations[start:start + block.shape[0]] = block
+        carry = block[-1]
+
+    return orientations
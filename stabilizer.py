@@ -5,17 +5,22 @@ import platform
 
 from calibrate_video import FisheyeCalibrator, StandardCalibrator
 from scipy.spatial.transform import Rotation
-from gyro_integrator import GyroIntegrator, FrameRotationIntegrator
-from blackbox_extract import BlackboxExtractor
-from GPMF_gyro import Extractor
-from matplotlib import pyplot as plt
-from vidgear.gears import WriteGear
-from vidgear.gears import helper as vidgearHelper
+from gyro_integrator import GyroIntegrator, FrameRotationIntegrator, GyroRateIndex, StabilizationSession
 from _version import __version__
-
-from scipy import signal, interpolate
+from frame_source import FrameSource
+from analysis_cache import AnalysisCache, video_fingerprint
+from gyro_log import load_gyro_log, read_blackbox_csv
 
 import time
+import os
+import copy
+import shutil
+import tempfile
+import subprocess
+import queue
+import threading
+import collections
+import concurrent.futures
 
 
 class Stabilizer:
@@ -27,8 +32,23 @@ class Stabilizer:
         self.better_sync_search_interval = 0.2
         self.gyro_lpf_cutoff = -1
 
+        # Frame width used for optical flow analysis. None analyzes full resolution
+        self.analysis_width = 1280
+        self.analysis_source = None
+        # Threads for tracking sync slices and solving frame pair rotations
+        self.analysis_workers = os.cpu_count() or 1
+        self.use_essential_matrix = True
+        # Feature detection settings. minDistance is given at full resolution
+        self.feature_params = dict(maxCorners=200, qualityLevel=0.01, minDistance=30, blockSize=3)
+        # Tracked slices are reused between runs on the same video. None disables the cache
+        self.analysis_cache = AnalysisCache()
+        self.video_fingerprint = None
+
 
         # General video stuff
+        self.videopath = None
+        self.frame_source = None
+        self.video_info = None
         self.cap = 0
         self.width = 0
         self.height = 0
@@ -42,6 +62,8 @@ class Stabilizer:
         self.map2 = None
 
         self.integrator = None #GyroIntegrator(self.gyro_data,initial_orientation=initial_orientation)
+        self.gyro_rate_index = None
+        self.stab_session = None
         self.times = None
         self.stab_transform = None
 
@@ -57,6 +79,179 @@ class Stabilizer:
     def set_gyro_lpf(self, cutoff_frequency = -1):
         self.gyro_lpf_cutoff = cutoff_frequency
 
+    def get_gyro_rate_index(self):
+        """Get the prefix integral of the raw gyro rates, built once per clip
+
+        Returns:
+            GyroRateIndex: Index over integrator.get_raw_data("xyz")
+        """
+        if self.gyro_rate_index is None:
+            self.gyro_rate_index = GyroRateIndex(self.integrator.get_raw_data("t"), self.integrator.get_raw_data("xyz"))
+        return self.gyro_rate_index
+
+    def get_stab_session(self):
+        """Get the stabilization session integrating the gyro data once per clip
+
+        Returns:
+            StabilizationSession: Session on the clock of integrator.get_raw_data("t")
+        """
+        if self.stab_session is None:
+            initial_orientation = Rotation.from_euler('xyz', [0, 0, 0], degrees=True).as_quat()
+
+            session_gyro_data = np.copy(self.gyro_data)
+            session_gyro_data[:,0] = self.integrator.get_raw_data("t")
+
+            self.stab_session = StabilizationSession(GyroIntegrator(session_gyro_data, zero_out_time=False,
+                                                                    initial_orientation=initial_orientation))
+        return self.stab_session
+
+    def update_smoothness(self, smooth=0.8):
+        """Recompute the stabilization with a new smoothness, keeping the current sync
+
+        Args:
+            smooth (float, optional): Smoothing time constant. Defaults to 0.8.
+        """
+        self.last_smooth = smooth
+
+        # Variable frame rate clips are stabilized at the actual frame timestamps
+        frame_times = None
+        if self.video_info is not None and self.video_info.is_variable_frame_rate():
+            frame_times = self.video_info.get_frame_times()
+            # The render loop reads up to num_frames frames, continue past the probed times at the nominal rate
+            missing = self.num_frames - len(frame_times)
+            if missing > 0:
+                frame_times = np.concatenate((frame_times, frame_times[-1] + np.arange(1, missing + 1) / self.fps))
+
+        self.times, self.stab_transform = self.get_stab_session().get_interpolated_stab_transform(smooth=smooth,start=0,interval = 1/self.fps,
+                                                                                                  frame_times=frame_times)
+
+    def set_analysis_width(self, width = 1280):
+        self.analysis_width = width
+        if self.analysis_source:
+            self.analysis_source.release()
+            self.analysis_source = None
+
+    def get_analysis_scale(self):
+        """Get the downscaling of the analysis frames without opening the video
+
+        Returns:
+            float: Analysis frame width relative to the video width
+        """
+        if self.analysis_width and self.width > self.analysis_width:
+            return self.analysis_width / self.width
+        return 1
+
+    def get_analysis_source(self):
+        """Get the grayscale, downscaled frame source used for optical flow
+
+        Returns:
+            FrameSource: Analysis frame source
+        """
+        if self.analysis_source is None:
+            self.analysis_source = FrameSource(self.videopath, gray=True, scale=self.get_analysis_scale())
+            self.analysis_source.keyframes = self.frame_source.get_keyframes()
+
+        return self.analysis_source
+
+    def set_analysis_cache(self, cache = None):
+        self.analysis_cache = cache
+
+    def get_slice_cache_key(self, start_frame, analyze_length):
+        """Get the analysis cache key of a slice
+
+        Args:
+            start_frame (int): First frame of the slice
+            analyze_length (int): Number of analyzed frames
+
+        Returns:
+            string: Cache key covering the video content, slice, calibration and tracker settings
+        """
+        if self.video_fingerprint is None:
+            self.video_fingerprint = video_fingerprint(self.videopath)
+
+        return self.analysis_cache.make_key(video = self.video_fingerprint,
+                                            start_frame = int(start_frame),
+                                            analyze_length = int(analyze_length),
+                                            dimension = [self.width, self.height],
+                                            calib_dimension = np.asarray(self.undistort.calib_dimension).tolist(),
+                                            K = np.asarray(self.undistort.K).tolist(),
+                                            D = np.asarray(self.undistort.D).tolist(),
+                                            analysis_scale = self.get_analysis_scale(),
+                                            feature_params = self.feature_params,
+                                            use_essential_matrix = self.use_essential_matrix)
+
+    def load_slice_analysis(self, start_frame, analyze_length):
+        """Load a tracked slice from the analysis cache
+
+        Args:
+            start_frame (int): First frame of the slice
+            analyze_length (int): Number of analyzed frames
+
+        Returns:
+            tuple: (frame times, transforms, previous points, current points), or None if not cached
+        """
+        if not self.analysis_cache or not self.videopath:
+            return None
+
+        data = self.analysis_cache.load(self.get_slice_cache_key(start_frame, analyze_length))
+        if data is None:
+            return None
+
+        print("Using cached optical flow for frames {}-{}".format(start_frame, start_frame + analyze_length))
+        splits = np.cumsum(data["point_counts"])[:-1]
+        return (data["frame_times"].tolist(), data["transforms"],
+                np.split(data["prev_pts"], splits), np.split(data["curr_pts"], splits))
+
+    def save_slice_analysis(self, start_frame, analyze_length, frame_times, transforms, prev_pts_lst, curr_pts_lst):
+        if not self.analysis_cache or not self.videopath:
+            return
+
+        empty = np.zeros((0, 1, 2), dtype=np.float32)
+        self.analysis_cache.save(self.get_slice_cache_key(start_frame, analyze_length),
+                                 frame_times = np.array(frame_times, dtype=float),
+                                 transforms = np.array(transforms, dtype=float).reshape(-1, 3),
+                                 point_counts = np.array([len(pts) for pts in prev_pts_lst], dtype=int),
+                                 prev_pts = np.concatenate(prev_pts_lst) if prev_pts_lst else empty,
+                                 curr_pts = np.concatenate(curr_pts_lst) if curr_pts_lst else empty)
+
+    def set_analysis_workers(self, workers = None):
+        self.analysis_workers = workers or os.cpu_count() or 1
+
+    def analysis_accuracy_report(self, start_frame = 10, analyze_length = 50, widths = (None, 1920, 1280, 960, 640)):
+        """Compare sync offset and run time of optical flow analysis at different resolutions
+
+        Args:
+            start_frame (int, optional): First frame of the analyzed slice. Defaults to 10.
+            analyze_length (int, optional): Number of analyzed frames. Defaults to 50.
+            widths (tuple, optional): Analysis widths to test. None is full resolution.
+
+        Returns:
+            list: (width, seconds, offset, difference to full resolution in gyro samples) for each width
+        """
+        original_width = self.analysis_width
+        gyro_times = self.integrator.get_raw_data("t")
+        gyro_period = (gyro_times[-1] - gyro_times[0]) / (len(gyro_times) - 1)
+
+        results = []
+        reference = None
+        for width in widths:
+            self.set_analysis_width(width)
+            start = time.time()
+            offset, _, _ = self.optical_flow_comparison(start_frame, analyze_length, debug_plots = False)
+            elapsed = time.time() - start
+
+            if reference is None:
+                reference = offset
+            results.append((width, elapsed, offset, (offset - reference) / gyro_period))
+
+        self.set_analysis_width(original_width)
+
+        print("Analysis width | time (s) | offset (s) | diff (gyro samples)")
+        for width, elapsed, offset, diff in results:
+            print("{:>14} | {:8.2f} | {:10.4f} | {:+.2f}".format(width if width else "full", elapsed, offset, diff))
+
+        return results
+
     def filter_gyro(self):
 
         # Replaces self.gyrodata and should only be used once
@@ -68,6 +263,7 @@ class Stabilizer:
             self.gyro_lpf_cutoff = gyro_sample_rate / 2 - 1
 
 
+        from scipy import signal
         sosgyro = signal.butter(10, self.gyro_lpf_cutoff, "lowpass", fs=gyro_sample_rate, output="sos")
 
         self.gyro_data[:,1:4] = signal.sosfiltfilt(sosgyro, self.gyro_data[:,1:4], 0) # Filter along "vertical" time axis
@@ -76,9 +272,8 @@ class Stabilizer:
     def auto_sync_stab(self, smooth=0.8, sliceframe1 = 10, sliceframe2 = 1000, slicelength = 50, debug_plots = True):
         v1 = (sliceframe1 + slicelength/2) / self.fps
         v2 = (sliceframe2 + slicelength/2) / self.fps
-        d1, times1, transforms1 = self.optical_flow_comparison(sliceframe1, slicelength, debug_plots = debug_plots)
-        #self.initial_offset = d1
-        d2, times2, transforms2 = self.optical_flow_comparison(sliceframe2, slicelength, debug_plots = debug_plots)
+        (d1, times1, transforms1), (d2, times2, transforms2) = self.analyze_slices([sliceframe1, sliceframe2], slicelength,
+                                                                                   debug_plots = debug_plots)
 
         self.times1 = times1
         self.times2 = times2
@@ -112,6 +307,20 @@ class Stabilizer:
 
         print("Gyro correction slope {}".format(slope))
 
+        if debug_plots:
+            self.plot_sync(times1, transforms1, times2, transforms2, corrected_times)
+
+        # Correct time scale of the integrated gyro data
+        self.get_stab_session().set_time_correction(slope, v1 - slope * g1)
+        self.update_smoothness(smooth)
+
+        #self.times, self.stab_transform = self.integrator.get_interpolated_stab_transform(smooth=smooth,start=-gyro_start,interval = interval)
+
+    def plot_sync(self, times1, transforms1, times2, transforms2, corrected_times):
+        """Plot the optical flow of two sync slices against the time corrected gyro data
+        """
+        from matplotlib import pyplot as plt
+
         xplot = plt.subplot(311)
 
         plt.plot(times1, -transforms1[:,0] * self.fps)
@@ -131,28 +340,11 @@ class Stabilizer:
         plt.plot(times1, transforms1[:,2] * self.fps)
         plt.plot(times2, transforms2[:,2] * self.fps)
         plt.plot(corrected_times, self.integrator.get_raw_data("z"))
-        #plt.plot(self.integrator.get_raw_data("t") + d2, self.integrator.get_raw_data("z"))
         plt.xlabel("time [s]")
         plt.ylabel("omega z [rad/s]")
 
         plt.show()
 
-        # Temp new integrator with corrected time scale
-
-        initial_orientation = Rotation.from_euler('xyz', [0, 0, 0], degrees=True).as_quat()
-
-        new_gyro_data = np.copy(self.gyro_data)
-
-        # Correct time scale
-        new_gyro_data[:,0] = slope * (self.integrator.get_raw_data("t") - g1) + v1 # (new_gyro_data[:,0]+gyro_start) *correction_slope
-
-        new_integrator = GyroIntegrator(new_gyro_data,zero_out_time=False, initial_orientation=initial_orientation)
-        new_integrator.integrate_all()
-        self.last_smooth = smooth
-        self.times, self.stab_transform = new_integrator.get_interpolated_stab_transform(smooth=smooth,start=0,interval = 1/self.fps)
-
-        #self.times, self.stab_transform = self.integrator.get_interpolated_stab_transform(smooth=smooth,start=-gyro_start,interval = interval)
-
     def manual_sync_correction(self, d1, d2, smooth=0.8):
         v1 = self.v1
         v2 = self.v2
@@ -178,169 +370,314 @@ class Stabilizer:
         corrected_times = slope * (self.integrator.get_raw_data("t") - g1) + v1
         print("Gyro correction slope {}".format(slope))
 
-        xplot = plt.subplot(311)
+        cost1 = self.window_sync_costs(times1, transforms1, [d1])[0]
+        cost2 = self.window_sync_costs(times2, transforms2, [d2])[0]
+        print("Sync cost d1: {}, d2: {}".format(cost1, cost2))
 
-        plt.plot(times1, -transforms1[:,0] * self.fps)
-        plt.plot(times2, -transforms2[:,0] * self.fps)
-        plt.plot(corrected_times, self.integrator.get_raw_data("x"))
-        plt.ylabel("omega x [rad/s]")
-
-        plt.subplot(312, sharex=xplot)
-        
-        plt.plot(times1, -transforms1[:,1] * self.fps)
-        plt.plot(times2, -transforms2[:,1] * self.fps)
-        plt.plot(corrected_times, self.integrator.get_raw_data("y"))
-        plt.ylabel("omega y [rad/s]")
+        self.plot_sync(times1, transforms1, times2, transforms2, corrected_times)
 
-        plt.subplot(313, sharex=xplot)
-
-        plt.plot(times1, transforms1[:,2] * self.fps)
-        plt.plot(times2, transforms2[:,2] * self.fps)
-        plt.plot(corrected_times, self.integrator.get_raw_data("z"))
-        plt.xlabel("time [s]")
-        plt.ylabel("omega z [rad/s]")
-
-        plt.show()
+        # Correct time scale of the integrated gyro data
+        self.get_stab_session().set_time_correction(slope, v1 - slope * g1)
+        self.update_smoothness(smooth)
 
-        # Temp new integrator with corrected time scale
-
-        initial_orientation = Rotation.from_euler('xyz', [0, 0, 0], degrees=True).as_quat()
+        #self.times, self.stab_transform = self.integrator.get_interpolated_stab_transform(smooth=smooth,start=-gyro_start,interval = interval)
 
-        new_gyro_data = np.copy(self.gyro_data)
+    def multi_sync_stab(self, smooth=0.8, num_slices = 6, slicelength = 50, start_frame = None, end_frame = None,
+                        piecewise = False, inlier_threshold = 0.005, debug_plots = True):
+        """Sync using optical flow slices spread evenly over the clip
+
+        The offsets of all slices are fitted with a robust clock model, so a single
+        bad slice is rejected instead of ruining the sync.
+
+        Args:
+            smooth (float, optional): Smoothness time constant. Defaults to 0.8.
+            num_slices (int, optional): Number of analyzed slices. Defaults to 6.
+            slicelength (int, optional): Frames per slice. Defaults to 50.
+            start_frame (int, optional): First frame of the first slice. Defaults to one slice length into the clip.
+            end_frame (int, optional): Last frame of the last slice. Defaults to one slice length before the end.
+            piecewise (bool, optional): Follow the slice offsets with piecewise linear drift
+                instead of a single line. Defaults to False.
+            inlier_threshold (float, optional): Largest residual in seconds of slices used for the fit. Defaults to 0.005.
+            debug_plots (bool, optional): Show the sync plots. Defaults to True.
+        """
+        num_slices = max(2, int(num_slices))
+        start_frame = slicelength if start_frame is None else start_frame
+        end_frame = self.num_frames - slicelength - 5 if end_frame is None else end_frame
+        end_frame = max(end_frame, start_frame + slicelength)
+
+        sliceframes = np.linspace(start_frame, end_frame - slicelength, num_slices).astype(int)
+        results = self.analyze_slices(list(sliceframes), slicelength, debug_plots = debug_plots)
+
+        video_times = (sliceframes + slicelength/2) / self.fps
+        offsets = np.array([result[0] for result in results])
+
+        knot_times, knot_offsets, residuals, inliers = self.fit_sync_model(video_times, offsets, piecewise, inlier_threshold)
+
+        print("Slice | video time (s) | offset (s) | residual (ms) | used")
+        for i in range(num_slices):
+            print("{:>5} | {:14.3f} | {:10.4f} | {:13.2f} | {}".format(i, video_times[i], offsets[i], residuals[i] * 1000,
+                                                                      "yes" if inliers[i] else "rejected"))
+
+        self.sync_slices = list(zip(sliceframes, video_times, offsets, residuals, inliers))
+
+        # Keep the outermost good slices for manual correction, with delays on the fitted model
+        first, last = np.flatnonzero(inliers)[[0, -1]]
+        self.times1, self.transforms1 = results[first][1], results[first][2]
+        self.times2, self.transforms2 = results[last][1], results[last][2]
+        self.v1 = video_times[first]
+        self.v2 = video_times[last]
+        self.d1 = np.interp(self.v1, knot_times, knot_offsets)
+        self.d2 = np.interp(self.v2, knot_times, knot_offsets)
+
+        # Video time of each gyro sample. Gyro time is video time minus the offset at that time
+        knot_gyro_times = knot_times - knot_offsets
+        gyro_times = self.integrator.get_raw_data("t")
+        corrected_times = np.interp(gyro_times, knot_gyro_times, knot_times)
 
-        # Correct time scale
-        new_gyro_data[:,0] = slope * (self.integrator.get_raw_data("t") - g1) + v1 # (new_gyro_data[:,0]+gyro_start) *correction_slope
+        # Linear extrapolation past the outer knots
+        start_slope = (knot_times[1] - knot_times[0]) / (knot_gyro_times[1] - knot_gyro_times[0])
+        end_slope = (knot_times[-1] - knot_times[-2]) / (knot_gyro_times[-1] - knot_gyro_times[-2])
+        before = gyro_times < knot_gyro_times[0]
+        after = gyro_times > knot_gyro_times[-1]
+        corrected_times[before] = knot_times[0] + (gyro_times[before] - knot_gyro_times[0]) * start_slope
+        corrected_times[after] = knot_times[-1] + (gyro_times[after] - knot_gyro_times[-1]) * end_slope
 
-        new_integrator = GyroIntegrator(new_gyro_data,zero_out_time=False, initial_orientation=initial_orientation)
-        new_integrator.integrate_all()
-        self.last_smooth = smooth
-        self.times, self.stab_transform = new_integrator.get_interpolated_stab_transform(smooth=smooth,start=0,interval = 1/self.fps)
-
-        #self.times, self.stab_transform = self.integrator.get_interpolated_stab_transform(smooth=smooth,start=-gyro_start,interval = interval)
+        print("Gyro correction slope {}".format(end_slope))
 
+        if debug_plots:
+            from matplotlib import pyplot as plt
+            plt.plot(video_times[inliers], offsets[inliers] * 1000, "o", label="Slices")
+            plt.plot(video_times[~inliers], offsets[~inliers] * 1000, "x", label="Rejected slices")
+            plt.plot(knot_times, knot_offsets * 1000, label="Clock model")
+            plt.xlabel("video time [s]")
+            plt.ylabel("offset [ms]")
+            plt.legend()
+            plt.show()
 
+        # Correct time scale of the integrated gyro data
+        self.get_stab_session().set_corrected_times(corrected_times)
+        self.update_smoothness(smooth)
+
+    def fit_sync_model(self, video_times, offsets, piecewise = False, inlier_threshold = 0.005, huber_iterations = 10):
+        """Robustly fit the gyro offset as a function of video time
+
+        The line with the most slices within inlier_threshold is found by trying every pair
+        of slices (RANSAC over all minimal samples), then refined on its inliers with
+        Huber weighted least squares.
+
+        Args:
+            video_times (np.ndarray): Video time at the center of each slice
+            offsets (np.ndarray): Estimated gyro offset of each slice
+            piecewise (bool, optional): Return the inlier offsets as knots of a piecewise
+                linear model instead of the fitted line. Defaults to False.
+            inlier_threshold (float, optional): Largest residual in seconds of an inlier. Defaults to 0.005.
+            huber_iterations (int, optional): Reweighting iterations. Defaults to 10.
+
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray, np.ndarray): Knot video times, knot offsets,
+                residual of each slice to the fitted line and inlier mask
+        """
+        video_times = np.asarray(video_times, dtype=float)
+        offsets = np.asarray(offsets, dtype=float)
+        valid = np.isfinite(offsets)
+
+        best_inliers = valid
+        best_score = None
+        candidates = np.flatnonzero(valid)
+        for i in candidates:
+            for j in candidates[candidates > i]:
+                slope = (offsets[j] - offsets[i]) / (video_times[j] - video_times[i])
+                residuals = np.abs(offsets - (offsets[i] + slope * (video_times - video_times[i])))
+                inliers = valid & (residuals < inlier_threshold)
+                score = (np.count_nonzero(inliers), -np.sum(residuals[inliers]))
+                if best_score is None or score > best_score:
+                    best_score = score
+                    best_inliers = inliers
+
+        if np.count_nonzero(best_inliers) < 2:
+            raise ValueError("Sync failed: fewer than two slices agree on the gyro offset")
+
+        # Huber weighted refit on the inliers
+        weights = np.ones(np.count_nonzero(best_inliers))
+        huber_k = inlier_threshold / 2
+        for _ in range(huber_iterations):
+            slope, intercept = np.polyfit(video_times[best_inliers], offsets[best_inliers], 1, w=np.sqrt(weights))
+            abs_residuals = np.abs(offsets[best_inliers] - (slope * video_times[best_inliers] + intercept))
+            weights = np.minimum(1, huber_k / np.maximum(abs_residuals, 1e-12))
+
+        # Residuals to the robust line, also for the piecewise model which passes through every inlier
+        residuals = offsets - (slope * video_times + intercept)
+
+        if piecewise:
+            knot_times = video_times[best_inliers]
+            knot_offsets = offsets[best_inliers]
+        else:
+            knot_times = video_times[[0, -1]]
+            knot_offsets = slope * knot_times + intercept
 
+        return knot_times, knot_offsets, residuals, best_inliers
 
     def optical_flow_comparison(self, start_frame=0, analyze_length = 50, debug_plots = True):
+        return self.analyze_slices([start_frame], analyze_length, debug_plots = debug_plots)[0]
+
+    def analyze_slices(self, start_frames, analyze_length = 50, debug_plots = True):
+        """Find the gyro offset of several video slices
+
+        The slices are tracked concurrently, each with its own frame source, and the
+        rotation of every frame pair is solved on the same thread pool as soon as its
+        points are tracked. Slices found in the analysis cache are not decoded at all.
+
+        Args:
+            start_frames (list): First frame of each slice
+            analyze_length (int, optional): Number of analyzed frames per slice. Defaults to 50.
+            debug_plots (bool, optional): Show the sync plots. Defaults to True.
+
+        Returns:
+            list: (estimated offset, frame times, transforms) for each slice
+        """
+        slices = [self.load_slice_analysis(start_frame, analyze_length) for start_frame in start_frames]
+        missing = [i for i, cached in enumerate(slices) if cached is None]
+
+        if missing:
+            analysis = self.get_analysis_source()
+            sources = [analysis]
+            for _ in missing[1:]:
+                source = FrameSource(self.videopath, gray=True, scale=analysis.scale)
+                source.keyframes = analysis.get_keyframes()
+                sources.append(source)
+
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.analysis_workers) as pool:
+                    tracking = [pool.submit(self.track_slice, source, start_frames[i], analyze_length, pool)
+                                for source, i in zip(sources, missing)]
+
+                    for i, future in zip(missing, tracking):
+                        frame_times, prev_pts_lst, curr_pts_lst, rotations = future.result()
+                        transforms = np.array([rotation.result() for rotation in rotations])
+                        slices[i] = (frame_times, transforms, prev_pts_lst, curr_pts_lst)
+                        self.save_slice_analysis(start_frames[i], analyze_length, *slices[i])
+            finally:
+                for source in sources[1:]:
+                    source.release()
+
+        # Plotting has to happen on this thread
+        results = []
+        for frame_times, transforms, prev_pts_lst, curr_pts_lst in slices:
+            estimated_offset = self.estimate_gyro_offset(frame_times, transforms, prev_pts_lst, curr_pts_lst, debug_plots = debug_plots)
+            results.append((estimated_offset, frame_times, transforms))
+
+        return results
+
+    def track_slice(self, source, start_frame, analyze_length, pool):
+        """Track features through a slice with LK optical flow
+
+        Args:
+            source (FrameSource): Grayscale analysis frame source, only used by this slice
+            start_frame (int): First frame of the slice
+            analyze_length (int): Number of analyzed frames
+            pool (concurrent.futures.Executor): Executor for the rotation of each frame pair
+
+        Returns:
+            (list, list, list, list): Frame times, tracked points in the previous and current
+                frame at full resolution, and futures of the frame pair rotations
+        """
         frame_times = []
-        frame_idx = []
-        transforms = []
         prev_pts_lst = []
         curr_pts_lst = []
+        rotations = []
 
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-        time.sleep(0.05)
+        # Grayscale frames at analysis resolution. Points are mapped back to full resolution before undistorting
+        source.seek(start_frame)
 
         # Read first frame
-        _, prev = self.cap.read()
-        prev_gray = cv2.cvtColor(prev, cv2.COLOR_BGR2GRAY)
-
-        for i in range(analyze_length):
-            prev_pts = cv2.goodFeaturesToTrack(prev_gray, maxCorners=200, qualityLevel=0.01, minDistance=30, blockSize=3)
+        _, prev_gray = source.read()
 
+        feature_params = dict(self.feature_params, minDistance=max(1, self.feature_params["minDistance"] * source.scale))
 
+        for i in range(analyze_length):
+            prev_pts = cv2.goodFeaturesToTrack(prev_gray, **feature_params)
 
-            succ, curr = self.cap.read()
-
-            frame_id = (int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)))
-            frame_time = (self.cap.get(cv2.CAP_PROP_POS_MSEC)/1000)
+            succ, curr_gray = source.read()
 
             if i % 10 == 0:
-                print("Analyzing frame: {}/{}".format(i,analyze_length))
+                print("Analyzing frame: {}/{}".format(i + start_frame, analyze_length + start_frame))
 
             if succ:
                 # Only add if succeeded
-                frame_idx.append(frame_id)
-                frame_times.append(frame_time)
+                frame_times.append(source.frame_time)
 
-
-                curr_gray = cv2.cvtColor(curr, cv2.COLOR_BGR2GRAY)
                 # Estimate transform using optical flow
                 curr_pts, status, err = cv2.calcOpticalFlowPyrLK(prev_gray, curr_gray, prev_pts, None)
 
                 idx = np.where(status==1)[0]
-                prev_pts = prev_pts[idx]
-                curr_pts = curr_pts[idx]
+                prev_pts = source.to_full_resolution(prev_pts[idx])
+                curr_pts = source.to_full_resolution(curr_pts[idx])
                 assert prev_pts.shape == curr_pts.shape
 
                 prev_pts_lst.append(prev_pts)
                 curr_pts_lst.append(curr_pts)
+                rotations.append(pool.submit(self.frame_pair_rotation, prev_pts, curr_pts))
 
+                prev_gray = curr_gray
 
-                # TODO: Try getting undistort + homography working for more accurate rotation estimation
-                src_pts = self.undistort.undistort_points(prev_pts, new_img_dim=(self.width,self.height))
-                dst_pts = self.undistort.undistort_points(curr_pts, new_img_dim=(self.width,self.height))
-
-                filtered_src = []
-                filtered_dst = []
+            else:
+                print("Frame {}".format(i))
 
-                for i in range(src_pts.shape[0]):
-                    # if both points are within frame
-                    if (0 < src_pts[i,0,0] < self.width) and (0 < dst_pts[i,0,0] < self.width) and (0 < src_pts[i,0,1] < self.height) and (0 < dst_pts[i,0,1] < self.height):
-                        filtered_src.append(src_pts[i,:])
-                        filtered_dst.append(dst_pts[i,:])
+        return frame_times, prev_pts_lst, curr_pts_lst, rotations
 
+    def frame_pair_rotation(self, prev_pts, curr_pts):
+        """Estimate the camera rotation between two frames from tracked points
 
+        Args:
+            prev_pts (np.ndarray): Points in the previous frame at full resolution
+            curr_pts (np.ndarray): Matching points in the current frame
 
-                #H, mask = cv2.findHomography(np.array(filtered_src), np.array(filtered_dst))
-                #retval, rots, trans, norms = self.undistort.decompose_homography(H, new_img_dim=(self.width,self.height))
+        Returns:
+            list: Rotation as xyz euler angles
+        """
+        # TODO: Try getting undistort + homography working for more accurate rotation estimation
+        src_pts = self.undistort.undistort_points(prev_pts, new_img_dim=(self.width,self.height))
+        dst_pts = self.undistort.undistort_points(curr_pts, new_img_dim=(self.width,self.height))
 
+        # if both points are within frame
+        inside = ((0 < src_pts[:,0,0]) & (src_pts[:,0,0] < self.width) & (0 < dst_pts[:,0,0]) & (dst_pts[:,0,0] < self.width) &
+                  (0 < src_pts[:,0,1]) & (src_pts[:,0,1] < self.height) & (0 < dst_pts[:,0,1]) & (dst_pts[:,0,1] < self.height))
+        filtered_src = src_pts[inside]
+        filtered_dst = dst_pts[inside]
 
-                # rots contains for solutions for the rotation. Get one with smallest magnitude.
-                # https://docs.opencv.org/master/da/de9/tutorial_py_epipolar_geometry.html
-                # https://en.wikipedia.org/wiki/Essential_matrix#Extracting_rotation_and_translation
-                roteul = None
-                smallest_mag = 1000
-                #for rot in rots:
-                #    thisrot = Rotation.from_matrix(rots[0]) # First one?
-                #    #thisrot = Rotation.from_matrix(rot)
-                #    if thisrot.magnitude() < smallest_mag and thisrot.magnitude() < 0.6:
-                #        # For some reason some camera calibrations lead to super high rotation magnitudes... Still testing.
-                #        roteul = Rotation.from_matrix(rot).as_euler("xyz")
-                #        smallest_mag = thisrot.magnitude()
+        #H, mask = cv2.findHomography(np.array(filtered_src), np.array(filtered_dst))
+        #retval, rots, trans, norms = self.undistort.decompose_homography(H, new_img_dim=(self.width,self.height))
 
-                #if type(roteul) == type(None):
-                #    print("Optical flow rotation determination failed")
-                #    roteul = [0, 0, 0]
+        # rots contains for solutions for the rotation. Get one with smallest magnitude.
+        # https://docs.opencv.org/master/da/de9/tutorial_py_epipolar_geometry.html
+        # https://en.wikipedia.org/wiki/Essential_matrix#Extracting_rotation_and_translation
+        roteul = None
 
-                # Compute fundamental matrix
-                #F, mask = cv2.findFundamentalMat(np.array(filtered_src), np.array(filtered_dst),cv2.FM_LMEDS)
-                # Compute essential matrix
+        # Compute fundamental matrix
+        #F, mask = cv2.findFundamentalMat(np.array(filtered_src), np.array(filtered_dst),cv2.FM_LMEDS)
+        # Compute essential matrix
 
-                # https://answers.opencv.org/question/206817/extract-rotation-and-translation-from-fundamental-matrix/
-                #E = self.undistort.find_essential_matrix(F, new_img_dim=(self.width,self.height))
+        # https://answers.opencv.org/question/206817/extract-rotation-and-translation-from-fundamental-matrix/
+        #E = self.undistort.find_essential_matrix(F, new_img_dim=(self.width,self.height))
 
-                self.use_essential_matrix = True
+        if self.use_essential_matrix:
+            R1, R2, t = self.undistort.recover_pose(filtered_src, filtered_dst, new_img_dim=(self.width,self.height))
 
-                if self.use_essential_matrix:
-                    R1, R2, t = self.undistort.recover_pose(np.array(filtered_src), np.array(filtered_dst), new_img_dim=(self.width,self.height))
-                
-                    rot1 = Rotation.from_matrix(R1)
-                    rot2 = Rotation.from_matrix(R2)
-
-                    if rot1.magnitude() < rot2.magnitude():
-                        roteul = rot1.as_euler("xyz")
-                    else: 
-                        roteul = rot2.as_euler("xyz")
-
-
-                #m, inliers = cv2.estimateAffine2D(src_pts, dst_pts) 
-                #dx = m[0,2]
-                #dy = m[1,2]
-                # Extract rotation angle
-                #da = np.arctan2(m[1,0], m[0,0])
-                #transforms.append([dx,dy,da]) 
-                transforms.append(list(roteul))
-                
-                
-                prev_gray = curr_gray
+            rot1 = Rotation.from_matrix(R1)
+            rot2 = Rotation.from_matrix(R2)
 
+            if rot1.magnitude() < rot2.magnitude():
+                roteul = rot1.as_euler("xyz")
             else:
-                print("Frame {}".format(i))
-        
-        transforms = np.array(transforms)
-        estimated_offset = self.estimate_gyro_offset(frame_times, transforms, prev_pts_lst, curr_pts_lst, debug_plots = debug_plots)
-        return estimated_offset, frame_times, transforms
+                roteul = rot2.as_euler("xyz")
+
+        #m, inliers = cv2.estimateAffine2D(src_pts, dst_pts)
+        #dx = m[0,2]
+        #dy = m[1,2]
+        # Extract rotation angle
+        #da = np.arctan2(m[1,0], m[0,0])
+        #transforms.append([dx,dy,da])
+        return list(roteul)
 
 
     def estimate_gyro_offset(self, OF_times, OF_transforms, prev_pts_list, curr_pts_list, debug_plots = True):
@@ -362,17 +699,11 @@ class Stabilizer:
 
             OF_transforms = new_OF_transforms
 
-        costs = []
-        offsets = []
+        rate_index = self.get_gyro_rate_index()
 
-        dt = self.rough_sync_search_interval # Search +/- 3 seconds
-        N = int(dt * 100) # 1/100 of a second in rough sync
-
-        for i in range(N):
-            offset = dt/2 - i * (dt/N) + self.initial_offset
-            cost = self.fast_gyro_cost_func(OF_times, OF_transforms, gyro_times + offset, gyro_data) #fast_gyro_cost_func(OF_times, OF_transforms, gyro_times + offset, gyro_data)
-            offsets.append(offset)
-            costs.append(cost)
+        # Rough sync over the whole search interval from cross-correlation
+        rough_offset, offsets, costs = self.coarse_gyro_offset(OF_times, OF_transforms, self.rough_sync_search_interval,
+                                                               self.initial_offset, rate_index = rate_index)
 
         slice_length = len(OF_times)
         cutting_ratio = 1
@@ -383,26 +714,23 @@ class Stabilizer:
         OF_times = OF_times[start_idx:start_idx + new_slice_length]
         OF_transforms = OF_transforms[start_idx:start_idx + new_slice_length,:]
 
-        rough_offset = offsets[np.argmin(costs)]
-
         print("Estimated offset: {}".format(rough_offset))
 
 
         if debug_plots:
+            from matplotlib import pyplot as plt
             plt.plot(offsets, costs)
         #    plt.show()
-        costs = []
-        offsets = []
 
         # Find better sync with smaller search space
         dt = self.better_sync_search_interval
-        N = int(dt * 5000)
         do_hpf = False
 
         # run both gyro and video through high pass filter
         # https://docs.scipy.org/doc/scipy/reference/generated/scipy.signal.butter.html
         
         if do_hpf:
+            from scipy import signal
             filterorder = 10
             filterfreq = 4 # hz
             sosgyro = signal.butter(filterorder, filterfreq, "highpass", fs=self.integrator.gyro_sample_rate, output="sos")
@@ -410,26 +738,134 @@ class Stabilizer:
 
             gyro_data = signal.sosfilt(sosgyro, gyro_data, 0) # Filter along "vertical" time axis
             OF_transforms = signal.sosfilt(sosvideo, OF_transforms, 0)
+            rate_index = GyroRateIndex(gyro_times, gyro_data)
 
         #plt.plot(gyro_times, gyro_data[:,0])
         #plt.plot(gyro_times, filtered_gyro_data[:,0])
 
-        for i in range(N):
-            offset = dt/2 - i * (dt/N) + rough_offset
-            cost = self.better_gyro_cost_func(OF_times, OF_transforms, gyro_times + offset, gyro_data)
-            offsets.append(offset)
-            costs.append(cost)
+        # All offsets of the fine search at once
+        N = int(dt * 5000)
+        offsets = dt/2 - np.arange(N) * (dt/N) + rough_offset
+        costs = self.window_sync_costs(OF_times, OF_transforms, offsets, rate_index)
 
         better_offset = offsets[np.argmin(costs)]
 
         print("Better offset: {}".format(better_offset))
 
         if debug_plots:
+            from matplotlib import pyplot as plt
             plt.plot(offsets, costs)
             plt.show()
 
         return better_offset
 
+    def coarse_gyro_offset(self, OF_times, OF_transforms, search_interval, center_offset = 0, step = 0.005, rate_index = None):
+        """Find the gyro offset by cross-correlating gyro and optical flow rotation rates
+
+        Both signals are resampled to a uniform grid. The weighted squared difference
+        for every lag in the search interval is expanded into a sliding gyro energy
+        and a cross-correlation, which are computed at once with cumsum and FFT.
+        A parabola through the best lag and its neighbours gives sub-step precision.
+
+        Args:
+            OF_times (list): Optical flow frame times
+            OF_transforms (np.ndarray): Optical flow rotations between frames
+            search_interval (float): Width of the searched offset range in seconds
+            center_offset (float, optional): Center of the searched offset range. Defaults to 0.
+            step (float, optional): Grid spacing in seconds. Defaults to 0.005.
+            rate_index (GyroRateIndex, optional): Gyro rates to compare with. Defaults to the clip's index.
+
+        Returns:
+            (float, np.ndarray, np.ndarray): Best offset, tested offsets and their costs
+        """
+
+        rate_index = rate_index or self.get_gyro_rate_index()
+        OF_times = np.asarray(OF_times)
+        axes_weight = np.array([0.7,0.7,1]) # Weight of the xyz in the cost function. pitch, yaw, roll. More weight to roll
+
+        OF_rates = np.array(OF_transforms) * self.fps
+        # Optical flow movements gives pixel movement, not camera movement
+        OF_rates[:,0] = -OF_rates[:,0]
+        OF_rates[:,1] = -OF_rates[:,1]
+
+        num_samples = int((OF_times[-1] - OF_times[0]) / step) + 1
+        grid = OF_times[0] + np.arange(num_samples) * step
+        OF_grid = np.stack([np.interp(grid, OF_times, OF_rates[:,i]) for i in range(3)], axis=1)
+
+        frame_interval = 1 / self.fps
+
+        # Lag j compares the slice with gyro shifted by offsets[j]
+        max_offset = center_offset + search_interval / 2
+        num_lags = int(search_interval / step) + 1
+        offsets = max_offset - np.arange(num_lags) * step
+        gyro_grid_times = grid[0] - max_offset + np.arange(num_lags + num_samples - 1) * step
+
+        # Gyro rates averaged over the frame interval, like the optical flow rotation between two frames
+        gyro_grid = rate_index.mean_rate(gyro_grid_times - frame_interval, gyro_grid_times)
+
+        from scipy import signal
+        costs = np.zeros(num_lags)
+        for i in range(3):
+            energy = np.concatenate(([0], np.cumsum(gyro_grid[:,i] ** 2)))
+            sliding_energy = energy[num_samples:] - energy[:-num_samples]
+            correlation = signal.fftconvolve(gyro_grid[:,i], OF_grid[::-1,i], mode="valid")
+
+            costs += axes_weight[i] * (sliding_energy - 2 * correlation + np.sum(OF_grid[:,i] ** 2))
+
+        costs /= num_samples
+
+        # Slice has to be covered by the gyro log
+        valid = rate_index.covers(grid[0] - offsets - frame_interval, grid[-1] - offsets)
+        if not np.any(valid):
+            print("Search interval is outside of the gyro data")
+            return center_offset, offsets, costs
+
+        costs[~valid] = np.inf
+        best = int(np.argmin(costs))
+        best_offset = offsets[best]
+
+        if 0 < best < num_lags - 1 and valid[best - 1] and valid[best + 1]:
+            c0, c1, c2 = costs[best - 1:best + 2]
+            curvature = c0 - 2 * c1 + c2
+            if curvature > 0:
+                best_offset -= step * 0.5 * (c0 - c2) / curvature
+
+        return best_offset, offsets, costs
+
+    def window_sync_costs(self, OF_times, OF_transforms, offsets, rate_index = None):
+        """Compare optical flow with the mean gyro rate over each frame interval for many offsets at once
+
+        Args:
+            OF_times (list): Optical flow frame times
+            OF_transforms (np.ndarray): Optical flow rotations between frames
+            offsets (np.ndarray): Gyro time offsets to evaluate
+            rate_index (GyroRateIndex, optional): Gyro rates to compare with. Defaults to the clip's index.
+
+        Returns:
+            np.ndarray: Weighted sum of squared differences for each offset. Infinite where
+                the slice is not covered by gyro data.
+        """
+
+        rate_index = rate_index or self.get_gyro_rate_index()
+        axes_weight = np.array([0.7,0.7,1]) # Weight of the xyz in the cost function. pitch, yaw, roll. More weight to roll
+
+        OF_rates = np.array(OF_transforms) * self.fps
+        # Optical flow movements gives pixel movement, not camera movement
+        OF_rates[:,0] = -OF_rates[:,0]
+        OF_rates[:,1] = -OF_rates[:,1]
+
+        # Gyro time of each frame window for each offset
+        window_end = np.asarray(OF_times)[np.newaxis,:] - np.asarray(offsets)[:,np.newaxis]
+        window_start = window_end - 1 / self.fps
+
+        gyro_rates = rate_index.mean_rate(window_start, window_end)
+        costs = np.sum((gyro_rates - OF_rates) ** 2 * axes_weight, axis=(1,2))
+
+        covered = rate_index.covers(window_start[:,0], window_end[:,-1])
+        costs[~covered] = np.inf
+
+        return costs
+
     def gyro_cost_func(self, OF_times, OF_transforms, gyro_times, gyro_data):
 
         # Estimate time delay using only roll direction
@@ -564,6 +1000,7 @@ class Stabilizer:
         sliced_gyro_data = gyro_data[mask,:]
         sliced_gyro_times = gyro_times[mask]
 
+        from scipy import interpolate
         nearest = interpolate.interp1d(gyro_times, gyro_data, kind='nearest', assume_sorted=True, axis = 0)
         gyro_dat_resampled = nearest(OF_times)
 
@@ -575,7 +1012,26 @@ class Stabilizer:
 
     def renderfile(self, starttime, stoptime, outpath = "Stabilized.mp4", out_size = (1920,1080), split_screen = True,
                    bitrate_mbits = 20, display_preview = False, scale=1, vcodec = "libx264", vprofile="main", pix_fmt = "",
-                   debug_text = False, custom_ffmpeg = ""):
+                   debug_text = False, custom_ffmpeg = "", mesh_grid = None, workers = 1, segments = 1, processes = None):
+        """Render stabilized video
+
+        Args:
+            mesh_grid (tuple, optional): Number of mesh vertices (x, y) for approximated warping,
+                e.g. (64, 36). Defaults to None, which computes the dense map for every frame.
+            workers (int, optional): Number of warp threads. Above 1, decoding, warping and
+                encoding run concurrently. Defaults to 1.
+            segments (int, optional): Split the export into this many keyframe aligned segments
+                which are rendered in separate processes and concatenated. Defaults to 1.
+            processes (int, optional): Size of the process pool for segments. Defaults to CPU count.
+        """
+
+        if segments > 1:
+            render_kwargs = {"out_size": out_size, "split_screen": split_screen, "bitrate_mbits": bitrate_mbits,
+                             "scale": scale, "vcodec": vcodec, "vprofile": vprofile, "pix_fmt": pix_fmt,
+                             "debug_text": debug_text, "custom_ffmpeg": custom_ffmpeg, "mesh_grid": mesh_grid,
+                             "workers": workers}
+            self.render_segments(starttime, stoptime, outpath, segments, processes, render_kwargs)
+            return
         
         export_out_size = (int(out_size[0]*2*scale) if split_screen else int(out_size[0]*scale), int(out_size[1]*scale))
 
@@ -629,13 +1085,14 @@ class Stabilizer:
             output_params = eval(custom_ffmpeg)
             output_params["-input_framerate"] = self.fps
 
+        from vidgear.gears import WriteGear
+        from vidgear.gears import helper as vidgearHelper
         out = WriteGear(output_filename=outpath, **output_params)
         output_params["custom_ffmpeg"] = vidgearHelper.get_valid_ffmpeg_path()
         crop = (int(scale*(self.width-out_size[0])/2), int(scale*(self.height-out_size[1])/2))
 
 
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, int(starttime * self.fps))
-        time.sleep(0.1)
+        self.frame_source.seek(int(starttime * self.fps))
 
         num_frames = int((stoptime - starttime) * self.fps) 
 
@@ -645,13 +1102,156 @@ class Stabilizer:
         
         #tmap1, tmap2 = self.undistort.get_maps(self.undistort_fov_scale,new_img_dim=(int(self.width * scale),int(self.height*scale)), update_new_K = False)
 
+        render_dim = (int(self.width * scale),int(self.height*scale))
+
+        if mesh_grid:
+            check_frame = min(int(starttime * self.fps), len(self.stab_transform) - 1)
+            mesh_error = self.undistort.get_mesh_error(self.undistort_fov_scale, new_img_dim=render_dim,
+                                                       quat = self.stab_transform[check_frame], grid_size = mesh_grid)
+            print("Mesh warp {}x{}: max error {:.3f} px".format(mesh_grid[0], mesh_grid[1], mesh_error))
+        else:
+            self.undistort.prepare_rotation_maps(self.undistort_fov_scale, render_dim)
+
+        def write_frame(frame_out):
+            out.write(frame_out)
+            if display_preview:
+                # Resize if preview is huge
+                if frame_out.shape[1] > 1280:
+                    frame_out = cv2.resize(frame_out, (1280, int(frame_out.shape[0] * 1280 / frame_out.shape[1])), interpolation=cv2.INTER_LINEAR)
+                cv2.imshow("Before and After" if split_screen else "Stabilized?", frame_out)
+                cv2.waitKey(2)
+
+        render_args = (render_dim, out_size, crop, scale, split_screen, debug_text, mesh_grid)
+
+        if workers > 1:
+            self.render_pipelined(self.read_render_frames(num_frames), render_args, write_frame, workers)
+        else:
+            for frame_num, frame in self.read_render_frames(num_frames):
+                write_frame(self.render_frame(frame, frame_num, *render_args))
+
+        # When everything done, release the capture
+        #out.release()
+        cv2.destroyAllWindows()
+        out.close()
+
+    def get_segment_frames(self, start_frame, end_frame, segments):
+        """Split a frame range into segments starting at keyframes where possible
+
+        Args:
+            start_frame (int): First frame to render
+            end_frame (int): Frame after the last frame to render
+            segments (int): Number of segments
+
+        Returns:
+            list: (first frame, end frame) of each segment
+        """
+        keyframes = np.array(self.frame_source.get_keyframes())
+        keyframes = keyframes[(keyframes > start_frame) & (keyframes < end_frame)]
+
+        boundaries = [start_frame]
+        for k in range(1, segments):
+            target = start_frame + (end_frame - start_frame) * k / segments
+            if len(keyframes) > 0:
+                target = keyframes[np.argmin(np.abs(keyframes - target))]
+            boundaries.append(int(target))
+        boundaries.append(end_frame)
+
+        boundaries = sorted(set(boundaries))
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def render_segments(self, starttime, stoptime, outpath, segments, processes, render_kwargs, retries = 1):
+        """Render segments of the export in parallel processes and concatenate them
+
+        Args:
+            starttime (float): Export start in seconds
+            stoptime (float): Export stop in seconds
+            outpath (string): Output video path
+            segments (int): Number of segments
+            processes (int): Size of the process pool. None uses the CPU count.
+            render_kwargs (dict): Arguments passed to renderfile for each segment
+            retries (int, optional): Number of times a failed segment is rendered again. Defaults to 1.
+        """
+        start_frame = int(starttime * self.fps)
+        end_frame = start_frame + int((stoptime - starttime) * self.fps)
+        segment_frames = self.get_segment_frames(start_frame, end_frame, segments)
+
+        # Unique per export, so concurrent exports to the same name don't share segments
+        segment_dir = tempfile.mkdtemp(prefix=os.path.basename(os.path.splitext(outpath)[0]) + "_segments_",
+                                       dir=os.path.dirname(os.path.abspath(outpath)))
+        extension = os.path.splitext(outpath)[1] or ".mp4"
+
+        # The video capture and the map buffers stay behind
+        undistort = copy.copy(self.undistort)
+        undistort.rotation_map_cache = None
+        state = {
+            "videopath": self.videopath,
+            "width": self.width,
+            "height": self.height,
+            "fps": self.fps,
+            "undistort": undistort,
+            "undistort_fov_scale": self.undistort_fov_scale,
+            "last_smooth": getattr(self, "last_smooth", 0),
+            "times": self.times,
+        }
+
+        # Half a frame of margin so the frame indices survive the round trip through seconds
+        tasks = []
+        for i, (first, end) in enumerate(segment_frames):
+            tasks.append(((first + 0.5) / self.fps, (first + 0.5) / self.fps + (end - first + 0.5) / self.fps,
+                          os.path.join(segment_dir, "segment_{:04d}{}".format(i, extension)), end))
+
+        print("Rendering {} segments".format(len(tasks)))
+
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+                def submit(task):
+                    segment_start, segment_stop, segment_path, end = task
+                    return pool.submit(render_segment, state, self.frame_source.get_keyframes(), self.stab_transform[:end],
+                                       segment_start, segment_stop, segment_path, render_kwargs)
+
+                attempts = {i: 0 for i in range(len(tasks))}
+                running = {submit(task): i for i, task in enumerate(tasks)}
+                while running:
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        i = running.pop(future)
+                        try:
+                            future.result()
+                            print("Segment {} done".format(i))
+                        except Exception as e:
+                            if attempts[i] >= retries:
+                                raise
+                            attempts[i] += 1
+                            print("Segment {} failed ({}), retrying".format(i, e))
+                            running[submit(tasks[i])] = i
+
+            list_path = os.path.join(segment_dir, "segments.txt")
+            with open(list_path, "w") as f:
+                for task in tasks:
+                    f.write("file '{}'\n".format(os.path.abspath(task[2]).replace("'", "'\\''")))
+
+            from vidgear.gears import helper as vidgearHelper
+            ffmpeg_path = vidgearHelper.get_valid_ffmpeg_path() or "ffmpeg"
+            subprocess.run([ffmpeg_path, "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", outpath], check=True)
+        finally:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+    def read_render_frames(self, num_frames):
+        """Decode frames from the current capture position
+
+        Args:
+            num_frames (int): Number of frames to read
+
+        Yields:
+            (int, np.ndarray): Frame index and decoded frame
+        """
         i = 0
         while(True):
             # Read next frame
-            frame_num = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
-            success, frame = self.cap.read()
+            frame_num = self.frame_source.position
+            success, frame = self.frame_source.read()
             
-            # Getting frame_num _before_ cap.read gives index of the read frame. 
+            # Getting frame_num _before_ read gives index of the read frame. 
 
             if i % 5 == 0:
                 print("frame: {}, {}/{} ({}%)".format(frame_num, i, num_frames, round(100 * i/num_frames,1)))
@@ -667,95 +1267,203 @@ class Stabilizer:
                 break
 
             if success and i > 0:
-                
-                if scale != 1:
-                    frame = cv2.resize(frame, (int(self.width * scale),int(self.height*scale)), interpolation=cv2.INTER_LINEAR)
-                
-                #frame_undistort = cv2.remap(frame, tempmap1, tempmap2, interpolation=cv2.INTER_LINEAR, # INTER_CUBIC
-                #                              borderMode=cv2.BORDER_CONSTANT)
+                yield frame_num, frame
+
+    def render_pipelined(self, frames, render_args, write_frame, workers):
+        """Run decode, warp and encode stages concurrently
+
+        A decoder thread fills a bounded queue, a thread pool warps the frames and
+        the calling thread writes the results in their original order.
+
+        Args:
+            frames (iterable): (frame_num, frame) pairs, e.g. from read_render_frames
+            render_args (tuple): Extra arguments passed to render_frame
+            write_frame (function): Called with each rendered frame in order
+            workers (int): Number of warp threads
+        """
+        max_pending = 2 * workers
+        decoded = queue.Queue(maxsize=max_pending)
+        stop = threading.Event()
+        end_marker = object()
+
+        def decode():
+            try:
+                for item in frames:
+                    while not stop.is_set():
+                        try:
+                            decoded.put(item, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if stop.is_set():
+                        return
+                decoded.put(end_marker)
+            except Exception as e:
+                decoded.put(e)
+
+        decoder = threading.Thread(target=decode, daemon=True)
+        decoder.start()
+
+        pending = collections.deque()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                while True:
+                    item = decoded.get()
+                    if item is end_marker:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+
+                    frame_num, frame = item
+                    pending.append(pool.submit(self.render_frame, frame, frame_num, *render_args))
+
+                    if len(pending) >= max_pending:
+                        write_frame(pending.popleft().result())
+
+                while pending:
+                    write_frame(pending.popleft().result())
+        finally:
+            stop.set()
+            for future in pending:
+                future.cancel()
+            decoder.join()
+
+    def get_frame_time(self, frame_num):
+        """Get the video time of a frame, from the stabilized frame times of variable frame rate clips
+
+        Args:
+            frame_num (int): Frame index
+
+        Returns:
+            float: Time in seconds
+        """
+        if self.times is not None and frame_num < len(self.times):
+            return float(self.times[frame_num])
+        return frame_num / self.fps
+
+    def render_frame(self, frame, frame_num, render_dim, out_size, crop, scale = 1, split_screen = True,
+                     debug_text = False, mesh_grid = None):
+        """Stabilize a single decoded frame
+
+        Args:
+            frame (np.ndarray): Decoded video frame
+            frame_num (int): Index of the frame in the video
+
+        Returns:
+            np.ndarray: Frame to write to the output video
+        """
+        
+        if scale != 1:
+            frame = cv2.resize(frame, render_dim, interpolation=cv2.INTER_LINEAR)
+        
+        #frame_undistort = cv2.remap(frame, tempmap1, tempmap2, interpolation=cv2.INTER_LINEAR, # INTER_CUBIC
+        #                              borderMode=cv2.BORDER_CONSTANT)
 
-                tmap1, tmap2 = self.undistort.get_maps(self.undistort_fov_scale,new_img_dim=(int(self.width * scale),int(self.height*scale)), update_new_K = False, quat = self.stab_transform[frame_num])
+        if mesh_grid:
+            tmap1, tmap2 = self.undistort.get_mesh_maps(self.undistort_fov_scale,new_img_dim=render_dim, quat = self.stab_transform[frame_num], grid_size = mesh_grid)
+        else:
+            tmap1, tmap2 = self.undistort.get_rotation_maps(self.undistort_fov_scale,new_img_dim=render_dim, quat = self.stab_transform[frame_num])
+
+        #frame = cv2.resize(frame, (int(self.width * scale),int(self.height*scale)), interpolation=cv2.INTER_LINEAR)
+        frame_out = cv2.remap(frame, tmap1, tmap2, interpolation=cv2.INTER_LINEAR, # INTER_CUBIC
+                                      borderMode=cv2.BORDER_CONSTANT)
+        # borderValue, BORDER_REPLICATE
+        #cv2.imshow("Before and After", cv2.hconcat([frame_undistort,frame_undistort2],2))
+        #cv2.imshow("Before and After", frame_undistort)
+        #cv2.waitKey(100)
+        #cv2.imshow("Before and After", frame_undistort2)
+        
+        #cv2.waitKey(100)
+        #frame_undistort = cv2.remap(frame, tempmap1, tempmap2, interpolation=cv2.INTER_LINEAR, # INTER_CUBIC
+        #                              borderMode=cv2.BORDER_CONSTANT)
+        #cv2.imshow("Stabilized?", frame_undistort)
 
-                #frame = cv2.resize(frame, (int(self.width * scale),int(self.height*scale)), interpolation=cv2.INTER_LINEAR)
-                frame_out = cv2.remap(frame, tmap1, tmap2, interpolation=cv2.INTER_LINEAR, # INTER_CUBIC
-                                              borderMode=cv2.BORDER_CONSTANT)
-                # borderValue, BORDER_REPLICATE
-                #cv2.imshow("Before and After", cv2.hconcat([frame_undistort,frame_undistort2],2))
-                #cv2.imshow("Before and After", frame_undistort)
-                #cv2.waitKey(100)
-                #cv2.imshow("Before and After", frame_undistort2)
-                
-                #cv2.waitKey(100)
-                #frame_undistort = cv2.remap(frame, tempmap1, tempmap2, interpolation=cv2.INTER_LINEAR, # INTER_CUBIC
-                #                              borderMode=cv2.BORDER_CONSTANT)
-                #cv2.imshow("Stabilized?", frame_undistort)
+        #print(self.stab_transform[frame_num])
+        #frame_out = self.undistort.get_rotation_map(frame_undistort, self.stab_transform[frame_num])
 
-                #print(self.stab_transform[frame_num])
-                #frame_out = self.undistort.get_rotation_map(frame_undistort, self.stab_transform[frame_num])
+        #frame_out = self.undistort.get_rotation_map(frame, self.stab_transform[frame_num])
 
-                #frame_out = self.undistort.get_rotation_map(frame, self.stab_transform[frame_num])
 
+        # Fix border artifacts
 
-                # Fix border artifacts
+        frame_out = frame_out[crop[1]:crop[1]+out_size[1] * scale, crop[0]:crop[0]+out_size[0]* scale]
 
-                frame_out = frame_out[crop[1]:crop[1]+out_size[1] * scale, crop[0]:crop[0]+out_size[0]* scale]
+        # temp debug text
+        if debug_text:
+            frame_out = cv2.putText(frame_out, "{} | {:0.1f} s ({}) | tau={:.1f}".format(__version__, self.get_frame_time(frame_num), frame_num, self.last_smooth),
+                                    (5,30),cv2.FONT_HERSHEY_SIMPLEX,1,(200,200,200),2)
+        #frame_out = cv2.putText(frame_out, "V{} | {:0.1f} s ({}) | tau={:.1f}".format(__version__, frame_num/self.fps, frame_num, self.last_smooth),
+        #                        (5,30),cv2.FONT_HERSHEY_SIMPLEX,1,(60,60,60),2)
+        #out.write(frame_out)
+        #print(frame_out.shape)
 
-                # temp debug text
-                if debug_text:
-                    frame_out = cv2.putText(frame_out, "{} | {:0.1f} s ({}) | tau={:.1f}".format(__version__, frame_num/self.fps, frame_num, self.last_smooth),
-                                            (5,30),cv2.FONT_HERSHEY_SIMPLEX,1,(200,200,200),2)
-                #frame_out = cv2.putText(frame_out, "V{} | {:0.1f} s ({}) | tau={:.1f}".format(__version__, frame_num/self.fps, frame_num, self.last_smooth),
-                #                        (5,30),cv2.FONT_HERSHEY_SIMPLEX,1,(60,60,60),2)
-                #out.write(frame_out)
-                #print(frame_out.shape)
+        # If the image is too big, resize it.
+    #%if(frame_out.shape[1] > 1920): 
+    #		frame_out = cv2.resize(frame_out, (int(frame_out.shape[1]/2), int(frame_out.shape[0]/2)));
+        
+        size = np.array(frame_out.shape)
+        #frame_out = cv2.resize(frame_out, (int(size[1]), int(size[0])))
 
-                # If the image is too big, resize it.
-            #%if(frame_out.shape[1] > 1920): 
-            #		frame_out = cv2.resize(frame_out, (int(frame_out.shape[1]/2), int(frame_out.shape[0]/2)));
-                
-                size = np.array(frame_out.shape)
-                #frame_out = cv2.resize(frame_out, (int(size[1]), int(size[0])))
-
-                if split_screen:
-
-                    # Fix border artifacts
-                    frame_undistort = frame_undistort[crop[1]:crop[1]+out_size[1]* scale, crop[0]:crop[0]+out_size[0]* scale]
-                    frame = cv2.resize(frame_undistort, ((int(size[1]), int(size[0]))))
-                    concatted = cv2.resize(cv2.hconcat([frame_out,frame],2), (int(out_size[0]*2*scale),int(out_size[1]*scale)))
-
-                    out.write(concatted)
-                    if display_preview:
-                        # Resize if preview is huge
-                        if concatted.shape[1] > 1280:
-                            concatted = cv2.resize(concatted, (1280, int(concatted.shape[0] * 1280 / concatted.shape[1])), interpolation=cv2.INTER_LINEAR)
-                        cv2.imshow("Before and After", concatted)
-                        cv2.waitKey(2)
-                else:
-
-                    out.write(frame_out)
-                    if display_preview:
-                        if frame_out.shape[1] > 1280:
-                            frame_out = cv2.resize(frame_out, (1280, int(frame_out.shape[0] * 1280 / frame_out.shape[1])), interpolation=cv2.INTER_LINEAR)
-                        cv2.imshow("Stabilized?", frame_out)
-                        cv2.waitKey(2)
+        if split_screen:
+            # Undistorted input without the stabilization rotation. The rotation map buffers
+            # are reused, so this has to run after the stabilized remap.
+            umap1, umap2 = self.undistort.get_rotation_maps(self.undistort_fov_scale, new_img_dim=render_dim)
+            frame_undistort = cv2.remap(frame, umap1, umap2, interpolation=cv2.INTER_LINEAR,
+                                        borderMode=cv2.BORDER_CONSTANT)
 
-        # When everything done, release the capture
-        #out.release()
-        cv2.destroyAllWindows()
-        out.close()
+            # Fix border artifacts
+            frame_undistort = frame_undistort[crop[1]:crop[1]+out_size[1]* scale, crop[0]:crop[0]+out_size[0]* scale]
+            frame = cv2.resize(frame_undistort, ((int(size[1]), int(size[0]))))
+            concatted = cv2.resize(cv2.hconcat([frame_out,frame],2), (int(out_size[0]*2*scale),int(out_size[1]*scale)))
+
+            return concatted
+
+        return frame_out
 
     def release(self):
-        self.cap.release()
+        self.frame_source.release()
+        if self.analysis_source:
+            self.analysis_source.release()
+
+
+def render_segment(state, keyframes, stab_transform, starttime, stoptime, outpath, render_kwargs):
+    """Render one segment of an export in a worker process
+
+    Args:
+        state (dict): Stabilizer attributes needed for rendering
+        keyframes (list): Keyframe indices of the video
+        stab_transform (np.ndarray): Stabilization quaternions up to the end of the segment
+        starttime (float): Segment start in seconds
+        stoptime (float): Segment stop in seconds
+        outpath (string): Segment video path
+        render_kwargs (dict): Arguments passed to renderfile
+
+    Returns:
+        string: Segment video path
+    """
+    stab = Stabilizer()
+    stab.__dict__.update(state)
+    stab.stab_transform = stab_transform
+    stab.frame_source = FrameSource(stab.videopath)
+    stab.frame_source.keyframes = keyframes
+    stab.cap = stab.frame_source.cap
+    try:
+        stab.renderfile(starttime, stoptime, outpath, display_preview = False, **render_kwargs)
+    finally:
+        stab.release()
+    return outpath
 
 
 class OnlyUndistort:
     def __init__(self, videopath, calibrationfile, fov_scale = 1.5):
         self.undistort_fov_scale = fov_scale
-        self.cap = cv2.VideoCapture(videopath)
-        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
-        self.num_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_source = FrameSource(videopath)
+        self.cap = self.frame_source.cap
+        self.video_info = self.frame_source.info
+        self.width = self.video_info.width
+        self.height = self.video_info.height
+        self.fps = self.video_info.fps
+        self.num_frames = self.video_info.num_frames
 
         self.undistort = FisheyeCalibrator()
         self.undistort.load_calibration_json(calibrationfile, True)
@@ -817,13 +1525,14 @@ class OnlyUndistort:
             output_params = eval(custom_ffmpeg)
             output_params["-input_framerate"] = self.fps
 
+        from vidgear.gears import WriteGear
+        from vidgear.gears import helper as vidgearHelper
         out = WriteGear(output_filename=outpath, **output_params)
         output_params["custom_ffmpeg"] = vidgearHelper.get_valid_ffmpeg_path()
         crop = (int(scale*(self.width-out_size[0])/2), int(scale*(self.height-out_size[1])/2))
 
 
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, int(starttime * self.fps))
-        time.sleep(0.1)
+        self.frame_source.seek(int(starttime * self.fps))
 
         num_frames = int((stoptime - starttime) * self.fps) 
 
@@ -833,10 +1542,10 @@ class OnlyUndistort:
         i = 0
         while(True):
             # Read next frame
-            frame_num = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
-            success, frame = self.cap.read()
+            frame_num = self.frame_source.position
+            success, frame = self.frame_source.read()
             
-            # Getting frame_num _before_ cap.read gives index of the read frame. 
+            # Getting frame_num _before_ read gives index of the read frame. 
 
             if i % 5 == 0:
                 print("frame: {}, {}/{} ({}%)".format(frame_num, i, num_frames, round(100 * i/num_frames,1)))
@@ -871,7 +1580,7 @@ class OnlyUndistort:
         cv2.destroyAllWindows()
         out.close()
 
-        self.cap.release()
+        self.frame_source.release()
 
 
 class GPMFStabilizer(Stabilizer):
@@ -881,11 +1590,14 @@ class GPMFStabilizer(Stabilizer):
 
         # General video stuff
         self.undistort_fov_scale = fov_scale
-        self.cap = cv2.VideoCapture(videopath)
-        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
-        self.num_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.videopath = videopath
+        self.frame_source = FrameSource(videopath)
+        self.cap = self.frame_source.cap
+        self.video_info = self.frame_source.info
+        self.width = self.video_info.width
+        self.height = self.video_info.height
+        self.fps = self.video_info.fps
+        self.num_frames = self.video_info.num_frames
 
 
         # Camera undistortion stuff
@@ -893,9 +1605,11 @@ class GPMFStabilizer(Stabilizer):
         self.undistort.load_calibration_json(calibrationfile, True)
         self.map1, self.map2 = self.undistort.get_maps(self.undistort_fov_scale,new_img_dim=(self.width,self.height))
 
-        # Get gyro data
-        self.gpmf = Extractor(videopath)
-        self.gyro_data = self.gpmf.get_gyro(True)
+        # Get gyro data. The GPMF parser is only imported when the gyro cache is cold
+        def parse_gpmf():
+            from GPMF_gyro import Extractor
+            return Extractor(videopath).get_gyro(True)
+        self.gyro_data = load_gyro_log(videopath, parse_gpmf, format="gpmf", version=2)
 
         # Hero 6??
         if hero == 6:
@@ -963,11 +1677,14 @@ class InstaStabilizer(Stabilizer):
         
         # General video stuff
         self.undistort_fov_scale = fov_scale
-        self.cap = cv2.VideoCapture(videopath)
-        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
-        self.num_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.videopath = videopath
+        self.frame_source = FrameSource(videopath)
+        self.cap = self.frame_source.cap
+        self.video_info = self.frame_source.info
+        self.width = self.video_info.width
+        self.height = self.video_info.height
+        self.fps = self.video_info.fps
+        self.num_frames = self.video_info.num_frames
 
 
         # Camera undistortion stuff
@@ -977,9 +1694,10 @@ class InstaStabilizer(Stabilizer):
 
         # Get gyro data
 
-        self.gyro_data = self.instaCSVGyro(gyrocsv)
+        self.gyro_data = load_gyro_log(gyrocsv, lambda: self.instaCSVGyro(gyrocsv), format="insta_csv", version=1)
 
 
+        from scipy import signal
         sosgyro = signal.butter(10, 5, "lowpass", fs=500, output="sos")
         self.gyro_data[:,1:4] = signal.sosfilt(sosgyro, self.gyro_data[:,1:4], 0) # Filter along "vertical" time axis
         self.gyro_data[:,0] -= 15
@@ -1077,11 +1795,14 @@ class BBLStabilizer(Stabilizer):
         
         # General video stuff
         self.undistort_fov_scale = fov_scale
-        self.cap = cv2.VideoCapture(videopath)
-        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
-        self.num_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.videopath = videopath
+        self.frame_source = FrameSource(videopath)
+        self.cap = self.frame_source.cap
+        self.video_info = self.frame_source.info
+        self.width = self.video_info.width
+        self.height = self.video_info.height
+        self.fps = self.video_info.fps
+        self.num_frames = self.video_info.num_frames
 
 
         # Camera undistortion stuff
@@ -1095,41 +1816,49 @@ class BBLStabilizer(Stabilizer):
         # quick fix
         cam_angle_degrees = -cam_angle_degrees
 
-        if use_csv:
-            with open(bblpath) as bblcsv:
-                gyro_index = None
-                
-                csv_reader = csv.reader(bblcsv)
-                for i, row in enumerate(csv_reader):
-                    #print(row)
-                    if(row[0] == "loopIteration"):
-                        gyro_index = row.index('gyroADC[0]')
-                        break
+        self.gyro_data = load_gyro_log(bblpath, lambda: self.read_gyro_log(bblpath, use_csv, logtype, cam_angle_degrees),
+                                       format="csvblackbox" if use_csv else logtype or "rawblackbox",
+                                       cam_angle_degrees=cam_angle_degrees, version=1)
 
-                data_list = []
-                gyroscale = np.pi/180
-                r  = Rotation.from_euler('x', cam_angle_degrees, degrees=True)
-                for row in csv_reader:
 
-                    gx = float(row[gyro_index+1])* gyroscale
-                    gy = float(row[gyro_index+2])* gyroscale
-                    gz = float(row[gyro_index]) * gyroscale
-                    
-                    to_rotate = [-(gx),
-                                    (gy),
-                                    -(gz)]
-                    
-                    rotated = r.apply(to_rotate)
-                    
-                    f = [float(row[1]) / 1000000,
-                            rotated[0],
-                            rotated[1],
-                            rotated[2]]
+        # This seems to make the orientation match. Implement auto match later
+        #self.gyro_data[:,[2, 3]] = self.gyro_data[:,[3, 2]]
+        #self.gyro_data[:,2] = -self.gyro_data[:,2]
+
+        #self.gyro_data[:,[2, 3]] = self.gyro_data[:,[3, 2]]
+        self.gyro_data[:,2] = self.gyro_data[:,2]
+        #self.gyro_data[:,3] = -self.gyro_data[:,3]
+        
+        self.gyro_lpf_cutoff = gyro_lpf_cutoff
+        
+        if self.gyro_lpf_cutoff > 0:
+            self.filter_gyro()
+
+        # Other attributes
+        initial_orientation = Rotation.from_euler('xyz', [0, 0, 0], degrees=True).as_quat()
 
-                    data_list.append(f)
+        self.integrator = GyroIntegrator(self.gyro_data,initial_orientation=initial_orientation)
+        self.integrator.integrate_all()
+        self.times = None
+        self.stab_transform = None
 
-                self.gyro_data = np.array(data_list)
+        self.initial_offset = initial_offset
 
+    
+    def read_gyro_log(self, bblpath, use_csv = False, logtype = "", cam_angle_degrees = 0):
+        """Parse a Blackbox log, Blackbox CSV or gyroflow CSV
+
+        Args:
+            bblpath (string): Path to the log
+            use_csv (bool, optional): Log is a Blackbox CSV export. Defaults to False.
+            logtype (string, optional): "gyroflow" for gyroflow CSV logs. Defaults to "".
+            cam_angle_degrees (float, optional): Camera angle, already sign flipped. Defaults to 0.
+
+        Returns:
+            np.ndarray: Nx4 array of [time, gyroX, gyroY, gyroZ]
+        """
+        if use_csv:
+            return read_blackbox_csv(bblpath, cam_angle_degrees)
 
         elif logtype == "gyroflow":
             with open(bblpath) as csvfile:
@@ -1165,38 +1894,14 @@ class BBLStabilizer(Stabilizer):
                 #gyro_arr = np.array(data_list)
                 #x, t = resample(gyro_arr[:,1:], 22 * 200,gyro_arr[:,0])
                 #self.gyro_data = np.column_stack((t,x))
-                self.gyro_data = np.array(data_list)
-                print(self.gyro_data)
+                return np.array(data_list)
 
         else:
+            from blackbox_extract import BlackboxExtractor
             self.bbe = BlackboxExtractor(bblpath)
-            self.gyro_data = self.bbe.get_gyro_data(cam_angle_degrees=cam_angle_degrees)
+            return self.bbe.get_gyro_data(cam_angle_degrees=cam_angle_degrees)
 
 
-        # This seems to make the orientation match. Implement auto match later
-        #self.gyro_data[:,[2, 3]] = self.gyro_data[:,[3, 2]]
-        #self.gyro_data[:,2] = -self.gyro_data[:,2]
-
-        #self.gyro_data[:,[2, 3]] = self.gyro_data[:,[3, 2]]
-        self.gyro_data[:,2] = self.gyro_data[:,2]
-        #self.gyro_data[:,3] = -self.gyro_data[:,3]
-        
-        self.gyro_lpf_cutoff = gyro_lpf_cutoff
-        
-        if self.gyro_lpf_cutoff > 0:
-            self.filter_gyro()
-
-        # Other attributes
-        initial_orientation = Rotation.from_euler('xyz', [0, 0, 0], degrees=True).as_quat()
-
-        self.integrator = GyroIntegrator(self.gyro_data,initial_orientation=initial_orientation)
-        self.integrator.integrate_all()
-        self.times = None
-        self.stab_transform = None
-
-        self.initial_offset = initial_offset
-
-    
     def stabilization_settings(self, smooth = 0.99):
 
 
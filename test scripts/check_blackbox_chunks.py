@@ -0,0 +1,102 @@
+"""Compare the chunked raw Blackbox conversion against the original per-frame loop
+
+Synthetic frames from two logs are fed through BlackboxExtractor with a parser
+replacement, using chunk sizes that do and don't divide the log lengths.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import math
+import time
+from collections import namedtuple
+import numpy as np
+from scipy.spatial.transform import Rotation
+from blackbox_extract import BlackboxExtractor
+
+TOLERANCE = 1e-9
+
+Frame = namedtuple("Frame", ["data"])
+
+class SyntheticParser:
+    """Minimal stand-in for orangebox.Parser with decoded frames of several logs"""
+    field_names = ["loopIteration", "time", "gyroADC[0]", "gyroADC[1]", "gyroADC[2]", "motor[0]"]
+
+    def __init__(self, log_lengths, seed=0):
+        rng = np.random.default_rng(seed)
+        self.logs = []
+        for length in log_lengths:
+            times = 1000000 + np.cumsum(rng.integers(120, 130, length))
+            gyro = rng.integers(-2000, 2000, (length, 3))
+            self.logs.append([Frame([i, int(times[i]), *gyro[i].tolist(), 1200]) for i in range(length)])
+        self.log_index = 1
+
+    def set_log_index(self, index):
+        self.log_index = index
+
+    def frames(self):
+        return iter(self.logs[self.log_index - 1])
+
+def make_extractor(parser):
+    extractor = BlackboxExtractor.__new__(BlackboxExtractor)
+    extractor.parser = parser
+    extractor.n_of_logs = len(parser.logs)
+    extractor.final_gyro_data = []
+    extractor.extracted = False
+    extractor.camera_angle = None
+    extractor.gyro_rate = 0
+    return extractor
+
+def loop_extract(parser, cam_angle_degrees):
+    """Original BlackboxExtractor.get_gyro_data loop"""
+    final_gyro_data = []
+    r  = Rotation.from_euler('x', cam_angle_degrees, degrees=True)
+
+    for lg in range(1,len(parser.logs)+1):
+        parser.set_log_index(lg)
+        t  = parser.field_names.index('time')
+        gx = parser.field_names.index('gyroADC[1]')
+        gy = parser.field_names.index('gyroADC[2]')
+        gz = parser.field_names.index('gyroADC[0]')
+        data_frames = []
+
+        for frame in parser.frames():
+            to_rotate = [-math.radians(frame.data[gx]),
+                         math.radians(frame.data[gy]),
+                         -math.radians(frame.data[gz])]
+
+            rotated = r.apply(to_rotate)
+
+            f = [frame.data[t]/1000000,
+                 rotated[0],
+                 rotated[1],
+                 rotated[2]]
+            data_frames.append(f)
+
+        final_gyro_data.extend(data_frames)
+
+    return np.array(final_gyro_data)
+
+parser = SyntheticParser([30000, 12345])
+
+failed = False
+for cam_angle, chunk_size in [(0, 65536), (25, 4096), (-40, 1000)]:
+    extractor = make_extractor(parser)
+    t0 = time.time()
+    chunks = [chunk for _, chunk in extractor.iter_gyro_chunks(cam_angle, chunk_size=chunk_size)]
+    chunked = np.concatenate(chunks)
+    t1 = time.time()
+    loop = loop_extract(parser, cam_angle)
+    t2 = time.time()
+
+    error = np.max(np.abs(chunked - loop)) if chunked.shape == loop.shape else np.inf
+    failed |= error > TOLERANCE
+    print("angle {}, chunks of {} frames: max deviation {:.2e}, chunked {:.3f} s, loop {:.3f} s".format(
+        cam_angle, chunk_size, error, t1 - t0, t2 - t1))
+
+extractor = make_extractor(parser)
+failed |= not np.allclose(extractor.get_gyro_data(25), loop_extract(parser, 25), rtol=0, atol=TOLERANCE)
+
+print("FAIL" if failed else "OK")
+sys.exit(1 if failed else 0)
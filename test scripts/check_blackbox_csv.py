@@ -0,0 +1,86 @@
+"""Compare the bulk Blackbox CSV loader against the original csv row loop
+
+Writes a synthetic Blackbox CSV export with a key/value preamble and checks
+read_blackbox_csv at several camera angles and chunk sizes.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import csv
+import tempfile
+import time
+import numpy as np
+from scipy.spatial.transform import Rotation
+from gyro_log import read_blackbox_csv
+
+TOLERANCE = 1e-9
+
+def loop_read(bblpath, cam_angle_degrees):
+    """Original csv loader of BBLStabilizer"""
+    with open(bblpath) as bblcsv:
+        gyro_index = None
+
+        csv_reader = csv.reader(bblcsv)
+        for i, row in enumerate(csv_reader):
+            if(row[0] == "loopIteration"):
+                gyro_index = row.index('gyroADC[0]')
+                break
+
+        data_list = []
+        gyroscale = np.pi/180
+        r  = Rotation.from_euler('x', cam_angle_degrees, degrees=True)
+        for row in csv_reader:
+
+            gx = float(row[gyro_index+1])* gyroscale
+            gy = float(row[gyro_index+2])* gyroscale
+            gz = float(row[gyro_index]) * gyroscale
+
+            to_rotate = [-(gx),
+                            (gy),
+                            -(gz)]
+
+            rotated = r.apply(to_rotate)
+
+            f = [float(row[1]) / 1000000,
+                    rotated[0],
+                    rotated[1],
+                    rotated[2]]
+
+            data_list.append(f)
+
+        return np.array(data_list)
+
+def write_synthetic_csv(path, num_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Product", "Blackbox flight data recorder by Nicholas Sherlock"])
+        writer.writerow(["Firmware revision", "Betaflight 4.2.0"])
+        writer.writerow(["gyro_scale", "0x3f800000"])
+        writer.writerow(["loopIteration", "time", "axisP[0]", "axisP[1]", "gyroADC[0]", "gyroADC[1]", "gyroADC[2]", "motor[0]"])
+        times = 1000000 + np.cumsum(rng.integers(240, 260, num_rows))
+        gyro = rng.integers(-2000, 2000, (num_rows, 3))
+        for i in range(num_rows):
+            writer.writerow([i, times[i], rng.integers(-50, 50), rng.integers(-50, 50), *gyro[i], 1200])
+
+failed = False
+with tempfile.TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, "synthetic.csv")
+    write_synthetic_csv(path, 50000)
+
+    for cam_angle, chunk_rows in [(0, 100000), (20, 100000), (-35, 7777)]:
+        t0 = time.time()
+        bulk = read_blackbox_csv(path, cam_angle, chunk_rows=chunk_rows)
+        t1 = time.time()
+        loop = loop_read(path, cam_angle)
+        t2 = time.time()
+
+        error = np.max(np.abs(bulk - loop)) if bulk.shape == loop.shape else np.inf
+        failed |= error > TOLERANCE
+        print("angle {}, chunks of {} rows: max deviation {:.2e}, bulk {:.3f} s, loop {:.3f} s".format(
+            cam_angle, chunk_rows, error, t1 - t0, t2 - t1))
+
+print("FAIL" if failed else "OK")
+sys.exit(1 if failed else 0)
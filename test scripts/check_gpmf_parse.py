@@ -0,0 +1,84 @@
+"""Compare the NumPy GPMF decoder parse_dict_fast against the construct based parse_dict
+
+Builds synthetic GPMF payloads with nested device and stream containers, grouped
+samples, padding, strings and dates, and checks that both parsers agree.
+Needs construct and dateutil, like the GoPro gyro extraction.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import struct
+import time
+import numpy as np
+from gpmf.parse import parse_dict, parse_dict_fast
+
+def klv(key, type_char, size, repeat, data):
+    """Encode one KLV element, padded to 32 bits"""
+    header = struct.pack(">4sBBH", key, ord(type_char) if type_char else 0, size, repeat)
+    return header + data + b"\0" * (-len(data) % 4)
+
+def nested(key, *elements):
+    data = b"".join(elements)
+    # Nested containers use size 1 and the byte count as repeat
+    return klv(key, None, 1, len(data), data)
+
+def sensor_stream(key, name, samples, scale, timestamp, total_samples):
+    return nested(b"STRM",
+                  klv(b"STMP", "J", 8, 1, struct.pack(">Q", timestamp)),
+                  klv(b"TSMP", "L", 4, 1, struct.pack(">L", total_samples)),
+                  klv(b"STNM", "c", len(name), 1, name),
+                  klv(b"ORIN", "c", 1, 3, b"ZXY"),
+                  klv(b"SIUN", "c", 5, 1, b"rad/s"),
+                  klv(b"SCAL", "s", 2, 1, struct.pack(">h", scale)),
+                  klv(key, "s", 6, len(samples), samples.astype(">i2").tobytes()))
+
+def synthetic_payload(index, num_samples, rng):
+    gyro = rng.integers(-32768, 32767, (num_samples, 3))
+    accl = rng.integers(-32768, 32767, (num_samples // 2, 3))
+    temperature = struct.pack(">f", 41.5 + index)
+    return nested(b"DEVC",
+                  klv(b"DVID", "L", 4, 1, struct.pack(">L", 1)),
+                  klv(b"DVNM", "c", 6, 1, b"Camera"),
+                  sensor_stream(b"GYRO", b"Gyroscope", gyro, 939, 1000000 * index, num_samples * (index + 1)),
+                  sensor_stream(b"ACCL", b"Accelerometer", accl, 418, 1000000 * index + 37, num_samples // 2 * (index + 1)),
+                  nested(b"STRM",
+                         klv(b"TMPC", "f", 4, 1, temperature),
+                         klv(b"GPSU", "U", 16, 1, "20{:02d}15101530.123".format(1 + index % 12).encode()),
+                         # Grouped values, one sample of four uint16 and a multi-row float block
+                         klv(b"FACE", "S", 8, 1, struct.pack(">4H", 1, 2, 3, 4)),
+                         klv(b"WBAL", "f", 12, 2, np.arange(6, dtype=">f4").tobytes())))
+
+def same_value(expected, actual, key):
+    """parse_dict returns tuples and lists, parse_dict_fast NumPy arrays"""
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and expected.keys() == actual.keys() and \
+            all(same_value(expected[k], actual[k], k) for k in expected)
+    if key == "STRM":
+        return len(expected) == len(actual) and all(same_value(e, a, None) for e, a in zip(expected, actual))
+    if key == "STMP" and isinstance(expected, bytes):
+        # parse_value has no 64-bit integer decoder and returns the raw bytes
+        return struct.unpack(">Q", expected)[0] == actual
+    if isinstance(expected, (bytes, str, int, float)) or expected is None:
+        return expected == actual
+    if hasattr(expected, "isoformat"):
+        return expected == actual
+    return np.array_equal(np.array(expected, dtype=np.float64), np.asarray(actual, dtype=np.float64))
+
+rng = np.random.default_rng(0)
+payloads = [synthetic_payload(i, int(rng.integers(190, 210)), rng) for i in range(200)]
+
+t0 = time.time()
+expected = [parse_dict(payload) for payload in payloads]
+t1 = time.time()
+actual = [parse_dict_fast(payload) for payload in payloads]
+t2 = time.time()
+
+mismatches = [i for i, (e, a) in enumerate(zip(expected, actual)) if not same_value(e, a, None)]
+print("{} payloads: {} mismatches, parse_dict_fast {:.3f} s, parse_dict {:.3f} s".format(
+    len(payloads), len(mismatches), t2 - t1, t1 - t0))
+
+failed = bool(mismatches)
+print("FAIL" if failed else "OK")
+sys.exit(1 if failed else 0)
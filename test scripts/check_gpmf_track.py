@@ -0,0 +1,133 @@
+"""Check the MP4 box walker of GPMFTrack against synthetic files built with struct
+
+Each file has a video track and a gpmd track whose payloads are interleaved with
+video chunks, with several chunk layouts of the sample tables. The payloads and
+times GPMFTrack reads back have to match the ones written.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import struct
+import tempfile
+import numpy as np
+import gpmf.extract
+from gpmf.extract import GPMFTrack
+
+def box(box_type, *payload, large=False):
+    data = b"".join(payload)
+    if large:
+        return struct.pack(">I4sQ", 1, box_type, len(data) + 16) + data
+    return struct.pack(">I4s", len(data) + 8, box_type) + data
+
+def full_box(box_type, version, *payload):
+    return box(box_type, struct.pack(">I", version << 24), *payload)
+
+def sample_table(data_format, chunk_offsets, samples_per_chunk, sizes, durations, co64=False, constant_size=False):
+    # Sample description entry: size, format, reserved, data reference index
+    stsd = full_box(b"stsd", 0, struct.pack(">I", 1), struct.pack(">I4s6xH", 16, data_format, 1))
+
+    # Run length encoded durations
+    runs = []
+    for duration in durations:
+        if runs and runs[-1][1] == duration:
+            runs[-1][0] += 1
+        else:
+            runs.append([1, duration])
+    stts = full_box(b"stts", 0, struct.pack(">I", len(runs)), b"".join(struct.pack(">II", *run) for run in runs))
+
+    entries = [(i + 1, n) for i, n in enumerate(samples_per_chunk) if i == 0 or n != samples_per_chunk[i - 1]]
+    stsc = full_box(b"stsc", 0, struct.pack(">I", len(entries)), b"".join(struct.pack(">III", c, n, 1) for c, n in entries))
+
+    if constant_size:
+        stsz = full_box(b"stsz", 0, struct.pack(">II", sizes[0], len(sizes)))
+    else:
+        stsz = full_box(b"stsz", 0, struct.pack(">II", 0, len(sizes)), b"".join(struct.pack(">I", s) for s in sizes))
+
+    if co64:
+        stco = full_box(b"co64", 0, struct.pack(">I", len(chunk_offsets)), b"".join(struct.pack(">Q", o) for o in chunk_offsets))
+    else:
+        stco = full_box(b"stco", 0, struct.pack(">I", len(chunk_offsets)), b"".join(struct.pack(">I", o) for o in chunk_offsets))
+
+    return box(b"stbl", stsd, stts, stsc, stsz, stco)
+
+def trak(handler, data_format, timescale, stbl, mdhd_version=0):
+    if mdhd_version == 1:
+        mdhd = full_box(b"mdhd", 1, struct.pack(">QQIQ", 0, 0, timescale, 0), b"\0" * 4)
+    else:
+        mdhd = full_box(b"mdhd", 0, struct.pack(">IIII", 0, 0, timescale, 0), b"\0" * 4)
+    # pre_defined, handler type, reserved, empty name
+    hdlr = full_box(b"hdlr", 0, struct.pack(">I4s12x", 0, handler), b"\0")
+    minf = box(b"minf", box(b"nmhd", b"\0" * 4), stbl)
+    return box(b"trak", box(b"tkhd", b"\0" * 84), box(b"mdia", mdhd, hdlr, minf))
+
+def write_synthetic_mp4(path, samples_per_chunk, rng, co64=False, constant_size=False, mdhd_version=0, large_mdat=False):
+    """Write an MP4 with interleaved video and gpmd chunks
+
+    Returns:
+        (list, int): Written (payload, (start, end)) in sample order and the gpmd timescale
+    """
+    num_samples = sum(samples_per_chunk)
+    if constant_size:
+        sizes = [int(rng.integers(100, 3000))] * num_samples
+    else:
+        sizes = rng.integers(100, 3000, num_samples).tolist()
+    durations = [1001] * (num_samples - 1) + [500]
+    payloads = [rng.integers(0, 256, size, dtype=np.uint8).tobytes() for size in sizes]
+
+    ftyp = box(b"ftyp", b"mp41", struct.pack(">I", 0), b"mp41")
+    mdat_header_size = 16 if large_mdat else 8
+
+    # Lay out mdat: a video chunk before every gpmd chunk
+    mdat_data = b""
+    gpmd_chunk_offsets = []
+    video_chunk_offsets = []
+    sample = 0
+    for count in samples_per_chunk:
+        video_chunk_offsets.append(len(ftyp) + mdat_header_size + len(mdat_data))
+        mdat_data += rng.integers(0, 256, int(rng.integers(1000, 20000)), dtype=np.uint8).tobytes()
+        gpmd_chunk_offsets.append(len(ftyp) + mdat_header_size + len(mdat_data))
+        mdat_data += b"".join(payloads[sample:sample + count])
+        sample += count
+
+    video_stbl = sample_table(b"avc1", video_chunk_offsets, [1] * len(video_chunk_offsets), [1000] * len(video_chunk_offsets),
+                              [1001] * len(video_chunk_offsets))
+    gpmd_stbl = sample_table(b"gpmd", gpmd_chunk_offsets, samples_per_chunk, sizes, durations, co64, constant_size)
+    moov = box(b"moov", full_box(b"mvhd", 0, b"\0" * 96),
+               trak(b"vide", b"avc1", 30000, video_stbl),
+               trak(b"meta", b"gpmd", 1000, gpmd_stbl, mdhd_version))
+
+    with open(path, "wb") as f:
+        f.write(ftyp)
+        f.write(box(b"mdat", mdat_data, large=large_mdat))
+        f.write(moov)
+
+    times = np.concatenate(([0], np.cumsum(durations)))
+    return [(payloads[i], (int(times[i]), int(times[i + 1]))) for i in range(num_samples)], 1000
+
+rng = np.random.default_rng(0)
+layouts = [
+    ("one sample per chunk", dict(samples_per_chunk=[1] * 40)),
+    ("mixed chunk sizes, co64", dict(samples_per_chunk=[3, 3, 1, 5, 5, 5, 2], co64=True)),
+    ("constant sample size, mdhd v1", dict(samples_per_chunk=[2] * 10 + [1], constant_size=True, mdhd_version=1)),
+    ("64 bit mdat size", dict(samples_per_chunk=[4, 1, 4], large_mdat=True)),
+]
+
+failed = False
+with tempfile.TemporaryDirectory() as tmpdir:
+    for name, layout in layouts:
+        path = os.path.join(tmpdir, "synthetic.mp4")
+        expected, timescale = write_synthetic_mp4(path, rng=rng, **layout)
+
+        for max_read_size in [8 * 1024 * 1024, 4096]:
+            gpmf.extract.MAX_READ_SIZE = max_read_size
+            track = GPMFTrack(path)
+            actual = list(track.payloads())
+            ok = track.timescale == timescale and actual == expected
+            failed |= not ok
+            print("{}, reads up to {} bytes: {} of {} payloads, {}".format(
+                name, max_read_size, len(actual), len(expected), "match" if ok else "MISMATCH"))
+
+print("FAIL" if failed else "OK")
+sys.exit(1 if failed else 0)
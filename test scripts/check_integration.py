@@ -0,0 +1,57 @@
+"""Compare the vectorized gyro integration against the per-sample loops
+
+Synthetic gyro logs with jittered timestamps, missing samples and fast rotation,
+for GyroIntegrator, FrameRotationIntegrator and EulerIntegrator.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import time
+import numpy as np
+from gyro_integrator import GyroIntegrator, FrameRotationIntegrator, EulerIntegrator
+
+TOLERANCE = 1e-6 # rad
+
+def synthetic_gyro(sample_rate, duration, seed=0):
+    rng = np.random.default_rng(seed)
+    num_samples = int(sample_rate * duration)
+    # Timestamp jitter and a gap of missing samples
+    times = np.cumsum(rng.uniform(0.8, 1.2, num_samples)) / sample_rate
+    times[num_samples // 2:] += 0.05
+    omega = np.cumsum(rng.normal(0, 5 / np.sqrt(sample_rate), (num_samples, 3)), axis=0)
+    omega[num_samples // 4:num_samples // 4 + 100] = 0
+    return np.column_stack((times, omega))
+
+def max_angle(q1, q2):
+    # Chord based, arccos of the dot product can't resolve angles below 1e-7
+    sign = np.where(np.sum(q1 * q2, axis=1) < 0, -1, 1)[:,np.newaxis]
+    return np.max(4 * np.arcsin(np.clip(np.linalg.norm(q1 - sign * q2, axis=1) / 2, 0, 1)))
+
+def compare(name, make_integrator):
+    t0 = time.time()
+    times_vectorized, vectorized = make_integrator().integrate_all(vectorized=True)
+    t1 = time.time()
+    times_loop, loop = make_integrator().integrate_all(vectorized=False)
+    t2 = time.time()
+
+    error = max_angle(vectorized, loop)
+    ok = error <= TOLERANCE and np.array_equal(times_vectorized, times_loop)
+    print("{}: max deviation {:.2e} rad, vectorized {:.3f} s, loop {:.3f} s".format(name, error, t1 - t0, t2 - t1))
+    return ok
+
+failed = False
+for sample_rate, duration in [(400, 30), (2000, 10)]:
+    data = synthetic_gyro(sample_rate, duration)
+    label = " {} Hz".format(sample_rate)
+    failed |= not compare("GyroIntegrator" + label, lambda: GyroIntegrator(data))
+    failed |= not compare("EulerIntegrator" + label, lambda: EulerIntegrator(data))
+
+frame_data = synthetic_gyro(30, 300)
+frame_data[:,0] = np.arange(frame_data.shape[0])
+frame_data[:,1:] *= 1 / 30
+failed |= not compare("FrameRotationIntegrator", lambda: FrameRotationIntegrator(frame_data))
+
+print("FAIL" if failed else "OK")
+sys.exit(1 if failed else 0)
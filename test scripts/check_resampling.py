@@ -0,0 +1,71 @@
+"""Compare the searchsorted slerp resampling against the original per-frame loop
+
+Smoothed orientations from a jittered synthetic gyro log are resampled at several
+frame rates, starting before the gyro data like an early sync offset.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import time
+import numpy as np
+import quaternion as quat
+from gyro_integrator import GyroIntegrator, interpolate_orientations
+
+TOLERANCE = 1e-6 # rad
+
+def loop_interpolate(time_list, orientations, start, interval):
+    """Original get_interpolated_stab_transform loop after the stabilize transform"""
+    time = start
+
+    out_times = []
+    slerped_rotations = []
+
+    while time < 0:
+        slerped_rotations.append(orientations[0])
+        out_times.append(time)
+        time += interval
+
+    while time_list[0] >= time:
+        slerped_rotations.append(orientations[0])
+        out_times.append(time)
+        time += interval
+    for i in range(len(time_list)-1):
+        if time_list[i] <= time < time_list[i+1]:
+            # interpolate between two quaternions
+            weight = (time - time_list[i])/(time_list[i+1]-time_list[i])
+            slerped_rotations.append(quat.slerp(orientations[i],orientations[i+1],[weight]))
+            out_times.append(time)
+            time += interval
+    return (out_times, np.vstack(slerped_rotations))
+
+def max_angle(q1, q2):
+    sign = np.where(np.sum(q1 * q2, axis=1) < 0, -1, 1)[:,np.newaxis]
+    return np.max(4 * np.arcsin(np.clip(np.linalg.norm(q1 - sign * q2, axis=1) / 2, 0, 1)))
+
+rng = np.random.default_rng(0)
+sample_rate = 400
+num_samples = sample_rate * 60
+times = np.cumsum(rng.uniform(0.8, 1.2, num_samples)) / sample_rate
+omega = np.cumsum(rng.normal(0, 5 / np.sqrt(sample_rate), (num_samples, 3)), axis=0)
+
+integrator = GyroIntegrator(np.column_stack((times, omega)), zero_out_time=False)
+integrator.integrate_all()
+time_list, stab_rotations = integrator.get_stabilize_transform(0.3)
+
+failed = False
+for fps, start in [(23.976, 0), (29.97, -0.5), (59.94, 0.25), (240, -0.1)]:
+    t0 = time.time()
+    loop_times, loop = loop_interpolate(time_list, stab_rotations, start, 1 / fps)
+    t1 = time.time()
+    vectorized = interpolate_orientations(time_list, stab_rotations, loop_times)
+    t2 = time.time()
+
+    error = max_angle(vectorized, loop)
+    failed |= error > TOLERANCE
+    print("{} fps from {} s, {} frames: max deviation {:.2e} rad, vectorized {:.4f} s, loop {:.3f} s".format(
+        fps, start, len(loop_times), error, t2 - t1, t1 - t0))
+
+print("FAIL" if failed else "OK")
+sys.exit(1 if failed else 0)
@@ -0,0 +1,49 @@
+"""Compare the vectorized quaternion smoothing against the per-sample slerp loop
+
+Synthetic gyro logs at FPV rates: constant fast rotation with noise and a random walk,
+at 400 Hz and 2 kHz, with short and long smoothing time constants.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import time
+import numpy as np
+from gyro_integrator import GyroIntegrator
+
+TOLERANCE = 1e-4 # rad
+
+def synthetic_gyro(rate, sample_rate, duration, random_walk=False, seed=0):
+    rng = np.random.default_rng(seed)
+    num_samples = int(sample_rate * duration)
+    if random_walk:
+        omega = np.cumsum(rng.normal(0, rate / np.sqrt(sample_rate), (num_samples, 3)), axis=0)
+    else:
+        axis = rng.normal(size=3)
+        omega = rate * axis / np.linalg.norm(axis) + rng.normal(0, 0.2, (num_samples, 3))
+    times = np.arange(num_samples) / sample_rate
+    return np.column_stack((times, omega))
+
+def max_angle(q1, q2):
+    return np.max(2 * np.arccos(np.clip(np.abs(np.sum(q1 * q2, axis=1)), 0, 1)))
+
+failed = False
+for rate, sample_rate, duration, random_walk in [(2, 400, 10, False), (5, 2000, 4, False), (2, 400, 10, True)]:
+    integrator = GyroIntegrator(synthetic_gyro(rate, sample_rate, duration, random_walk))
+    integrator.integrate_all()
+
+    for smooth in [0.2, 1, 3]:
+        t0 = time.time()
+        _, vectorized = integrator.get_smoothed_orientation(smooth, vectorized=True)
+        t1 = time.time()
+        _, loop = integrator.get_smoothed_orientation(smooth, vectorized=False)
+        t2 = time.time()
+
+        error = max_angle(vectorized, loop)
+        failed |= error > TOLERANCE
+        print("{} rad/s {} Hz{}, smooth {}: max deviation {:.2e} rad, vectorized {:.3f} s, loop {:.3f} s".format(
+            rate, sample_rate, " random walk" if random_walk else "", smooth, error, t1 - t0, t2 - t1))
+
+print("FAIL" if failed else "OK")
+sys.exit(1 if failed else 0)
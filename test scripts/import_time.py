@@ -0,0 +1,121 @@
+"""Import time benchmark for the launcher and the headless entry points
+
+Imports each entry module in a fresh interpreter with -X importtime and fails if
+a heavy dependency is loaded at import or the cumulative import time exceeds
+its budget. Heavy dependencies are meant to be imported on first use.
+
+Usage: python "test scripts/import_time.py" [--runs N] [--budget-scale X]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["matplotlib", "scipy.signal", "scipy.interpolate", "vidgear", "tkinter", "orangebox", "construct"]
+
+# Entry module: (modules that must not be imported, budget in ms)
+ENTRY_POINTS = {
+    # Launcher window, the utilities import the processing stack when opened
+    "gyroflow": (HEAVY_MODULES + ["stabilizer", "calibrate_video", "scipy.spatial"], 1500),
+    # Headless batch parent process
+    "batch": (HEAVY_MODULES + ["PySide2", "stabilizer", "cv2", "numpy"], 300),
+    # Processing stack loaded by the batch workers
+    "stabilizer": (HEAVY_MODULES + ["PySide2"], 1200),
+}
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure_import(module):
+    """Import a module in a fresh interpreter with -X importtime
+
+    Args:
+        module (string): Module name
+
+    Returns:
+        (set, list, float): Names of all imported modules, (ms, name) of the modules
+            imported directly by the entry module, and its total import time in ms
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            cwd=parentdir, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("Importing {} failed:\n{}".format(module, result.stderr.strip().splitlines()[-1]))
+
+    # Rows are (cumulative us, nesting depth, name), each module listed after its imports
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            rows.append((int(match.group(2)), len(match.group(3)), match.group(4)))
+
+    entry = max(i for i, row in enumerate(rows) if row[2] == module)
+    depth = rows[entry][1]
+    direct_imports = []
+    for cumulative_us, row_depth, name in reversed(rows[:entry]):
+        if row_depth <= depth:
+            break
+        if row_depth == depth + 2:
+            direct_imports.append((cumulative_us / 1000, name))
+
+    return set(row[2] for row in rows), direct_imports, rows[entry][0] / 1000
+
+
+def check_entry_point(module, forbidden, budget_ms, runs = 3):
+    """Benchmark one entry module
+
+    Args:
+        module (string): Entry module
+        forbidden (list): Modules that must not be imported, including their submodules
+        budget_ms (float): Allowed import time, the fastest of the runs counts
+        runs (int, optional): Number of measurements. Defaults to 3.
+
+    Returns:
+        list: Problems found, empty if the entry point passes
+    """
+    timings = []
+    for _ in range(runs):
+        imported, direct_imports, total_ms = measure_import(module)
+        timings.append(total_ms)
+
+    problems = []
+    for name in forbidden:
+        loaded = sorted(m for m in imported if m == name or m.startswith(name + "."))
+        if loaded:
+            problems.append("{} imports {}".format(module, loaded[0]))
+
+    best_ms = min(timings)
+    print("{}: {:.0f} ms (budget {:.0f} ms)".format(module, best_ms, budget_ms))
+    for t, name in sorted(direct_imports, reverse=True)[:5]:
+        print("    {:8.1f} ms  {}".format(t, name))
+
+    if best_ms > budget_ms:
+        problems.append("{} took {:.0f} ms, budget is {:.0f} ms".format(module, best_ms, budget_ms))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check import time of the gyroflow entry points")
+    parser.add_argument("modules", nargs="*", default=list(ENTRY_POINTS), help="Entry modules to check")
+    parser.add_argument("--runs", type=int, default=3, help="Measurements per module, the fastest counts")
+    parser.add_argument("--budget-scale", type=float, default=1, help="Multiplier for the time budgets on slow machines")
+    args = parser.parse_args()
+
+    problems = []
+    for module in args.modules:
+        forbidden, budget_ms = ENTRY_POINTS[module]
+        try:
+            problems += check_entry_point(module, forbidden, budget_ms * args.budget_scale, args.runs)
+        except RuntimeError as e:
+            problems.append(str(e))
+
+    for problem in problems:
+        print("FAIL: {}".format(problem))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import os
+import subprocess
+import threading
+
+import cv2
+import numpy as np
+
+
+def get_ffprobe_path():
+    """Find ffprobe, preferring the one next to the ffmpeg binary used for rendering
+
+    Returns:
+        string: Path or command name of ffprobe
+    """
+    from vidgear.gears import helper as vidgearHelper
+    ffmpeg_path = vidgearHelper.get_valid_ffmpeg_path()
+    if ffmpeg_path:
+        candidate = os.path.join(os.path.dirname(ffmpeg_path), os.path.basename(ffmpeg_path).replace("ffmpeg", "ffprobe"))
+        if os.path.isfile(candidate):
+            return candidate
+    return "ffprobe"
+
+
+def probe_frame_times(videopath):
+    """Get the presentation time of every frame in the first video stream using ffprobe
+
+    Only the packet headers are read, no frames are decoded.
+
+    Args:
+        videopath (string): Path to the video file
+
+    Returns:
+        np.ndarray: Sorted frame times in seconds relative to the first frame. Empty if ffprobe is not available.
+    """
+    try:
+        result = subprocess.run([get_ffprobe_path(), "-v", "error", "-select_streams", "v:0",
+                                 "-show_entries", "packet=pts_time", "-of", "csv=p=0", videopath],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print("Could not read frame timestamps: {}".format(e))
+        return np.zeros(0)
+
+    times = []
+    for line in result.stdout.splitlines():
+        try:
+            times.append(float(line.strip().strip(",")))
+        except ValueError:
+            # N/A for packets without timestamp
+            pass
+
+    # Packets are listed in decode order
+    times = np.sort(np.array(times, dtype=np.float64))
+    if len(times):
+        times -= times[0]
+    return times
+
+
+class VideoInfo:
+    """Metadata of a video file, probed with a single open
+
+    Attributes:
+        videopath (string): Path to the video file
+        width (int): Frame width in pixels
+        height (int): Frame height in pixels
+        fps (float): Nominal frame rate
+        num_frames (int): Frame count reported by the container
+        duration (float): num_frames / fps in seconds
+    """
+    def __init__(self, videopath):
+        self.videopath = videopath
+
+        cap = cv2.VideoCapture(videopath)
+        self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        self.duration = self.num_frames / self.fps if self.fps else 0
+        self.frame_times = None
+        self.lock = threading.Lock()
+
+    def get_frame_times(self):
+        """Get the presentation time of each frame, probing the file on first use
+
+        Without ffprobe the frames are assumed to be spaced evenly at the nominal frame rate.
+
+        Returns:
+            np.ndarray: Frame times in seconds relative to the first frame
+        """
+        with self.lock:
+            if self.frame_times is None:
+                times = probe_frame_times(self.videopath)
+                if len(times) == 0 and self.fps:
+                    times = np.arange(self.num_frames) / self.fps
+                self.frame_times = times
+            return self.frame_times
+
+    def is_variable_frame_rate(self, tolerance = 0.1, min_fraction = 0.05, max_drift = 1.5):
+        """Check whether the frame times deviate from the nominal frame rate for more than a glitch
+
+        A single dropped or duplicated timestamp changes one interval and shifts the
+        later frames by one interval, which the nominal frame grid still handles.
+
+        Args:
+            tolerance (float, optional): Allowed deviation of an interval as fraction of the nominal frame interval. Defaults to 0.1.
+            min_fraction (float, optional): Fraction of deviating intervals that makes a clip variable. Defaults to 0.05.
+            max_drift (float, optional): Allowed distance of the frame times from n / fps in frame intervals. Defaults to 1.5.
+
+        Returns:
+            bool: True for variable frame rate clips
+        """
+        times = self.get_frame_times()
+        if len(times) < 2 or not self.fps:
+            return False
+
+        deviating = np.abs(np.diff(times) * self.fps - 1) > tolerance
+        drift = times * self.fps - np.arange(len(times))
+        return bool(np.mean(deviating) > min_fraction or np.max(np.abs(drift)) > max_drift)
+
+
+video_info_cache = {}
+video_info_cache_lock = threading.Lock()
+
+
+def probe_video(videopath):
+    """Get the VideoInfo of a file, reusing earlier probes of the same unmodified file
+
+    The GUI, the gyro extractors and the stabilizers all need the frame size, rate
+    and count, and opening a container initializes a decoder each time.
+
+    Args:
+        videopath (string): Path to the video file
+
+    Returns:
+        VideoInfo: Probed metadata
+    """
+    stat = os.stat(videopath)
+    key = (os.path.abspath(videopath), stat.st_mtime_ns, stat.st_size)
+
+    with video_info_cache_lock:
+        info = video_info_cache.get(key)
+    if info is not None:
+        return info
+
+    info = VideoInfo(videopath)
+    with video_info_cache_lock:
+        # Drop probes of older versions of the file
+        for old_key in [k for k in video_info_cache if k[0] == key[0]]:
+            del video_info_cache[old_key]
+        video_info_cache[key] = info
+    return info